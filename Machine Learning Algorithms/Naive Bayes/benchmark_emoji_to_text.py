@@ -0,0 +1,58 @@
+"""
+Microbenchmark of emoji_to_text on the crowdsourced corpus.
+
+Compares the single-pass emoticon replacement (with the demojize fast path) against the original
+implementation, which always ran demojize and then applied each emoticon pattern in turn, and checks
+that both give the same output for every text.
+
+Usage:
+    python benchmark_emoji_to_text.py
+    python benchmark_emoji_to_text.py --dataset data/jerbarnes_dataset.csv --repeat 10
+"""
+import argparse
+import time
+from pathlib import Path
+import pandas as pd
+
+import preprocessor # preprocessor.py
+
+
+DATA_DIR = Path('./data') # All datasets are contained within this path
+
+def emoji_to_text_sequential(text):
+    """The original emoji_to_text: demojize followed by one re.sub per emoticon pattern."""
+    return preprocessor.replace_emoticons_sequentially(preprocessor.demojize(text))
+
+def time_function(function, texts, repeat):
+    """Returns the best time (in seconds) out of `repeat` runs of `function` over all texts."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in texts:
+            function(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark emoji_to_text against the original pattern-by-pattern implementation.")
+    parser.add_argument('--dataset', default=DATA_DIR/'crowdsourced_dataset.csv', help="Headerless CSV dataset with 'label' and 'text' columns")
+    parser.add_argument('--repeat', type=int, default=5, help="Number of timed runs (the best one is reported)")
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.dataset, header=None, names=['label', 'text'], usecols=[0, 1])
+    texts = df['text'].dropna().astype(str).tolist()
+
+    mismatches = [text for text in texts if preprocessor.emoji_to_text(text) != emoji_to_text_sequential(text)]
+    if mismatches:
+        raise SystemExit(f"{len(mismatches)} texts differ between the two implementations, e.g. {mismatches[0]!r}")
+
+    sequential = time_function(emoji_to_text_sequential, texts, args.repeat)
+    single_pass = time_function(preprocessor.emoji_to_text, texts, args.repeat)
+
+    print(f"{len(texts)} texts, identical output")
+    print(f"Sequential:  {sequential * 1000:8.2f} ms ({sequential / len(texts) * 1e6:.2f} µs/text)")
+    print(f"Single pass: {single_pass * 1000:8.2f} ms ({single_pass / len(texts) * 1e6:.2f} µs/text)")
+    print(f"Speedup:     {sequential / single_pass:8.2f}x")
+
+if __name__ == '__main__':
+    main()
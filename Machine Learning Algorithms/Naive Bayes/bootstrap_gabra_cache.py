@@ -0,0 +1,135 @@
+"""
+Pre-populates the persistent Gabra cache with the normalizations and lemmas already contained in
+the preprocessed datasets, so that preprocessing in-domain text needs almost no Gabra requests.
+
+Each raw text is re-tokenized (without normalization or lemmatization) and aligned token by token
+with its '_lowercased_no_lemmatization' and '_lowercased_lemmatized' variants, giving a
+surface form -> normalized form -> lemma triple for every token. Rows whose token counts differ
+are skipped, as are words that were resolved inconsistently across the datasets.
+
+Usage:
+    python bootstrap_gabra_cache.py
+    python bootstrap_gabra_cache.py --cache gabra_cache.sqlite3 --datasets jerbarnes_dataset crowdsourced_dataset
+"""
+import argparse
+from collections import Counter, defaultdict
+from pathlib import Path
+import pandas as pd
+
+import preprocessor # preprocessor.py
+
+
+DATA_DIR = Path('./data') # All datasets are contained within this path
+
+SOURCE = 'bootstrap' # Source recorded on the bootstrapped resolutions
+
+def read_dataset(path):
+    """Reads a headerless CSV dataset with 'label', 'text' and 'processed_text' columns."""
+    return pd.read_csv(path, header=None, names=['label', 'text', 'processed_text'])
+
+def is_resolvable(token):
+    """Whether resolve_word would look the token up (the same skip rules as get_lemma)."""
+    return len(token) >= 2 and token.isalnum() and token == token.lower()
+
+def align_dataset(dataset, tokenizer, normalizations, lemmas):
+    """
+    Collects the surface -> normalized and normalized -> lemma pairs of one dataset.
+
+    Args:
+        dataset: Name of the dataset (e.g. 'jerbarnes_dataset')
+        tokenizer: MalteseTokenizer with full lowercasing, used to re-tokenize the raw texts
+        normalizations: Counters of normalized forms per surface form, updated in place
+        lemmas: Counters of lemmas per normalized form, updated in place
+
+    Returns:
+        tuple: (number of aligned rows, number of skipped rows)
+    """
+    normalized_df = read_dataset(DATA_DIR/f'{dataset}_lowercased_no_lemmatization.csv')
+    lemmatized_df = read_dataset(DATA_DIR/f'{dataset}_lowercased_lemmatized.csv')
+
+    aligned, skipped = 0, 0
+    for text, normalized_text, lemmatized_text, lemmatized_source in zip(
+            normalized_df['text'], normalized_df['processed_text'], lemmatized_df['processed_text'], lemmatized_df['text']):
+        # Both variants must describe the same raw text
+        if not isinstance(text, str) or text != lemmatized_source or not isinstance(normalized_text, str) or not isinstance(lemmatized_text, str):
+            skipped += 1
+            continue
+
+        surface_tokens = tokenizer.pre_tokenize(text)
+        normalized_tokens = normalized_text.split()
+        lemmatized_tokens = lemmatized_text.split()
+        if not len(surface_tokens) == len(normalized_tokens) == len(lemmatized_tokens):
+            skipped += 1
+            continue
+
+        for surface, normalized, lemma in zip(surface_tokens, normalized_tokens, lemmatized_tokens):
+            if not is_resolvable(normalized):
+                continue
+            lemmas[normalized][lemma] += 1
+            # 'hemm' is never normalized (see normalize_word), but 'Hemm' is, so its record can't be inferred
+            if is_resolvable(surface) and surface != 'hemm':
+                normalizations[surface][normalized] += 1
+        aligned += 1
+
+    return aligned, skipped
+
+def build_resolutions(normalizations, lemmas):
+    """
+    Turns the collected pairs into resolution records, dropping words resolved inconsistently.
+
+    Returns:
+        tuple: (records keyed by surface form for normalize+lemmatise lookups,
+                records keyed by normalized form for lemmatise lookups,
+                number of inconsistent words)
+    """
+    conflicts = 0
+
+    lemma_records = {}
+    for normalized, counts in lemmas.items():
+        if len(counts) > 1:
+            conflicts += 1
+            continue
+        lemma = next(iter(counts))
+        lemma_records[normalized] = preprocessor.WordResolution(None, None if lemma == normalized else lemma, SOURCE)
+
+    full_records = {}
+    for surface, counts in normalizations.items():
+        if len(counts) > 1:
+            conflicts += 1
+            continue
+        normalized = next(iter(counts))
+        if normalized not in lemma_records:
+            continue
+        full_records[surface] = preprocessor.WordResolution(
+            None if normalized == surface else normalized, lemma_records[normalized].lemma, SOURCE)
+
+    return full_records, lemma_records, conflicts
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-populate the Gabra cache from the preprocessed datasets.")
+    parser.add_argument('--cache', default=None, help="SQLite cache to populate (defaults to the cache used by preprocessor.py)")
+    parser.add_argument('--datasets', nargs='*', default=['jerbarnes_dataset', 'crowdsourced_dataset'],
+                        help="Datasets with '_lowercased_no_lemmatization' and '_lowercased_lemmatized' variants")
+    args = parser.parse_args()
+
+    cache = preprocessor.configure_gabra_cache(args.cache) if args.cache else preprocessor.get_gabra_cache()
+    if cache is None:
+        print("Persistent Gabra caching is disabled, nothing to populate")
+        return
+
+    tokenizer = preprocessor.MalteseTokenizer(case_folding_type=2, lemmatize=False)
+    normalizations, lemmas = defaultdict(Counter), defaultdict(Counter)
+    for dataset in args.datasets:
+        aligned, skipped = align_dataset(dataset, tokenizer, normalizations, lemmas)
+        print(f"Aligned {aligned} rows of {dataset} ({skipped} skipped)")
+
+    full_records, lemma_records, conflicts = build_resolutions(normalizations, lemmas)
+    print(f"Found {len(full_records)} surface forms and {len(lemma_records)} normalized forms ({conflicts} inconsistent words dropped)")
+
+    # Resolutions already obtained from Gabra are kept
+    added = cache.add_resolutions('normalize+lemmatise', full_records)
+    added += cache.add_resolutions('lemmatise', lemma_records)
+    print(f"Added {added} resolutions to the Gabra cache: {cache.stats()}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+import argparse
+from pathlib import Path
+import pandas as pd
+
+import preprocessor # preprocessor.py
+
+
+DATA_DIR = Path('./data') # All datasets are contained within this path
+
+def collect_vocabulary(datasets):
+    """
+    Tokenizes the 'text' column of each dataset (without normalization or lemmatization)
+    and returns the set of lowercased tokens.
+
+    Args:
+        datasets: Paths of headerless CSV datasets with 'label' and 'text' columns
+    """
+    tokenizer = preprocessor.MalteseTokenizer(case_folding_type=2, lemmatize=False)
+    vocabulary = set()
+
+    for dataset in datasets:
+        df = pd.read_csv(dataset, header=None, names=['label', 'text'], usecols=[0, 1])
+        for text in df['text'].dropna():
+            vocabulary.update(tokenizer.pre_tokenize(text))
+        print(f"Collected tokens from {dataset} ({len(vocabulary)} unique so far)")
+
+    return vocabulary
+
+def main():
+    parser = argparse.ArgumentParser(description="Build an offline Gabra lexicon snapshot for MalteseTokenizer.")
+    parser.add_argument('--output', default='gabra_lexicon.bin', help="Path of the snapshot file to write")
+    parser.add_argument('--datasets', nargs='*', default=[DATA_DIR/'jerbarnes_dataset.csv', DATA_DIR/'crowdsourced_dataset.csv'],
+                        help="Raw datasets whose vocabulary should be included")
+    parser.add_argument('--words', nargs='*', default=[], help="Extra word list files (one word per line)")
+    args = parser.parse_args()
+
+    vocabulary = collect_vocabulary(args.datasets)
+    for word_list in args.words:
+        with open(word_list, 'r', encoding='utf-8') as f:
+            vocabulary.update(line.strip() for line in f if line.strip())
+
+    # Lookups go through the persistent Gabra cache, so re-building a snapshot is cheap
+    snapshot = preprocessor.build_lexicon_snapshot(args.output, vocabulary)
+    print(f"Saved {len(snapshot)} entries to {args.output}")
+    print(f"Gabra cache: {preprocessor.get_gabra_cache().stats()}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+import argparse
+from collections import Counter
+from pathlib import Path
+import pandas as pd
+
+import preprocessor # preprocessor.py
+
+
+DATA_DIR = Path('./data') # All datasets are contained within this path
+
+def count_frequencies(datasets):
+    """
+    Counts token frequencies in the 'processed_text' column of normalized (non-lemmatized) datasets.
+
+    Args:
+        datasets: Paths of headerless CSV datasets with 'label', 'text' and 'processed_text' columns
+    """
+    frequencies = Counter()
+    for dataset in datasets:
+        df = pd.read_csv(dataset, header=None, names=['label', 'text', 'processed_text'])
+        for processed_text in df['processed_text'].dropna():
+            frequencies.update(processed_text.split())
+    return frequencies
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a word list of Gabra-confirmed Maltese wordforms for offline diacritic restoration.")
+    parser.add_argument('--output', default='maltese_wordlist.tsv', help="Path of the word list to write")
+    parser.add_argument('--lexicon', default=None, help="Optional lexicon snapshot whose normalized forms and lemmas are included")
+    parser.add_argument('--datasets', nargs='*',
+                        default=[DATA_DIR/'jerbarnes_dataset_lowercased_no_lemmatization.csv', DATA_DIR/'crowdsourced_dataset_lowercased_no_lemmatization.csv'],
+                        help="Normalized datasets used to rank words that share the same plain spelling")
+    args = parser.parse_args()
+
+    # Only spellings returned by Gabra are included, so that unresolved misspellings never become targets
+    words = {word.lower() for word in preprocessor.get_gabra_cache().known_wordforms()}
+    if args.lexicon:
+        for _, normalized, lemma in preprocessor.LexiconSnapshot(args.lexicon).entries():
+            words.update(word.lower() for word in (normalized, lemma) if word)
+
+    frequencies = count_frequencies(args.datasets)
+    ranked = sorted(words, key=lambda word: (-frequencies[word], word))
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        for word in ranked:
+            f.write(f"{word}\t{frequencies[word]}\n")
+    print(f"Saved {len(ranked)} words to {args.output}")
+
+if __name__ == '__main__':
+    main()
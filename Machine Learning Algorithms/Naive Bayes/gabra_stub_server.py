@@ -0,0 +1,206 @@
+"""
+Local stand-in for the MLRS Gabra and tagger APIs, serving recorded responses from a fixture file.
+
+Used to benchmark and test the preprocessing pipeline reproducibly without network access. Latency,
+server errors and rate limiting can be injected to exercise the caching, batching and retry logic.
+
+Usage:
+    # Record fixtures from the persistent Gabra cache filled by earlier preprocessing runs
+    python gabra_stub_server.py record --cache gabra_cache.sqlite3 --output gabra_fixtures.json
+
+    # Serve them (point preprocessor.py at the server with GABRA_API_URL and MLRS_API_URL)
+    python gabra_stub_server.py serve --fixtures gabra_fixtures.json --port 8001 --latency 50 --error-rate 0.05
+    GABRA_API_URL=http://localhost:8001 MLRS_API_URL=http://localhost:8001 GABRA_CACHE_PATH=bench_cache.sqlite3 jupyter notebook
+"""
+import argparse
+import json
+import random
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+# Endpoints served by the stand-in, with the query parameter holding the searched word or text
+ENDPOINTS = {
+    'wordforms/search_suggest': 's',
+    'lexemes/search_suggest': 's',
+    'lexemes/lemmatise': 's',
+    'tag': 'text',
+}
+
+# Response returned for queries missing from the fixtures (the real APIs return empty results)
+EMPTY_RESPONSES = {
+    'wordforms/search_suggest': {'results': []},
+    'lexemes/search_suggest': {'results': []},
+    'lexemes/lemmatise': {'results': []},
+    'tag': {'result': []},
+}
+
+def record_fixtures(cache_path, output_path):
+    """
+    Export the responses stored in a persistent Gabra cache as a fixture file.
+
+    Args:
+        cache_path: Path to the SQLite cache written by preprocessor.GabraCache
+        output_path: Path of the JSON fixture file to write
+    """
+    fixtures = {endpoint: {} for endpoint in ENDPOINTS}
+
+    with sqlite3.connect(cache_path) as conn:
+        for endpoint, word, data in conn.execute("SELECT endpoint, word, data FROM responses"):
+            if endpoint in fixtures:
+                fixtures[endpoint][word] = json.loads(data)
+
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(fixtures, f, ensure_ascii=False)
+
+    counts = ', '.join(f"{endpoint}: {len(responses)}" for endpoint, responses in fixtures.items())
+    print(f"Saved fixtures to {output_path} ({counts})")
+
+class RateLimiter:
+    """
+    Token bucket allowing a sustained number of requests per second, with bursts up to the same amount.
+    """
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+class GabraStubServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server replaying fixtures, with optional latency, error and rate limit injection.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, fixtures, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit=None, missing_status=200, seed=None):
+        super().__init__(address, GabraStubHandler)
+        self.fixtures = fixtures
+        self.latency = latency # Seconds added to every response
+        self.jitter = jitter # Maximum random seconds added on top of the latency
+        self.error_rate = error_rate # Fraction of requests answered with a 500 error
+        self.rate_limiter = RateLimiter(rate_limit) if rate_limit else None
+        self.missing_status = missing_status # Status returned for queries missing from the fixtures
+
+        self.random = random.Random(seed)
+        self.stats_lock = threading.Lock()
+        self.stats = {'requests': 0, 'hits': 0, 'misses': 0, 'errors': 0, 'rate_limited': 0}
+
+    def count(self, key):
+        with self.stats_lock:
+            self.stats[key] += 1
+
+class GabraStubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        endpoint = url.path.strip('/')
+
+        if endpoint == '_stats':
+            return self._send_json(200, server.stats)
+        if endpoint not in ENDPOINTS:
+            return self._send_json(404, {'error': f"Unknown endpoint '{endpoint}'"})
+
+        server.count('requests')
+
+        if server.rate_limiter and not server.rate_limiter.allow():
+            server.count('rate_limited')
+            return self._send_json(429, {'error': 'Too many requests'})
+
+        delay = server.latency + server.random.uniform(0, server.jitter)
+        if delay:
+            time.sleep(delay)
+
+        if server.random.random() < server.error_rate:
+            server.count('errors')
+            return self._send_json(500, {'error': 'Injected server error'})
+
+        query = parse_qs(url.query).get(ENDPOINTS[endpoint], [''])[0]
+        responses = server.fixtures.get(endpoint, {})
+        if query in responses:
+            server.count('hits')
+            return self._send_json(200, responses[query])
+
+        server.count('misses')
+        if server.missing_status != 200:
+            return self._send_json(server.missing_status, {'error': 'No fixture for query'})
+        return self._send_json(200, EMPTY_RESPONSES[endpoint])
+
+    def _send_json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # Keep benchmark output readable
+
+def serve(fixtures_path, host='localhost', port=8001, **options):
+    """
+    Serve a fixture file until interrupted.
+
+    Args:
+        fixtures_path: Path of the JSON fixture file, or None to serve empty results only
+        host: Host to bind to
+        port: Port to listen on
+        options: Fault injection options passed to GabraStubServer
+    """
+    fixtures = {}
+    if fixtures_path:
+        with open(fixtures_path, 'r', encoding='utf-8') as f:
+            fixtures = json.load(f)
+
+    server = GabraStubServer((host, port), fixtures, **options)
+    print(f"Serving Gabra stand-in on http://{host}:{port} (statistics at /_stats)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Statistics: {server.stats}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the MLRS Gabra and tagger APIs.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    record_parser = subparsers.add_parser('record', help="Export fixtures from a persistent Gabra cache")
+    record_parser.add_argument('--cache', default='gabra_cache.sqlite3', help="SQLite cache written by preprocessor.py")
+    record_parser.add_argument('--output', default='gabra_fixtures.json', help="Fixture file to write")
+
+    serve_parser = subparsers.add_parser('serve', help="Serve recorded fixtures")
+    serve_parser.add_argument('--fixtures', default='gabra_fixtures.json', help="Fixture file to serve")
+    serve_parser.add_argument('--host', default='localhost')
+    serve_parser.add_argument('--port', type=int, default=8001)
+    serve_parser.add_argument('--latency', type=float, default=0.0, help="Milliseconds added to every response")
+    serve_parser.add_argument('--jitter', type=float, default=0.0, help="Maximum random milliseconds added on top of the latency")
+    serve_parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests answered with a 500 error")
+    serve_parser.add_argument('--rate-limit', type=float, default=None, help="Requests per second allowed before answering 429")
+    serve_parser.add_argument('--missing-status', type=int, default=200, help="Status for queries without a fixture (200 serves empty results)")
+    serve_parser.add_argument('--seed', type=int, default=None, help="Random seed for reproducible jitter and errors")
+
+    args = parser.parse_args()
+    if args.command == 'record':
+        record_fixtures(args.cache, args.output)
+    else:
+        serve(args.fixtures, host=args.host, port=args.port,
+              latency=args.latency / 1000, jitter=args.jitter / 1000, error_rate=args.error_rate,
+              rate_limit=args.rate_limit, missing_status=args.missing_status, seed=args.seed)
+
+if __name__ == '__main__':
+    main()
@@ -1,34 +1,74 @@
-from emoji import demojize
+from emoji import demojize, EMOJI_DATA
 import malti.tokeniser
 import requests
+from requests.adapters import HTTPAdapter
+from urllib.parse import quote_plus
+from concurrent.futures import ThreadPoolExecutor
 import time
+import random
+import sqlite3
+import threading
+import mmap
+import struct
+import hashlib
+import pickle
+import math
+from array import array
 from functools import lru_cache
-from collections import OrderedDict
+from itertools import islice
+from collections import Counter, OrderedDict, deque, namedtuple
 from abc import ABC, abstractmethod
 import json
 import os
 from langid.langid import LanguageIdentifier, model
+import numpy as np
 from sklearn.base import BaseEstimator, TransformerMixin
 import pandas as pd
 import re
 from emoji import demojize
 
+# Base URLs of the MLRS APIs (can be pointed at a local stand-in, e.g. gabra_stub_server.py in the Naive Bayes folder)
+MLRS_API_URL = os.environ.get('MLRS_API_URL', "https://mlrs.research.um.edu.mt/tools/mlrsapi")
+GABRA_API_URL = os.environ.get('GABRA_API_URL', "https://mlrs.research.um.edu.mt/resources/gabra-api")
+
 # =============
 # Model Loading
 # =============
 
 # MalteseTokenizer without Maltese language filtering
 class MalteseTokenizer:
-    def __init__(self, case_folding_type=2, lemmatize=True):
+    def __init__(self, case_folding_type=2, lemmatize=True, lexicon_path=None, normalizer_path=None):
         if case_folding_type not in {0, 1, 2}:
             raise ValueError("Invalid case folding method. Choose from 0 (no change), 1 (lowercase everything except fully-uppercase words), 2 (full lowercasing)")
         self.case_folding_type = case_folding_type
         self.lemmatize = lemmatize
+        # Optional LexiconSnapshot file to use instead of the Gabra API (defaults to the GABRA_LEXICON_PATH environment variable)
+        self.lexicon_path = lexicon_path
+        # Optional word list file for offline diacritic restoration instead of Gabra's Search Suggest API
+        # (defaults to the MALTESE_WORDLIST_PATH environment variable)
+        self.normalizer_path = normalizer_path
 
         self.cleaner = TextCleaner(input_dir=None, output_dir=None)
-        self.anonymizer = TextAnonymizer(input_dir=None, output_dir=None, names_dir='./names')
-        
-    def __call__(self, text):
+        self.anonymizer = TextAnonymizer(input_dir=None, output_dir=None)
+
+    @property
+    def lexicon(self):
+        # Tokenizers unpickled from older models have no lexicon_path attribute
+        path = getattr(self, 'lexicon_path', None) or os.environ.get('GABRA_LEXICON_PATH')
+        return load_lexicon_snapshot(path) if path else None
+
+    @property
+    def normalizer(self):
+        path = getattr(self, 'normalizer_path', None) or os.environ.get('MALTESE_WORDLIST_PATH')
+        return load_diacritic_normalizer(path) if path else None
+
+    def pre_tokenize(self, text):
+        """
+        Apply all preprocessing steps up to (but excluding) Gabra normalization and lemmatization.
+
+        Args:
+            text: Raw input text
+        """
         # Apply the same initial cleaning steps used in the Facebook Scraper dataset
         text = self.cleaner.clean_text(text)
         text = self.anonymizer.anonymize_text(text)
@@ -37,14 +77,31 @@ class MalteseTokenizer:
         text = emoji_to_text(text)
         tokens = tokenise(text)
         tokens = clean_tokens(tokens)
-        if self.case_folding_type == 1:
-            tokens = selective_lowercase(tokens)
-        elif self.case_folding_type == 2:
-            tokens = lowercase(tokens)
-        tokens = [normalize_word(token) for token in tokens]
-        if self.lemmatize:
-            tokens = [get_lemma(token) for token in tokens]
-        return tokens
+        return fold_case(tokens, self.case_folding_type)
+        
+    def __call__(self, text):
+        return self.tokenize_batch([text])[0]
+
+    def tokenize_batch(self, texts, max_workers=None):
+        """
+        Tokenize several texts, looking up each distinct token only once across the whole batch.
+
+        Works in three passes: the texts are first tokenized into a shared vocabulary table,
+        then each vocabulary item is resolved once (see resolve_record), and finally every text
+        is rewritten through its array of token ids.
+
+        Args:
+            texts: Iterable of raw input texts
+            max_workers: Maximum number of concurrent Gabra lookups (defaults to GABRA_MAX_WORKERS)
+
+        Returns:
+            List of token lists, one per text
+        """
+        corpus = TokenizedCorpus(self.pre_tokenize(text) for text in texts)
+        resolver = TokenResolver(lexicon=self.lexicon, normalizer=self.normalizer, max_workers=max_workers)
+
+        resolved = resolver.resolve(corpus.vocabulary, lemmatize=self.lemmatize)
+        return corpus.rewrite([lemma if self.lemmatize else normalized for normalized, lemma in resolved])
 
 
 class MalteseTextPreprocessor(BaseEstimator, TransformerMixin):
@@ -63,8 +120,7 @@ class MalteseTextPreprocessor(BaseEstimator, TransformerMixin):
 
     def transform(self, X, y=None):
         processed_X = []
-        for raw_text in X: # X is an iterable of raw text strings
-            tokens = self.tokenizer_(raw_text) 
+        for tokens in self.tokenizer_.tokenize_batch(X): # X is an iterable of raw text strings
             processed_X.append(' '.join(tokens) if tokens else "")
         return pd.Series(processed_X) # Output a Series for the next pipeline step
 
@@ -72,6 +128,102 @@ class MalteseTextPreprocessor(BaseEstimator, TransformerMixin):
 # Text Preprocessing
 # ==================
 
+# Emoticon patterns with their text equivalents, in order of precedence
+EMOTICON_PATTERNS = {
+    # Happy/Positive
+    r":\)+": ":smile:",
+    r":-\)+": ":smile:",
+    r":D+": ":big smile:",
+    r":-D+": ":big smile:",
+    r"=\)+": ":smile:",
+    r"=D+": ":big smile:",
+    r"<3+": ":heart:",
+    r":\*+": ":kiss:",
+    r":-\*+": ":kiss:",
+    r";\)+": ":wink:",
+    r";-\)+": ":wink:",
+    r":P+": ":tongue:",
+    r":-P+": ":tongue:",
+    r":p+": ":tongue:",
+    r"=P+": ":tongue:",
+    r":-p+": ":tongue:",
+    r"x[Dd]+": ":laughing:",
+    r"X[Dd]+": ":laughing:",
+    
+    # Sad/Negative
+    r":\(+": ":sad:",
+    r":-\(+": ":sad:",
+    r"D:+": ":sad:",
+    r":/+": ":skeptical:",
+    r":\\+": ":skeptical:",
+    r":\|+": ":neutral:",
+    r":-\|+": ":neutral:",
+    r":O+": ":surprised:",
+    r":o+": ":surprised:",
+    r":'-\(+": ":crying:",
+    r"-_-+": ":annoyed:",
+}
+
+# All patterns as one alternation (one group per pattern), matched in a single left-to-right pass.
+# No two patterns can match at the same position, so the alternation order doesn't matter.
+# The lookahead on the patterns' first characters (all literals) lets the regex engine skip ahead to
+# candidate positions instead of trying every alternative at every character.
+EMOTICON_START_CHARACTERS = "".join(sorted({pattern[0] for pattern in EMOTICON_PATTERNS}))
+EMOTICON_REGEX = re.compile(f"(?=[{re.escape(EMOTICON_START_CHARACTERS)}])(?:"
+                            + "|".join(f"({pattern})" for pattern in EMOTICON_PATTERNS) + ")")
+EMOTICON_REPLACEMENTS = list(EMOTICON_PATTERNS.values())
+
+# Each pattern compiled on its own, for the pattern-by-pattern fallback
+_emoticon_regexes = [(re.compile(pattern), replacement) for pattern, replacement in EMOTICON_PATTERNS.items()]
+
+# Every character that can be part of an emoticon
+EMOTICON_CHARACTERS = frozenset(":;=<3*-_()/\\|'DdPpOoXx")
+
+# Every non-ASCII character found in an emoji (all emojis contain at least one)
+EMOJI_CHARACTERS = frozenset(character for e in EMOJI_DATA for character in e if not character.isascii())
+
+def replace_emoticons_sequentially(text):
+    """
+    Replaces emoticons by applying each pattern of EMOTICON_PATTERNS to the whole text in turn.
+
+    This is the original implementation of emoji_to_text's emoticon replacement, which replace_emoticons
+    falls back to. A pattern can match text produced by an earlier replacement here
+    (e.g. 'D:)' -> 'D:smile:' -> ':sad:smile:').
+
+    Args:
+        text: The text containing emoticons
+    """
+    for regex, replacement in _emoticon_regexes:
+        text = regex.sub(replacement, text)
+    return text
+
+def replace_emoticons(text):
+    """
+    Replaces emoticons with their text equivalents in a single pass, giving the same result as
+    replace_emoticons_sequentially.
+
+    The two only differ when an emoticon runs into other emoticon characters (e.g. ':):)' or 'D:)'),
+    in which case the text is handed to replace_emoticons_sequentially instead.
+
+    Args:
+        text: The text containing emoticons
+    """
+    parts = []
+    last_end = 0
+    for match in EMOTICON_REGEX.finditer(text):
+        start, end = match.span()
+        if (start > 0 and text[start - 1] in EMOTICON_CHARACTERS) or (end < len(text) and text[end] in EMOTICON_CHARACTERS):
+            return replace_emoticons_sequentially(text)
+
+        parts.append(text[last_end:start])
+        parts.append(EMOTICON_REPLACEMENTS[match.lastindex - 1])
+        last_end = end
+
+    if not parts:
+        return text
+    parts.append(text[last_end:])
+    return "".join(parts)
+
 def emoji_to_text(text):
     """
     Replaces emojis and common emoticons in a string with their text equivalents.
@@ -82,50 +234,12 @@ def emoji_to_text(text):
     """
     result = text
 
-    # Replace emojis
-    result = demojize(result)
-
-    # Define emoticon patterns with regex
-    emoticon_patterns = {
-        # Happy/Positive
-        r":\)+": ":smile:",
-        r":-\)+": ":smile:",
-        r":D+": ":big smile:",
-        r":-D+": ":big smile:",
-        r"=\)+": ":smile:",
-        r"=D+": ":big smile:",
-        r"<3+": ":heart:",
-        r":\*+": ":kiss:",
-        r":-\*+": ":kiss:",
-        r";\)+": ":wink:",
-        r";-\)+": ":wink:",
-        r":P+": ":tongue:",
-        r":-P+": ":tongue:",
-        r":p+": ":tongue:",
-        r"=P+": ":tongue:",
-        r":-p+": ":tongue:",
-        r"x[Dd]+": ":laughing:",
-        r"X[Dd]+": ":laughing:",
-        
-        # Sad/Negative
-        r":\(+": ":sad:",
-        r":-\(+": ":sad:",
-        r"D:+": ":sad:",
-        r":/+": ":skeptical:",
-        r":\\+": ":skeptical:",
-        r":\|+": ":neutral:",
-        r":-\|+": ":neutral:",
-        r":O+": ":surprised:",
-        r":o+": ":surprised:",
-        r":'-\(+": ":crying:",
-        r"-_-+": ":annoyed:",
-    }
-    
-    # Replace each emoticon pattern with its text equivalent
-    for pattern, replacement in emoticon_patterns.items():
-        result = re.sub(pattern, replacement, result)
-        
-    return result
+    # Replace emojis (skipped for texts without any emoji characters, which demojize would leave unchanged)
+    if not result.isascii() and not EMOJI_CHARACTERS.isdisjoint(result):
+        result = demojize(result)
+
+    # Replace each emoticon with its text equivalent
+    return replace_emoticons(result)
 
 # ===============================
 # Tokenisation & Token Processing
@@ -238,113 +352,588 @@ def selective_lowercase(tokens):
     return [token if token.isupper() or (token.startswith('[') and token.endswith(']')) 
             else token.lower() for token in tokens]
 
+def fold_case(tokens, case_folding_type):
+    """
+    Applies one of the MalteseTokenizer case folding methods to a list of tokens.
+
+    Args:
+        tokens: The list of tokens to case fold
+        case_folding_type: 0 (no change), 1 (selective lowercasing) or 2 (full lowercasing)
+    """
+    if case_folding_type == 1:
+        return selective_lowercase(tokens)
+    elif case_folding_type == 2:
+        return lowercase(tokens)
+    return list(tokens)
+
 def tokenise_with_pos_tag(text):
     """
     Tokenises and POS-tags a Maltese text using the MLRS API.
+
+    Results are cached persistently, and long texts are tagged in several requests (see tag_texts).
     
     Args:
         text: The text to tokenize and tag with parts of speech
     """
-    url = "https://mlrs.research.um.edu.mt/tools/mlrsapi/tag"
-    
-    # Parameters for the GET request
-    params = {
-        'text': text
-    }
-
-    try:
-        # Make the GET request
-        response = requests.get(url, params=params)
-        
-        # Check if the request was successful
-        response.raise_for_status()
-        
-        # Get the JSON response and return the result
-        json_response = response.json()
-        return json_response['result']
-        
-    except requests.exceptions.RequestException as e:
-        print(f"An error occurred during POS tagging: {e}")
-        return None
+    return next(tag_texts([text]))
     
 # =============
 # Lemmatisation
 # =============
-    
-@lru_cache(maxsize=512)
-def make_request(url):
+
+# Default location of the persistent Gabra cache (can be overridden with the GABRA_CACHE_PATH environment variable)
+DEFAULT_GABRA_CACHE_PATH = os.environ.get(
+    'GABRA_CACHE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gabra_cache.sqlite3'))
+
+class GabraCache:
+    """
+    Persistent, process-safe cache for Gabra API responses, backed by SQLite.
+
+    Responses are keyed by endpoint (e.g. 'lexemes/lemmatise') and the lowercased surface form
+    that was searched for. Once the cache holds more than max_entries responses, the least
+    recently used ones are evicted. In offline mode, lookups that miss the cache never
+    touch the network.
+
+    Responses with no results and failed requests are cached negatively: they expire after
+    negative_ttl and error_ttl seconds respectively, so they are eventually retried.
+
+    The last use of an entry is only recorded once every TOUCH_INTERVAL seconds, so that lookups
+    in a warm cache don't write to it, and the size of a table is only counted every
+    EVICT_CHECK_INTERVAL inserts (or once the inserts since the last count may have filled it).
+    """
+    TOUCH_INTERVAL = 3600
+    EVICT_CHECK_INTERVAL = 1000
+
+    def __init__(self, path=DEFAULT_GABRA_CACHE_PATH, max_entries=200000, offline=False,
+                 negative_ttl=7 * 24 * 3600, error_ttl=300):
+        self.path = path
+        self.max_entries = max_entries
+        self.offline = offline
+        self.negative_ttl = negative_ttl
+        self.error_ttl = error_ttl
+
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.resolution_hits = 0
+        self.resolution_misses = 0
+        self.evictions = 0
+
+        self._local = threading.local() # SQLite connections cannot be shared between threads
+        self._lock = threading.Lock()
+        self._sizes = {} # Table -> (number of entries when last counted, inserts since)
+
+        with self._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    endpoint TEXT NOT NULL,
+                    word TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    last_used REAL NOT NULL,
+                    expires REAL,
+                    PRIMARY KEY (endpoint, word)
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+
+            # Caches created before negative caching was added have no expiry column
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(responses)")]
+            if 'expires' not in columns:
+                conn.execute("ALTER TABLE responses ADD COLUMN expires REAL")
+
+            # Combined normalization and lemmatization results (see resolve_record)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS resolutions (
+                    kind TEXT NOT NULL,
+                    word TEXT NOT NULL,
+                    normalized TEXT,
+                    lemma TEXT,
+                    source TEXT NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (kind, word)
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS resolutions_last_used ON resolutions (last_used)")
+
+    def _connection(self):
+        """Return this thread's connection to the cache database, opening it if needed."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL") # Allows concurrent readers while another process writes
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, endpoint, word):
+        """
+        Look up a cached response.
+
+        Args:
+            endpoint: Gabra API endpoint (e.g. 'wordforms/search_suggest')
+            word: The lowercased surface form that was searched for
+
+        Returns:
+            tuple: (found, data) where data is the decoded JSON response if found,
+            or None if the request is cached as failed
+        """
+        conn = self._connection()
+        row = conn.execute("SELECT data, expires, last_used FROM responses WHERE endpoint = ? AND word = ?",
+                           (endpoint, word)).fetchone()
+        now = time.time()
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return False, None
+            if row[1] is not None and row[1] <= now:
+                self.expired += 1
+                self.misses += 1
+                return False, None
+
+            data = json.loads(row[0])
+            if data is None or not (data.get("results") or data.get("result")):
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+
+        if now - row[2] >= self.TOUCH_INTERVAL:
+            with conn:
+                conn.execute("UPDATE responses SET last_used = ? WHERE endpoint = ? AND word = ?",
+                             (now, endpoint, word))
+        return True, data
+
+    def set(self, endpoint, word, data, ttl=None):
+        """
+        Store a response, evicting the least recently used entries if the cache is full.
+
+        Args:
+            endpoint: Gabra API endpoint (e.g. 'wordforms/search_suggest')
+            word: The lowercased surface form that was searched for
+            data: Decoded JSON response to store, or None to record a failed request
+            ttl: Seconds until the entry expires (defaults to error_ttl for failed requests,
+                 negative_ttl for responses without results, and never otherwise)
+        """
+        if ttl is None:
+            if data is None:
+                ttl = self.error_ttl
+            elif not (data.get("results") or data.get("result")):
+                ttl = self.negative_ttl
+
+        now = time.time()
+        expires = now + ttl if ttl is not None else None
+
+        conn = self._connection()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO responses (endpoint, word, data, last_used, expires) VALUES (?, ?, ?, ?, ?)",
+                         (endpoint, word, json.dumps(data, ensure_ascii=False), now, expires))
+
+            self._evict(conn, 'responses')
+
+    def _evict(self, conn, table, inserted=1):
+        """Evict the least recently used entries of a table if it holds more than max_entries."""
+        with self._lock:
+            # Count the table on the first insert, and then only every EVICT_CHECK_INTERVAL inserts
+            # (other processes' inserts are only seen when it is counted)
+            count, pending = self._sizes.get(table, (0, self.EVICT_CHECK_INTERVAL))
+            pending += inserted
+            if pending < self.EVICT_CHECK_INTERVAL and count + pending <= self.max_entries:
+                self._sizes[table] = (count, pending)
+                return
+
+        count = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        if count > self.max_entries:
+            # Evict down to 90% of the limit so that eviction doesn't run on every insert
+            excess = count - int(self.max_entries * 0.9)
+            conn.execute(f"""
+                DELETE FROM {table} WHERE rowid IN (
+                    SELECT rowid FROM {table} ORDER BY last_used LIMIT ?
+                )""", (excess,))
+            count -= excess
+            with self._lock:
+                self.evictions += excess
+        with self._lock:
+            self._sizes[table] = (count, 0)
+
+    def get_resolution(self, kind, word):
+        """
+        Look up a cached WordResolution.
+
+        Args:
+            kind: 'normalize+lemmatise', 'lemmatise' or 'normalize' (see resolve_record)
+            word: The lowercased surface form
+
+        Returns:
+            The cached WordResolution, or None if not cached
+        """
+        conn = self._connection()
+        row = conn.execute("SELECT normalized, lemma, source, last_used FROM resolutions WHERE kind = ? AND word = ?",
+                           (kind, word)).fetchone()
+        with self._lock:
+            if row is None:
+                self.resolution_misses += 1
+                return None
+            self.resolution_hits += 1
+
+        now = time.time()
+        if now - row[3] >= self.TOUCH_INTERVAL:
+            with conn:
+                conn.execute("UPDATE resolutions SET last_used = ? WHERE kind = ? AND word = ?",
+                             (now, kind, word))
+        return WordResolution(*row[:3])
+
+    def set_resolution(self, kind, word, resolution):
+        """
+        Store a WordResolution, evicting the least recently used ones if the cache is full.
+
+        Args:
+            kind: 'normalize+lemmatise', 'lemmatise' or 'normalize' (see resolve_record)
+            word: The lowercased surface form
+            resolution: The WordResolution to store
+        """
+        conn = self._connection()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO resolutions (kind, word, normalized, lemma, source, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                         (kind, word, *resolution, time.time()))
+            self._evict(conn, 'resolutions')
+
+    def add_resolutions(self, kind, resolutions):
+        """
+        Store several WordResolutions in one transaction, keeping any that are already cached.
+
+        Args:
+            kind: 'normalize+lemmatise', 'lemmatise' or 'normalize' (see resolve_record)
+            resolutions: Dictionary mapping lowercased surface forms to WordResolutions
+
+        Returns:
+            The number of resolutions added
+        """
+        conn = self._connection()
+        now = time.time()
+        with conn:
+            before = conn.total_changes
+            conn.executemany("INSERT OR IGNORE INTO resolutions (kind, word, normalized, lemma, source, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                             [(kind, word, *resolution, now) for word, resolution in resolutions.items()])
+            added = conn.total_changes - before
+            self._evict(conn, 'resolutions', added)
+        return added
+
+    def known_wordforms(self):
+        """
+        Yield every wordform and lemma spelling found in the cached responses.
+
+        These are spellings confirmed by Gabra, usable as a word list for DiacriticNormalizer.
+        """
+        conn = self._connection()
+        for (data,) in conn.execute("SELECT data FROM responses"):
+            data = json.loads(data)
+            for result in (data or {}).get("results") or []:
+                if "surface_form" in result.get("wordform", {}):
+                    yield result["wordform"]["surface_form"]
+                if "lemma" in result.get("lexeme", {}):
+                    yield result["lexeme"]["lemma"]
+
+    def clear(self):
+        """Remove all cached responses and resolutions."""
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM responses")
+            conn.execute("DELETE FROM resolutions")
+        with self._lock:
+            self._sizes.clear()
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def stats(self):
+        """Return hit/miss counters for this process and the current size of the cache."""
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            'hits': self.hits,
+            'negative_hits': self.negative_hits,
+            'misses': self.misses,
+            'expired': self.expired,
+            'hit_rate': (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+            'resolution_hits': self.resolution_hits,
+            'resolution_misses': self.resolution_misses,
+            'evictions': self.evictions,
+            'entries': len(self),
+            'resolutions': self._connection().execute("SELECT COUNT(*) FROM resolutions").fetchone()[0],
+            'offline': self.offline,
+        }
+
+    # Connections and locks cannot be pickled, so only the settings are kept
+    def __getstate__(self):
+        return {'path': self.path, 'max_entries': self.max_entries, 'offline': self.offline,
+                'negative_ttl': self.negative_ttl, 'error_ttl': self.error_ttl}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+_gabra_cache = None
+_gabra_cache_configured = False
+
+def configure_gabra_cache(path=DEFAULT_GABRA_CACHE_PATH, max_entries=200000, offline=False,
+                          negative_ttl=7 * 24 * 3600, error_ttl=300):
+    """
+    Configure the persistent cache used for all Gabra lookups.
+
+    Args:
+        path: Path to the SQLite database file, or None to disable persistent caching
+        max_entries: Maximum number of responses to keep before evicting the least recently used
+        offline: If True, lookups that miss the cache return no result instead of calling the API
+        negative_ttl: Seconds to remember that a word had no results
+        error_ttl: Seconds to remember that a request failed before retrying it
+    """
+    global _gabra_cache, _gabra_cache_configured
+    _gabra_cache = GabraCache(path, max_entries=max_entries, offline=offline,
+                              negative_ttl=negative_ttl, error_ttl=error_ttl) if path else None
+    _gabra_cache_configured = True
+    return _gabra_cache
+
+def get_gabra_cache():
+    """Return the persistent Gabra cache, creating the default one on first use."""
+    if not _gabra_cache_configured:
+        configure_gabra_cache(offline=os.environ.get('GABRA_OFFLINE') == '1')
+    return _gabra_cache
+
+class CircuitBreaker:
+    """
+    Stops calling a failing service for a while, so that lookups fail fast instead of stalling.
+
+    The breaker is closed while requests succeed. Once at least error_threshold of the last
+    window requests have failed, it opens and rejects all requests for reset_timeout seconds.
+    It then half-opens and lets a single trial request through: if it succeeds the breaker
+    closes again, otherwise it re-opens.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, window=20, error_threshold=0.5, reset_timeout=30):
+        self.window = window
+        self.error_threshold = error_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = self.CLOSED
+        self.opened_at = None
+        self.trial_in_progress = False
+        self.outcomes = deque(maxlen=window) # True for each recent success, False for each failure
+
+        self.metrics = {'successes': 0, 'failures': 0, 'rejected': 0,
+                        'opened': 0, 'half_opened': 0, 'closed': 0}
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        """Return whether a request may be made now."""
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    self.metrics['rejected'] += 1
+                    return False
+                self.state = self.HALF_OPEN
+                self.metrics['half_opened'] += 1
+
+            if self.state == self.HALF_OPEN:
+                if self.trial_in_progress:
+                    self.metrics['rejected'] += 1
+                    return False
+                self.trial_in_progress = True
+            return True
+
+    def is_open(self):
+        """Return whether requests are currently being rejected, without using up a half-open trial."""
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at < self.reset_timeout:
+                self.metrics['rejected'] += 1
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.metrics['successes'] += 1
+            self.outcomes.append(True)
+            if self.state == self.HALF_OPEN:
+                self.state = self.CLOSED
+                self.trial_in_progress = False
+                self.outcomes.clear()
+                self.metrics['closed'] += 1
+
+    def record_failure(self):
+        with self._lock:
+            self.metrics['failures'] += 1
+            self.outcomes.append(False)
+
+            if self.state == self.HALF_OPEN:
+                self._open()
+            elif (self.state == self.CLOSED and len(self.outcomes) == self.window and
+                  self.outcomes.count(False) / self.window >= self.error_threshold):
+                self._open()
+
+    def _open(self):
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self.trial_in_progress = False
+        self.metrics['opened'] += 1
+
+    def stats(self):
+        """Return the current state and the counters for each state transition."""
+        with self._lock:
+            return {'state': self.state, **self.metrics}
+
+# Shared by all Gabra requests in this process
+gabra_circuit_breaker = CircuitBreaker()
+
+# Shared by all POS tagger requests in this process, so that an outage of one service doesn't stop
+# requests to the other
+pos_tagger_circuit_breaker = CircuitBreaker()
+
+# Maximum number of concurrent Gabra lookups when resolving a batch of tokens
+GABRA_MAX_WORKERS = int(os.environ.get('GABRA_MAX_WORKERS', 8))
+
+_gabra_session = None
+_gabra_session_lock = threading.Lock()
+
+def get_gabra_session():
+    """Return the shared HTTP session, which keeps a pool of connections to Gabra alive between requests."""
+    global _gabra_session
+    with _gabra_session_lock:
+        if _gabra_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=GABRA_MAX_WORKERS)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _gabra_session = session
+    return _gabra_session
+
+def backoff_delay(attempt, base=0.5, cap=8):
+    """
+    Returns a randomized ("full jitter") exponential backoff delay before retrying a request.
+
+    Args:
+        attempt: Number of attempts made so far (1 for the first retry)
+        base: Delay ceiling in seconds for the first retry, doubled for every further retry
+        cap: Maximum delay ceiling in seconds
+    """
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+def make_request(url, params=None, circuit_breaker=gabra_circuit_breaker):
     """
     Helper function to make request with retry logic.
+
+    Retries back off exponentially with jitter, and no request is made while the
+    circuit breaker is open.
     
     Args:
         url: The URL to make the request to
+        params: Optional query parameters (URL-encoded by requests)
+        circuit_breaker: CircuitBreaker of the service the request is sent to
+
+    Returns:
+        (data, attempted): the decoded JSON response (None if the request failed), and whether a
+        request was actually made. It isn't if the circuit breaker rejects the first attempt (e.g.
+        while another thread's half-open trial is running), in which case the failure says nothing
+        about the URL and shouldn't be cached.
     """
-    DELAY = 3  # 3 second delay between requests
     MAX_RETRIES = 3  # Will try each request up to 3 times
 
     for attempt in range(MAX_RETRIES):
+        # Fail fast if the service has been failing (also stops retrying once the breaker opens)
+        if not circuit_breaker.allow_request():
+            return None, attempt > 0
+
         try:
             if attempt > 0:
-                time.sleep(DELAY)  # Wait before making request after first attempt
+                time.sleep(backoff_delay(attempt))  # Wait before making request after first attempt
 
-            response = requests.get(url, timeout=15)
+            response = get_gabra_session().get(url, params=params, timeout=15)
             response.raise_for_status()
-            return response.json()
+            data = response.json()
         except Exception as e:
+            circuit_breaker.record_failure()
             if attempt == MAX_RETRIES - 1:  # Last attempt
                 print(f"Request failed after {MAX_RETRIES} attempts: {e}")
                 print(f"URL: {url}")
-                return None
+                return None, True
             print(f"Request failed, retrying: {e}")
+        else:
+            circuit_breaker.record_success()
+            return data, True
 
-def normalize_word(word):
+    return None, True
+
+def gabra_request(endpoint, word):
     """
-    Takes an incorrectly written Maltese word (e.g., 'nohorgu') and uses Gabra's Search Suggest API
-    to try to find its proper spelling equivalent ('noħorġu').
+    Query a Gabra API endpoint for a word, going through the persistent cache first.
     
     Args:
-        word: The word to normalize
+        endpoint: Gabra API endpoint (e.g. 'lexemes/lemmatise')
+        word: The lowercased word to search for
+
+    Returns:
+        The decoded JSON response, or None if the request failed (or was skipped because
+        Gabra is unavailable), in which case callers leave the word unchanged
     """
-    # Skip empty words    
-    if not word:
-        return ""
-    
-    # Skip if word is too short
-    if len(word) < 2:
-        return word
+    cache = get_gabra_cache()
+    if cache is not None:
+        found, data = cache.get(endpoint, word)
+        if found:
+            return data
+        if cache.offline:
+            return None
+
+    # Skip the lookup without caching anything while the circuit breaker is open
+    if gabra_circuit_breaker.is_open():
+        return None
 
-    # Skip if word isn't alphanumeric
-    if not word.isalnum():
-        return word
-        
-    # Special case - avoid 'hemm' being converted to 'ħemm'
-    if word == 'hemm':
-        return word
+    data, attempted = make_request(f"{GABRA_API_URL}/{endpoint}?s={word}")
 
-    # Store original word case pattern
-    is_upper = word.isupper()
-    is_title = word.istitle()
-    
+    # Failed requests are cached for a short time only, so that they are retried later (and
+    # requests the circuit breaker rejected aren't cached at all)
+    if cache is not None and attempted:
+        cache.set(endpoint, word, data)
+    return data
+
+def match_case(word, result):
+    """
+    Applies the case pattern of the original word (fully uppercase or title case) to a lookup result.
+
+    Args:
+        word: The original word
+        result: The normalized form or lemma found for the lowercased word
+    """
+    if word.isupper():
+        return result.upper()
+    elif word.istitle():
+        return result.title()
+    return result
+
+def search_normalized_form(word):
+    """
+    Uses Gabra's Search Suggest API to find the proper spelling of a lowercased word.
+
+    Args:
+        word: The lowercased word to search for
+
+    Returns:
+        The proper spelling as returned by Gabra, or None if no match was found
+    """
+    return _search_normalized_form(word)[0]
+
+def _search_normalized_form(word):
+    """Same as search_normalized_form, but also returns whether every request it needed succeeded."""
     # Try searching wordforms first
-    url = f"https://mlrs.research.um.edu.mt/resources/gabra-api/wordforms/search_suggest?s={word.lower()}"
-    data = make_request(url)
+    data = gabra_request("wordforms/search_suggest", word)
     
     if data and data.get("results") and len(data["results"]) > 0:
         # Iterate through all wordform results
         for result in data["results"]:
             if "wordform" in result and "surface_form" in result["wordform"]:
-                surface_form = result["wordform"]["surface_form"]
-                
-                # Apply original case pattern and return
-                if is_upper:
-                    return surface_form.upper()
-                elif is_title:
-                    return surface_form.title()
-                return surface_form
+                return result["wordform"]["surface_form"], True
+    complete = data is not None
     
     # If not found, try searching lexemes
-    url = f"https://mlrs.research.um.edu.mt/resources/gabra-api/lexemes/search_suggest?s={word.lower()}"
-    data = make_request(url)
+    data = gabra_request("lexemes/search_suggest", word)
+    complete = complete and data is not None
     
     if data and data.get("results") and len(data["results"]) > 0:
         # Iterate through all lexeme results
@@ -354,21 +943,89 @@ def normalize_word(word):
                 
                 # Only use lemma if it's the same length as the input word
                 if len(lemma) == len(word):
-                    if is_upper:
-                        return lemma.upper()
-                    elif is_title:
-                        return lemma.title()
-                    return lemma
+                    return lemma, complete
+    
+    return None, complete
+
+def search_lemma(word):
+    """
+    Uses Gabra's Lemmatise API to find the lemma of a lowercased word.
+
+    Args:
+        word: The lowercased word to lemmatize
+
+    Returns:
+        The lemma as returned by Gabra, or None if no match was found
+    """
+    return _search_lemma(word)[0]
+
+def _search_lemma(word):
+    """Same as search_lemma, but also returns whether the request succeeded."""
+    data = gabra_request("lexemes/lemmatise", word)
+
+    # Check if results exist and are not empty
+    if data and data.get("results") and len(data["results"]) > 0:
+        # Iterate through all results
+        for result in data["results"]:
+            surface_form = result["wordform"]["surface_form"]
+            
+            # Check if surface form matches and lexeme/lemma exists
+            if (word == surface_form and 
+                "lexeme" in result and 
+                "lemma" in result["lexeme"]):
+                return result["lexeme"]["lemma"], True
+
+    return None, data is not None
+
+def normalize_word(word, lexicon=None, normalizer=None):
+    """
+    Takes an incorrectly written Maltese word (e.g., 'nohorgu') and uses Gabra's Search Suggest API
+    to try to find its proper spelling equivalent ('noħorġu').
+    
+    Args:
+        word: The word to normalize
+        lexicon: Optional LexiconSnapshot to look the word up in instead of calling the API
+        normalizer: Optional DiacriticNormalizer to restore diacritics locally instead of calling the API
+    """
+    # Skip empty words    
+    if not word:
+        return ""
     
+    # Skip if word is too short
+    if len(word) < 2:
+        return word
+
+    # Skip if word isn't alphanumeric
+    if not word.isalnum():
+        return word
+        
+    # Special case - avoid 'hemm' being converted to 'ħemm'
+    if word == 'hemm':
+        return word
+
+    if normalizer is not None:
+        normalized = normalizer.normalize(word.lower())
+    elif lexicon is not None:
+        normalized = lexicon.normalized_form(word.lower())
+    else:
+        # Prefer a cached resolution record (e.g. one bootstrapped from the preprocessed datasets)
+        record = cached_resolution(word.lower(), lemmatize=False)
+        normalized = record.normalized if record is not None else search_normalized_form(word.lower())
+
     # If no matches found, return original word
-    return word
+    if normalized is None:
+        return word
 
-def get_lemma(word):
+    # Apply original case pattern and return
+    return match_case(word, normalized)
+
+def get_lemma(word, lexicon=None):
     """
     Retrieves the lemma (base form) of a given word using the Gabra API.
     
     Args:
         word: The word to lemmatize
+        lexicon: Optional LexiconSnapshot to look the word up in instead of calling the API
     """
     # Skip empty words
     if not word:
@@ -382,35 +1039,801 @@ def get_lemma(word):
     if not word.isalnum():
         return word
 
-    # Store original word case pattern
-    is_upper = word.isupper()
-    is_title = word.istitle()
-    
-    url = f"https://mlrs.research.um.edu.mt/resources/gabra-api/lexemes/lemmatise?s={word.lower()}"
-    data = make_request(url)
-
-    # Check if results exist and are not empty
-    if data and data.get("results") and len(data["results"]) > 0:
-        # Iterate through all results
-        for result in data["results"]:
-            surface_form = result["wordform"]["surface_form"]
-            
-            # Check if surface form matches and lexeme/lemma exists
-            if (word.lower() == surface_form and 
-                "lexeme" in result and 
-                "lemma" in result["lexeme"]):
-                
-                lemma = result["lexeme"]["lemma"]
-                
-                # Apply original case pattern to lemma
-                if is_upper:
-                    return lemma.upper()
-                elif is_title:
-                    return lemma.title()
-                return lemma
+    if lexicon is not None:
+        lemma = lexicon.lemma(word.lower())
+    else:
+        record = cached_resolution(word.lower(), normalize=False)
+        lemma = record.lemma if record is not None else search_lemma(word.lower())
 
     # No matching lemma found, return the original word
-    return word
+    if lemma is None:
+        return word
+
+    # Apply original case pattern to lemma
+    return match_case(word, lemma)
+
+# Result of resolving a lowercased surface form: its proper spelling and lemma as found by the
+# lookup backends (None where there was no match), and which backends they came from
+WordResolution = namedtuple('WordResolution', ['normalized', 'lemma', 'source'])
+
+def resolution_kind(normalize=True, lemmatize=True):
+    """Returns the kind under which resolution records are cached: 'normalize+lemmatise', 'lemmatise' or 'normalize'."""
+    return '+'.join(kind for kind, needed in (('normalize', normalize), ('lemmatise', lemmatize)) if needed)
+
+def cached_resolution(word, normalize=True, lemmatize=True):
+    """
+    Looks up the cached WordResolution of a lowercased word without making any requests.
+
+    Args:
+        word: The lowercased word
+        normalize: Whether the record should include normalization
+        lemmatize: Whether the record should include lemmatization (a record without it has no lemma)
+
+    Returns:
+        The cached WordResolution, or None if the word has not been resolved yet
+    """
+    cache = get_gabra_cache()
+    if cache is None:
+        return None
+
+    record = cache.get_resolution(resolution_kind(normalize, lemmatize), word)
+    if record is None and not normalize:
+        # A word that normalization leaves unchanged has the same lemma either way
+        full_record = cache.get_resolution('normalize+lemmatise', word)
+        if full_record is not None and full_record.normalized is None:
+            record = full_record
+    elif record is None and not lemmatize:
+        # A full record also holds the normalized form
+        record = cache.get_resolution('normalize+lemmatise', word)
+    return record
+
+def resolve_record(word, normalize=True, lexicon=None, normalizer=None, lemmatize=True):
+    """
+    Finds the normalized form of a lowercased word and the lemma of that normalized form in one go.
+
+    Results obtained from the Gabra API are cached persistently as a single record, so that neither
+    the normalization nor the lemmatization requests are ever repeated for the same word.
+
+    Args:
+        word: The lowercased word (must be alphanumeric and at least 2 characters long)
+        normalize: Whether to normalize the word before lemmatizing it
+        lexicon: Optional LexiconSnapshot to use instead of the Gabra API
+        normalizer: Optional DiacriticNormalizer to use instead of Gabra's Search Suggest API
+        lemmatize: Whether to lemmatize the word (otherwise the record has no lemma, and is cached as a
+                   separate 'normalize' record, which a later full resolution reuses)
+
+    Returns:
+        WordResolution
+    """
+    # Only results coming entirely from the Gabra API are cached, since local backends are already fast
+    persistent = lexicon is None and (normalizer is None or not normalize)
+    if persistent:
+        record = cached_resolution(word, normalize, lemmatize)
+        if record is not None:
+            return record
+
+    sources = []
+    complete = True # Whether all Gabra requests succeeded, so the record can be cached
+
+    # A word only normalized so far keeps its normalized form, and only needs lemmatizing now
+    partial = cached_resolution(word, lemmatize=False) if persistent and normalize and lemmatize else None
+
+    normalized = None
+    if partial is not None:
+        normalized = partial.normalized
+        sources.append(partial.source)
+    elif normalize:
+        if normalizer is not None:
+            normalized = normalizer.normalize(word)
+            sources.append('wordlist')
+        elif lexicon is not None:
+            normalized = lexicon.normalized_form(word)
+            sources.append('lexicon')
+        else:
+            normalized, complete = _search_normalized_form(word)
+            sources.append('gabra')
+
+    # Lemmatize the normalized form, skipping words get_lemma would skip
+    target = normalized.lower() if normalized is not None else word
+    lemma = None
+    if lemmatize and len(target) >= 2 and target.isalnum():
+        if lexicon is not None:
+            lemma = lexicon.lemma(target)
+            sources.append('lexicon')
+        else:
+            lemma, found = _search_lemma(target)
+            complete = complete and found
+            sources.append('gabra')
+
+    record = WordResolution(normalized, lemma, '+'.join(dict.fromkeys(sources)))
+    cache = get_gabra_cache() if persistent else None
+    if cache is not None and complete:
+        cache.set_resolution(resolution_kind(normalize, lemmatize), word, record)
+    return record
+
+def resolve_word(word, normalize=True, lexicon=None, normalizer=None, lemmatize=True):
+    """
+    Normalizes and lemmatizes a word with a single resolution record, giving the same results as
+    normalize_word followed by get_lemma (or get_lemma alone if normalize is False).
+
+    Args:
+        word: The word to resolve
+        normalize: Whether to normalize the word before lemmatizing it
+        lexicon: Optional LexiconSnapshot to use instead of the Gabra API
+        normalizer: Optional DiacriticNormalizer to use instead of Gabra's Search Suggest API
+        lemmatize: Whether to lemmatize the word (otherwise the lemma returned is the normalized word)
+
+    Returns:
+        tuple: (normalized word, lemma of the normalized word)
+    """
+    # Skip words that are empty, too short or not alphanumeric
+    if len(word) < 2 or not word.isalnum():
+        return word, word
+
+    # Special case - avoid 'hemm' being converted to 'ħemm'
+    if word == 'hemm':
+        normalize = False
+
+    if not normalize and not lemmatize:
+        return word, word
+
+    record = resolve_record(word.lower(), normalize, lexicon, normalizer, lemmatize)
+
+    # Apply the original case pattern to the results
+    normalized = match_case(word, record.normalized) if record.normalized is not None else word
+    lemma = match_case(normalized, record.lemma) if record.lemma is not None else normalized
+    return normalized, lemma
+
+_executors = {} # max_workers -> thread pool shared by all lookups of this process
+_executors_pid = None
+_executors_lock = threading.Lock()
+
+def _get_executor(max_workers):
+    """
+    Return the long-lived thread pool running up to max_workers lookups, so that its threads (and their
+    connections to the Gabra cache) are reused by every batch instead of being started for each one.
+    """
+    global _executors_pid
+    with _executors_lock:
+        # Threads don't survive a fork, so a child process starts its own pools
+        if _executors_pid != os.getpid():
+            _executors.clear()
+            _executors_pid = os.getpid()
+        executor = _executors.get(max_workers)
+        if executor is None:
+            executor = _executors[max_workers] = ThreadPoolExecutor(max_workers=max_workers)
+        return executor
+
+def _map_concurrently(function, items, max_workers):
+    """Apply a function to each distinct item using a thread pool, returning an {item: result} dictionary."""
+    items = list(dict.fromkeys(items))
+    if max_workers <= 1 or len(items) <= 1:
+        return {item: function(item) for item in items}
+
+    # The function must not call _map_concurrently itself, since it runs in the shared pool
+    return dict(zip(items, _get_executor(max_workers).map(function, items)))
+
+class TokenResolver:
+    """
+    Normalizes and lemmatizes tokens, remembering the results so that each distinct token is only
+    resolved once, however many times (and in however many batches) it occurs.
+    """
+    def __init__(self, lexicon=None, normalizer=None, max_workers=None):
+        self.lexicon = lexicon
+        self.normalizer = normalizer
+        # Snapshot lookups are local, so threads would only add overhead
+        self.max_workers = 1 if lexicon is not None else (max_workers or GABRA_MAX_WORKERS)
+        self.resolved = {} # (token, normalize, lemmatize) -> (normalized token, lemma)
+
+    def resolve(self, tokens, normalize=True, lemmatize=True):
+        """
+        Return the (normalized form, lemma) pair of each token, resolving new distinct tokens concurrently.
+
+        Args:
+            tokens: List of tokens
+            normalize: Whether to normalize the tokens before lemmatizing them
+            lemmatize: Whether to lemmatize the tokens (otherwise each lemma is the normalized token)
+        """
+        keys = [(token, normalize, lemmatize) for token in tokens]
+        if not lemmatize:
+            # Tokens already resolved in full have their normalized form too
+            for token, _, _ in keys:
+                full = self.resolved.get((token, normalize, True))
+                if full is not None:
+                    self.resolved.setdefault((token, normalize, False), (full[0], full[0]))
+        missing = [key for key in keys if key not in self.resolved]
+        self.resolved.update(_map_concurrently(
+            lambda key: resolve_word(key[0], key[1], self.lexicon, self.normalizer, key[2]), missing, self.max_workers))
+        return [self.resolved[key] for key in keys]
+
+def resolve_tokens(tokens, normalize=True, lemmatize=True, lexicon=None, normalizer=None, max_workers=None):
+    """
+    Normalizes and/or lemmatizes each distinct token once, resolving them concurrently.
+
+    Args:
+        tokens: Iterable of tokens, possibly with repetitions
+        normalize: Whether to normalize the tokens
+        lemmatize: Whether to lemmatize the (normalized) tokens
+        lexicon: Optional LexiconSnapshot to use instead of the Gabra API
+        normalizer: Optional DiacriticNormalizer to use instead of Gabra's Search Suggest API
+        max_workers: Maximum number of concurrent Gabra lookups (defaults to GABRA_MAX_WORKERS)
+
+    Returns:
+        Dictionary mapping each distinct token to its resolved form
+    """
+    tokens = list(dict.fromkeys(tokens))
+    resolver = TokenResolver(lexicon=lexicon, normalizer=normalizer, max_workers=max_workers)
+
+    resolved = resolver.resolve(tokens, normalize=normalize, lemmatize=lemmatize)
+    return {token: lemma if lemmatize else normalized
+            for token, (normalized, lemma) in zip(tokens, resolved)}
+
+# ====================
+# Corpus Preprocessing
+# ====================
+
+class TokenizedCorpus:
+    """
+    A corpus tokenized once into a vocabulary table, with each document stored as an array of token ids.
+    """
+    def __init__(self, token_lists=()):
+        self.vocabulary = [] # Token id -> token
+        self.token_ids = {} # Token -> token id
+        self.documents = [] # One array of token ids per document
+
+        for tokens in token_lists:
+            self.add(tokens)
+
+    def add(self, tokens):
+        """Add a tokenized document to the corpus."""
+        ids = array('I')
+        for token in tokens:
+            token_id = self.token_ids.get(token)
+            if token_id is None:
+                token_id = len(self.vocabulary)
+                self.token_ids[token] = token_id
+                self.vocabulary.append(token)
+            ids.append(token_id)
+        self.documents.append(ids)
+
+    def rewrite(self, table):
+        """
+        Rewrite every document through a lookup table.
+
+        Args:
+            table: List holding the replacement of each vocabulary item, indexed by token id
+
+        Returns:
+            List of token lists, one per document
+        """
+        return [[table[token_id] for token_id in ids] for ids in self.documents]
+
+    def __len__(self):
+        return len(self.documents)
+
+def preprocess_corpus(texts, tokenizer_configs, lexicon_path=None, normalizer_path=None, max_workers=None):
+    """
+    Preprocess a corpus under several tokenizer configurations at once.
+
+    The texts are cleaned, anonymized and tokenized only once, and each distinct token is normalized
+    and lemmatized only once across all configurations, since case folding is applied per token.
+
+    Args:
+        texts: Iterable of raw input texts
+        tokenizer_configs: List of dictionaries with 'case_folding_type' and 'lemmatize' keys
+        lexicon_path: Optional LexiconSnapshot file to use instead of the Gabra API
+        normalizer_path: Optional word list file for offline diacritic restoration
+        max_workers: Maximum number of concurrent Gabra lookups (defaults to GABRA_MAX_WORKERS)
+
+    Returns:
+        List with one list of token lists (one per text) for each configuration, in order
+    """
+    tokenizer = MalteseTokenizer(case_folding_type=0, lexicon_path=lexicon_path, normalizer_path=normalizer_path)
+    corpus = TokenizedCorpus(tokenizer.pre_tokenize(text) for text in texts)
+    resolver = TokenResolver(lexicon=tokenizer.lexicon, normalizer=tokenizer.normalizer, max_workers=max_workers)
+
+    results = []
+    for config in tokenizer_configs:
+        resolved = resolver.resolve(fold_case(corpus.vocabulary, config['case_folding_type']), lemmatize=config['lemmatize'])
+        results.append(corpus.rewrite([lemma if config['lemmatize'] else normalized for normalized, lemma in resolved]))
+    return results
+
+# ================
+# Lexicon Snapshot
+# ================
+
+class LexiconSnapshot:
+    """
+    Read-only, memory-mapped snapshot of Gabra lookups, used instead of the API when preprocessing offline.
+
+    Maps each lowercased surface form to its proper spelling (as found by normalize_word) and to its
+    lemma (as found by get_lemma). Lookups are a binary search over the memory-mapped file, so the
+    snapshot is shared between processes by the OS and never fully loaded into memory.
+
+    File layout (all integers are little-endian uint32):
+        MAGIC | entry count | offsets[count + 1] | records
+    where each record is 'surface\0normalized\0lemma' encoded in UTF-8, sorted by surface form.
+    An empty normalized form or lemma means Gabra had no match for that word.
+    """
+    MAGIC = b'GABRALEX'
+    HEADER = struct.Struct('<8sI')
+    OFFSET = struct.Struct('<I')
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            self._mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.count = self.HEADER.unpack_from(self._mm, 0)
+        if magic != self.MAGIC:
+            raise ValueError(f"{path} is not a Gabra lexicon snapshot")
+        self._offsets_start = self.HEADER.size
+
+    @classmethod
+    def build(cls, path, entries):
+        """
+        Write a snapshot file.
+
+        Args:
+            path: Output file path
+            entries: Iterable of (surface form, normalized form or None, lemma or None) tuples
+        """
+        records = {}
+        for surface, normalized, lemma in entries:
+            records[surface.lower()] = (normalized or '', lemma or '')
+
+        blobs = [f"{surface}\0{normalized}\0{lemma}".encode('utf-8')
+                 for surface, (normalized, lemma) in records.items()]
+        blobs.sort() # Sorting the encoded records sorts them by surface form, since '\0' sorts first
+
+        offset = cls.HEADER.size + cls.OFFSET.size * (len(blobs) + 1)
+        offsets = []
+        for blob in blobs:
+            offsets.append(offset)
+            offset += len(blob)
+        offsets.append(offset)
+
+        with open(path, 'wb') as file:
+            file.write(cls.HEADER.pack(cls.MAGIC, len(blobs)))
+            file.write(struct.pack(f'<{len(offsets)}I', *offsets))
+            for blob in blobs:
+                file.write(blob)
+
+        return cls(path)
+
+    def _record(self, index):
+        """Return the (start, end) byte range of the record at the given index."""
+        position = self._offsets_start + index * self.OFFSET.size
+        start, end = struct.unpack_from('<II', self._mm, position)
+        return start, end
+
+    def lookup(self, word):
+        """
+        Look up a lowercased word.
+
+        Returns:
+            tuple: (normalized form, lemma), where either may be None if Gabra had no match,
+            or None if the word is not in the snapshot
+        """
+        key = word.encode('utf-8')
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            start, end = self._record(middle)
+            separator = self._mm.find(b'\0', start, end)
+            surface = self._mm[start:separator]
+
+            if surface < key:
+                low = middle + 1
+            elif surface > key:
+                high = middle
+            else:
+                normalized, lemma = self._mm[separator + 1:end].decode('utf-8').split('\0')
+                return normalized or None, lemma or None
+        return None
+
+    def normalized_form(self, word):
+        """Return the proper spelling of a lowercased word, or None if unknown."""
+        entry = self.lookup(word)
+        return entry[0] if entry else None
+
+    def lemma(self, word):
+        """Return the lemma of a lowercased word, or None if unknown."""
+        entry = self.lookup(word)
+        return entry[1] if entry else None
+
+    def entries(self):
+        """Yield every (surface form, normalized form, lemma) entry in order, with None for missing matches."""
+        for index in range(self.count):
+            start, end = self._record(index)
+            surface, normalized, lemma = self._mm[start:end].decode('utf-8').split('\0')
+            yield surface, normalized or None, lemma or None
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, word):
+        return self.lookup(word) is not None
+
+    def close(self):
+        self._mm.close()
+
+    # Memory maps cannot be pickled, so the snapshot is reopened from its path
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+@lru_cache(maxsize=None)
+def load_lexicon_snapshot(path):
+    """Open a lexicon snapshot, sharing a single memory map per path within the process."""
+    return LexiconSnapshot(path)
+
+def build_lexicon_snapshot(path, words):
+    """
+    Resolve words through the Gabra API (or its cache) and save the results as a lexicon snapshot.
+
+    Both the words and their normalized forms are included, so that the snapshot can lemmatize
+    the output of normalize_word without any further lookups.
+
+    Args:
+        path: Output file path
+        words: Iterable of words to include
+    """
+    pending = {word.lower() for word in words}
+    entries = {}
+    while pending:
+        word = pending.pop()
+        if word in entries or len(word) < 2 or not word.isalnum():
+            continue
+
+        normalized = search_normalized_form(word)
+        entries[word] = (normalized, search_lemma(word))
+        if normalized:
+            pending.add(normalized.lower())
+
+    return LexiconSnapshot.build(path, ((word, normalized, lemma) for word, (normalized, lemma) in entries.items()))
+
+# =====================
+# Diacritic Restoration
+# =====================
+
+# Maps Maltese letters with diacritics (and accented vowels) to their plain ASCII equivalents, e.g. 'għ' -> 'gh'
+STRIP_DIACRITICS = str.maketrans('ħġċżàèìòùĦĠĊŻÀÈÌÒÙ', 'hgczaeiouHGCZAEIOU')
+
+def strip_diacritics(word):
+    """Remove Maltese diacritics from a word (e.g. 'noħorġu' -> 'nohorgu')."""
+    return word.translate(STRIP_DIACRITICS)
+
+def edit_distance(a, b):
+    """Return the Damerau-Levenshtein (optimal string alignment) distance between two strings."""
+    previous_previous, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous_previous[j - 2] + 1)
+        previous_previous, previous = previous, current
+    return previous[-1]
+
+def _deletes(word, max_distance):
+    """Return all strings obtained by deleting up to max_distance characters from a word (including the word)."""
+    variants = {word}
+    frontier = {word}
+    for _ in range(max_distance):
+        frontier = {variant[:i] + variant[i + 1:] for variant in frontier for i in range(len(variant))}
+        variants |= frontier
+    return variants
+
+class DiacriticNormalizer:
+    """
+    Restores Maltese diacritics locally, as an offline replacement for Gabra's Search Suggest API.
+
+    Known wordforms are indexed by their diacritic-free spelling, so 'nohorgu' is restored to 'noħorġu'
+    with a single dictionary lookup. Words whose plain spelling is unknown can optionally be matched
+    to a known word within a small edit distance, using a symmetric delete index: the deletions of
+    every known spelling are precomputed, so a lookup only generates the deletions of the query.
+    """
+    def __init__(self, words, max_edit_distance=1, min_edit_length=4):
+        """
+        Args:
+            words: Iterable of known wordforms, or of (wordform, frequency) pairs. When several known
+                   words share a plain spelling, the most frequent (or else the first) one is used.
+            max_edit_distance: Maximum edit distance for the fallback (0 disables it)
+            min_edit_length: Minimum word length for the fallback, since short words have too many neighbours
+        """
+        self.max_edit_distance = max_edit_distance
+        self.min_edit_length = min_edit_length
+
+        self.known = {} # Known word -> frequency
+        for entry in words:
+            word, frequency = entry if isinstance(entry, tuple) else (entry, 0)
+            word = word.lower()
+            if word not in self.known:
+                self.known[word] = frequency
+
+        self.by_plain_spelling = {} # Plain spelling -> best known word
+        for word, frequency in self.known.items():
+            plain = strip_diacritics(word)
+            best = self.by_plain_spelling.get(plain)
+            if best is None or frequency > self.known[best]:
+                self.by_plain_spelling[plain] = word
+
+        self.deletes = {} # Deletion of a plain spelling -> plain spellings it was derived from
+        if max_edit_distance > 0:
+            for plain in self.by_plain_spelling:
+                if len(plain) >= min_edit_length:
+                    for variant in _deletes(plain, max_edit_distance):
+                        self.deletes.setdefault(variant, []).append(plain)
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        """
+        Load a word list with one word per line, optionally followed by a tab and its frequency.
+        """
+        def read_words():
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    fields = line.rstrip('\n').split('\t')
+                    if fields[0]:
+                        yield (fields[0], int(fields[1])) if len(fields) > 1 else fields[0]
+        return cls(read_words(), **kwargs)
+
+    def normalize(self, word):
+        """
+        Return the known spelling of a lowercased word, or None if no known word is close enough.
+        """
+        if word in self.known:
+            return word
+
+        plain = strip_diacritics(word)
+        match = self.by_plain_spelling.get(plain)
+        if match is not None:
+            return match
+
+        if self.max_edit_distance == 0 or len(plain) < self.min_edit_length:
+            return None
+
+        # Symmetric delete fallback: candidates share at least one deletion variant with the query
+        best, best_key = None, None
+        for variant in _deletes(plain, self.max_edit_distance):
+            for candidate in self.deletes.get(variant, ()):
+                distance = edit_distance(plain, candidate)
+                if distance > self.max_edit_distance:
+                    continue
+                word_match = self.by_plain_spelling[candidate]
+                key = (distance, -self.known[word_match], candidate)
+                if best_key is None or key < best_key:
+                    best, best_key = word_match, key
+        return best
+
+    def __len__(self):
+        return len(self.known)
+
+@lru_cache(maxsize=None)
+def load_diacritic_normalizer(path):
+    """Load a word list file as a DiacriticNormalizer, sharing one instance per path within the process."""
+    return DiacriticNormalizer.from_file(path)
+
+# ===========
+# POS Tagging
+# ===========
+
+# Maximum length of the text sent in one tagger request once URL-encoded (non-ASCII letters such as ħ
+# take 6 characters each), keeping request URLs well within server limits
+POS_TAG_MAX_CHARS = int(os.environ.get('POS_TAG_MAX_CHARS', 1500))
+
+# Number of input texts handled per window in tag_texts (bounds memory use when streaming a corpus)
+POS_TAG_WINDOW = 512
+
+# Several texts are packed into one request as separate lines. This is switched off for the rest of
+# the process if the tokens of a packed response ever fail to line up with the text of its lines.
+_pos_tag_packing = True
+
+def _encoded_length(text):
+    """Length of a text once URL-encoded as a query parameter (as requests encodes params)."""
+    return len(quote_plus(text))
+
+def _split_long_text(text, max_chars):
+    """Splits a text at whitespace into pieces of at most max_chars URL-encoded characters (where possible)."""
+    if _encoded_length(text) <= max_chars:
+        return [text]
+
+    pieces, piece, size = [], "", 0
+    for word in text.split():
+        length = _encoded_length(word)
+        # Words are joined with a space, which is encoded as a single '+'
+        if piece and size + 1 + length > max_chars:
+            pieces.append(piece)
+            piece, size = word, length
+        else:
+            piece, size = (f"{piece} {word}", size + 1 + length) if piece else (word, length)
+    if piece:
+        pieces.append(piece)
+    return pieces
+
+def _pack_pieces(pieces, max_chars):
+    """Groups texts into batches whose newline-joined, URL-encoded length stays within max_chars."""
+    separator = _encoded_length("\n")
+    batches, batch, size = [], [], 0
+    for piece in pieces:
+        # Pieces containing newlines would be split apart by the tagger, and blank pieces have no tokens
+        # to line up, so they are sent on their own
+        if not _pos_tag_packing or '\n' in piece or not piece.strip():
+            batches.append([piece])
+            continue
+        length = _encoded_length(piece)
+        if batch and size + separator + length > max_chars:
+            batches.append(batch)
+            batch, size = [], 0
+        size += length + (separator if batch else 0)
+        batch.append(piece)
+    if batch:
+        batches.append(batch)
+    return batches
+
+def _token_text(token):
+    """The text of a token in a tagger result (a string, or a list or dictionary holding it), or None if unknown."""
+    if isinstance(token, str):
+        return token
+    if isinstance(token, (list, tuple)) and token and isinstance(token[0], str):
+        return token[0]
+    if isinstance(token, dict):
+        for key in ('token', 'word', 'form', 'text'):
+            if isinstance(token.get(key), str):
+                return token[key]
+    return None
+
+def _align_packed_result(result, batch):
+    """
+    Splits the result of tagging several newline-separated texts into the result of each text.
+
+    The tagger splits its input into sentences, not lines: a line can hold several sentences, and a
+    sentence without a full stop runs on into the next line. Every token is therefore matched against
+    the text of the lines (ignoring whitespace), and sentences are cut where a line ends.
+
+    Args:
+        result: The 'result' of the response, a list of sentences, each a list of tokens
+        batch: The texts that were sent, none of them blank
+
+    Returns:
+        List with the sentences of each text (the shape of the result of tagging it on its own), or
+        None if the tokens don't spell out the texts exactly
+    """
+    if not isinstance(result, list):
+        return None
+
+    lines = [''.join(text.split()) for text in batch]
+    results = [[] for _ in batch]
+    line, position = 0, 0
+    for sentence in result:
+        if not isinstance(sentence, list):
+            return None
+        part = []
+        for token in sentence:
+            text = _token_text(token)
+            if text is None:
+                return None
+            text = ''.join(text.split())
+            if position == len(lines[line]) and text:
+                # The current line is complete, so the token must start the next one
+                if part:
+                    results[line].append(part)
+                    part = []
+                line, position = line + 1, 0
+                if line == len(lines):
+                    return None
+            if not lines[line].startswith(text, position):
+                return None
+            part.append(token)
+            position += len(text)
+        if part:
+            results[line].append(part)
+
+    if line != len(lines) - 1 or position != len(lines[line]):
+        return None
+    return results
+
+def _tag_batch(batch):
+    """
+    Tags a batch of texts with a single tagger request.
+
+    Returns:
+        (results, attempted): list with the tagger result for each text (None where the request
+        failed), and whether the request was actually made (see make_request)
+    """
+    global _pos_tag_packing
+
+    if pos_tagger_circuit_breaker.is_open():
+        return [None] * len(batch), False
+
+    data, attempted = make_request(f"{MLRS_API_URL}/tag", params={'text': "\n".join(batch)},
+                                   circuit_breaker=pos_tagger_circuit_breaker)
+    if data is None:
+        return [None] * len(batch), attempted
+    if len(batch) == 1:
+        return [data['result']], True
+
+    results = _align_packed_result(data.get('result'), batch)
+    if results is not None:
+        return results, True
+
+    # The tokens didn't line up with the texts, so tag the texts separately from now on
+    print("POS tagger returned a result that doesn't line up with a packed request, disabling request packing")
+    _pos_tag_packing = False
+    outcomes = [_tag_batch([text]) for text in batch]
+    return [results[0] for results, _ in outcomes], all(attempted for _, attempted in outcomes)
+
+def _combine_results(results):
+    """Combines the tagger results of the pieces of a long text."""
+    if len(results) == 1:
+        return results[0]
+    if any(result is None for result in results):
+        return None
+    return [item for result in results for item in result]
+
+def tag_texts(texts, max_chars=POS_TAG_MAX_CHARS, max_workers=None):
+    """
+    Tokenises and POS-tags many texts using the MLRS API, yielding the results in input order.
+
+    Texts are handled in windows of POS_TAG_WINDOW. Within a window, identical texts are tagged once,
+    texts already in the persistent cache (under the 'tag' endpoint) are not sent again, and the
+    rest are packed into as few requests of up to max_chars URL-encoded characters as possible, which
+    are sent concurrently. The result of a packed request is split between its texts by matching its
+    tokens against them. Texts longer than max_chars are split at whitespace and tagged in several parts.
+
+    Args:
+        texts: Iterable of texts to tag (e.g. a generator over a whole corpus)
+        max_chars: Maximum URL-encoded length of the text sent in one request
+        max_workers: Maximum number of concurrent requests (defaults to GABRA_MAX_WORKERS)
+
+    Yields:
+        The tagger result for each text, as tokenise_with_pos_tag returns it, or None if tagging failed
+    """
+    max_workers = max_workers or GABRA_MAX_WORKERS
+    cache = get_gabra_cache()
+
+    texts = iter(texts)
+    while True:
+        window = list(islice(texts, POS_TAG_WINDOW))
+        if not window:
+            return
+
+        results = {}
+        missing = []
+        for text in dict.fromkeys(window):
+            if cache is not None:
+                found, data = cache.get('tag', text)
+                if found:
+                    results[text] = data['result'] if data is not None else None
+                    continue
+                if cache.offline:
+                    results[text] = None
+                    continue
+            missing.append(text)
+
+        pieces = {text: _split_long_text(text, max_chars) for text in missing}
+        batches = _pack_pieces(list(dict.fromkeys(piece for text in missing for piece in pieces[text])), max_chars)
+        tagged = {}
+        rejected = set() # Pieces whose request the circuit breaker rejected
+        for batch, (batch_results, attempted) in _map_concurrently(lambda batch: _tag_batch(list(batch)),
+                                                                   [tuple(batch) for batch in batches], max_workers).items():
+            tagged.update(zip(batch, batch_results))
+            if not attempted:
+                rejected.update(batch)
+
+        for text in missing:
+            result = _combine_results([tagged[piece] for piece in pieces[text]])
+            results[text] = result
+            if cache is not None and rejected.isdisjoint(pieces[text]):
+                # Failed requests are cached for a short time only (see GabraCache.set)
+                cache.set('tag', text, {'result': result} if result is not None else None)
+
+        for text in window:
+            yield results[text]
 
 # =======================================================
 # Classes imported from Facebook Post Processing Pipeline
@@ -462,15 +1885,270 @@ class TextProcessor(ABC):
         else:
             print(f"No valid data in {file_path}")
 
+def load_prebuilt(path, digest, build):
+    """
+    Load an object saved by an earlier process, or build it and save it for later processes.
+
+    Objects are saved as plain data (e.g. a dict of attributes rather than an instance), since pickled
+    instances can only be loaded when this module is imported under the same name.
+
+    Args:
+        path: Path of the prebuilt file
+        digest: Hash of everything the object is built from (the file is rebuilt if it doesn't match)
+        build: Function returning the object (a false value is returned as is, and not saved)
+
+    Returns:
+        The prebuilt or newly built object
+    """
+    try:
+        with open(path, 'rb') as f:
+            prebuilt = pickle.load(f)
+        if prebuilt['digest'] == digest:
+            return prebuilt['object']
+    except Exception:
+        pass # Not built yet, or built from something else
+
+    built = build()
+    if built:
+        try:
+            temporary_path = f"{path}.{os.getpid()}.tmp"
+            with open(temporary_path, 'wb') as f:
+                pickle.dump({'digest': digest, 'object': built}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary_path, path)
+        except OSError:
+            pass # e.g. a read-only directory, in which case each process builds its own
+    return built
+
+class TwoLanguageIdentifier:
+    """
+    The langid language identifier reduced to two languages, giving the same results as a
+    LanguageIdentifier (with norm_probs=True) restricted to them with set_languages.
+
+    With two languages, the normalized probabilities only depend on the difference between their
+    log-probabilities, so only the difference between the weights of each feature is kept. langid counts
+    the features of a text by walking a DFA over its bytes, where each state adds a fixed set of features,
+    so the differences are also summed per state. Scoring a text is then a single walk over its bytes,
+    without a feature vector.
+    """
+
+    # Changed whenever the reduction changes, so that older prebuilt files are rebuilt
+    VERSION = 1
+
+    # classify_batch walks the texts one at a time once fewer than this many are left
+    MIN_BATCH = 16
+
+    def __init__(self, languages, nextmove, state_weights, bias):
+        self.languages = languages # In langid's order (e.g. ['en', 'mt'])
+        self.nextmove = nextmove # DFA transitions, (state << 8) + byte -> next state
+        self.state_weights = state_weights # State -> log-probability of the second language minus the first
+        self.bias = bias # Difference between the log prior probabilities
+
+        # The same tables as NumPy arrays (sharing the memory of nextmove), for classify_batch
+        self._nextmove_array = np.frombuffer(nextmove, dtype=np.uint16 if nextmove.typecode == 'H' else np.uint32)
+        self._state_weights_array = np.array(state_weights, dtype=np.float64)
+
+    # Only the tables are kept (the arrays are recreated from them)
+    def __getstate__(self):
+        return {'languages': self.languages, 'nextmove': self.nextmove, 'state_weights': self.state_weights, 'bias': self.bias}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    @classmethod
+    def from_langid(cls, languages):
+        """Reduce langid's model (which takes a few seconds to decode) to two languages."""
+        identifier = LanguageIdentifier.from_modelstring(model, norm_probs=True)
+        identifier.set_languages(languages)
+        first, second = identifier.nb_ptc.astype('float64').T
+        feature_weights = (second - first).tolist()
+
+        state_weights = [0.0] * (len(identifier.tk_nextmove) >> 8)
+        for state, features in identifier.tk_output.items():
+            state_weights[state] = sum(feature_weights[feature] for feature in features)
+
+        typecode = 'H' if len(state_weights) <= 1 << 16 else 'I'
+        bias = float(identifier.nb_pc[1]) - float(identifier.nb_pc[0])
+        return cls(list(identifier.nb_classes), array(typecode, identifier.tk_nextmove), state_weights, bias)
+
+    def classify(self, text):
+        """
+        Classify a text.
+
+        Returns:
+            tuple: (language, probability)
+        """
+        nextmove = self.nextmove
+        state_weights = self.state_weights
+        state = 0
+        score = self.bias
+        for byte in text.encode('utf-8'):
+            state = nextmove[(state << 8) + byte]
+            score += state_weights[state]
+        return self._classify_score(score)
+
+    def classify_batch(self, texts):
+        """
+        Classify many texts at once, with the same results as classify.
+
+        The texts are walked together, one byte position at a time, with each step a few NumPy operations
+        over all the texts that are long enough. Each score is still added up in the same order as in
+        classify, so the results are identical.
+
+        Args:
+            texts: List of texts
+
+        Returns:
+            List of (language, probability) tuples, in the order of the texts
+        """
+        encoded = [text.encode('utf-8') for text in texts]
+        lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+        order = np.argsort(-lengths, kind='stable').tolist()
+        lengths = lengths[order]
+        data = np.frombuffer(b''.join([encoded[i] for i in order]), dtype=np.uint8)
+
+        negative_lengths = -lengths # Increasing, for searchsorted
+        positions = np.cumsum(lengths) - lengths # Offset of the next byte of each text in data
+        states = np.zeros(len(order), dtype=np.int64)
+        scores = np.full(len(order), self.bias, dtype=np.float64)
+
+        # The texts are sorted longest first, so those that are still being walked always come first
+        step = 0
+        active = len(order)
+        while True:
+            active = int(np.searchsorted(negative_lengths[:active], -step)) # Texts longer than step bytes
+            if active < self.MIN_BATCH:
+                break
+            states[:active] = self._nextmove_array[(states[:active] << 8) + data[positions[:active]]]
+            scores[:active] += self._state_weights_array[states[:active]]
+            positions[:active] += 1
+            step += 1
+
+        # Finish the few longest texts one at a time
+        nextmove = self.nextmove
+        state_weights = self.state_weights
+        for row in range(active):
+            state = int(states[row])
+            score = float(scores[row])
+            for byte in encoded[order[row]][step:]:
+                state = nextmove[(state << 8) + byte]
+                score += state_weights[state]
+            scores[row] = score
+
+        results = [None] * len(order)
+        for i, score in zip(order, scores.tolist()):
+            results[i] = self._classify_score(score)
+        return results
+
+    def _classify_score(self, score):
+        # Normalized as in langid, where overflowing exponentials give a probability of 0
+        first = 1 / (1 + (math.exp(score) if score < 709 else math.inf))
+        second = 1 / ((math.exp(-score) if score > -709 else math.inf) + 1)
+        if first >= second:
+            return self.languages[0], first
+        return self.languages[1], second
+
+@lru_cache(maxsize=None)
+def load_language_identifier(languages=('en', 'mt')):
+    """
+    Load the TwoLanguageIdentifier for a pair of languages, sharing one per pair within the process.
+
+    The identifier is saved next to this file the first time it is built (e.g. langid_en_mt.pickle), and
+    loaded from there by later processes as long as the langid model is unchanged.
+    """
+    digest = hashlib.sha256(f"{TwoLanguageIdentifier.VERSION} {sorted(languages)}".encode('utf-8'))
+    digest.update(model.encode('ascii') if isinstance(model, str) else model)
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), f"langid_{'_'.join(sorted(languages))}.pickle")
+    state = load_prebuilt(path, digest.hexdigest(), lambda: TwoLanguageIdentifier.from_langid(languages).__getstate__())
+    return TwoLanguageIdentifier(**state)
+
 class MalteseFilter(TextProcessor):
-    def __init__(self, input_dir, output_dir=None, threshold=0.94, debug=False):
+    # Stages that can decide whether a text is kept, in the order they are tried (counted in stage_counts)
+    STAGES = ('empty', 'orthography', 'langid')
+
+    # Orthographic pre-classifier (see classify_orthography)
+    MALTESE_LETTERS = set('ċġħżĊĠĦŻ')
+    MALTESE_WORDS = {
+        # Function words, with their common spellings without Maltese letters
+        'li', "ta'", 'ma', 'mhux', 'biex', 'huwa', 'hija', 'huma', 'kien', 'kienet', 'jien', 'jiena', 'aħna', 'ahna',
+        'dan', 'din', 'dawn', 'ukoll', 'wkoll', 'imma', 'jekk', 'meta', 'fejn', 'għax', 'ghax', 'kif', 'minn', 'fuq',
+        'lil', 'ħafna', 'hafna', 'sew', 'tajjeb', 'grazzi', 'iva', 'xi', 'kollha', 'kollox', 'kollu', 'issa', 'qed',
+        'qiegħed', 'għandi', 'ghandi', 'għandu', 'ghandu', 'għandek', 'ghandek', 'nista', 'tista', 'jista', 'għaliex',
+        'anke', 'lanqas', 'mela', 'allura', 'bħal', 'bhal', 'bla', 'sabiex', 'hemm', 'hawn', 'hekk', 'jew', 'kont',
+        'qisu', "x'",
+        # Articles, on their own or joined to a preposition (e.g. 'il-' in 'il-kelb', 'tal-' in 'tal-Maltin')
+        'il-', 'l-', 'iċ-', 'in-', 'ir-', 'is-', 'it-', 'ix-', 'iż-', 'id-', 'tal-', 'taċ-', 'tad-', 'tan-', 'tar-',
+        'tas-', 'tat-', 'tax-', 'taż-', 'fil-', 'fiċ-', 'fid-', 'fin-', 'fir-', 'fis-', 'fit-', 'fix-', 'fiż-', 'bil-',
+        'mal-', 'sal-', 'mill-', 'għall-', 'ghall-', 'lill-', 'dal-', 'dil-', 'kull-'
+    }
+    ENGLISH_WORDS = {
+        'the', 'and', 'is', 'you', 'to', 'of', 'for', 'in', 'this', 'that', 'with', 'have', 'are', 'be', 'it', 'on',
+        'was', 'my', 'we', 'they', 'your', 'i', 'am', 'not', 'but', 'what', 'so', 'do', 'just', 'from', 'at', 'if',
+        'can', 'will', 'all', 'about', 'would', 'there', 'their', 'an', 'has', 'had', 'been', 'were', 'he', 'she',
+        'his', 'her', 'them', 'which', 'when', 'who', 'how', 'our', 'me', 'more', 'very', 'one', 'out', 'up', 'no',
+        'some', 'any', 'know', 'like'
+    }
+    # Words are split at punctuation, symbols and emojis, except for apostrophes and hyphens, which are kept
+    # at the end of the word before them (e.g. "x'" in "x'inhu", 'il-' in 'il-kelb')
+    WORD_REGEX = re.compile(r"[^\W_]+['-]?")
+    # A text is Maltese if it has at least this much Maltese evidence (Maltese words and words with
+    # Maltese letters, a single one of which is nearly decisive), and more of it than English words (so
+    # that Maltese with a few English words mixed in is still decided)...
+    MIN_MALTESE_EVIDENCE = 1
+    # ...and English if it has at least this many (distinct) English words, making up at least half of its
+    # words, and no Maltese evidence
+    MIN_ENGLISH_WORDS = 5
+
+    def __init__(self, input_dir, output_dir=None, threshold=0.94, debug=False, pre_classify=False):
         super().__init__(input_dir, output_dir)
 
         self.threshold = threshold
         self.debug = debug
+        # Decide the clear cases from their spelling and words before using langid (see classify_orthography)
+        self.pre_classify = pre_classify
+
+        # Gives the same results as langid's LanguageIdentifier restricted to English and Maltese
+        self.identifier = load_language_identifier(('en', 'mt'))
+
+        # Number of texts decided by each stage
+        self.stage_counts = Counter({stage: 0 for stage in self.STAGES})
+
+    def classify_orthography(self, text):
+        """
+        Classify a text from its letters and words alone, if it is a clear case.
 
-        self.identifier = LanguageIdentifier.from_modelstring(model, norm_probs=True)
-        self.identifier.set_languages(['en', 'mt'])
+        Args:
+            text: String to analyze
+
+        Returns:
+            'mt' or 'en', or None if the text is left for langid
+        """
+        words = self.WORD_REGEX.findall(text.lower().replace('’', "'"))
+
+        maltese_evidence = len(self.MALTESE_WORDS.intersection(words))
+        if not self.MALTESE_LETTERS.isdisjoint(text):
+            maltese_evidence += sum(1 for word in words if not self.MALTESE_LETTERS.isdisjoint(word))
+        english_words = len(self.ENGLISH_WORDS.intersection(words))
+
+        if maltese_evidence >= self.MIN_MALTESE_EVIDENCE and maltese_evidence > english_words:
+            return 'mt'
+        if english_words >= self.MIN_ENGLISH_WORDS and english_words * 2 >= len(words) and not maltese_evidence:
+            return 'en'
+        return None
+
+    def _decide_early(self, text):
+        """Decide a text without langid if possible, returning (bool, tuple) as is_maltese, or None."""
+        if not text:
+            self.stage_counts['empty'] += 1
+            return True, None
+
+        if self.pre_classify:
+            lang = self.classify_orthography(text)
+            if lang:
+                self.stage_counts['orthography'] += 1
+                return lang == 'mt', (lang, None)
+
+        self.stage_counts['langid'] += 1
+        return None
 
     def is_maltese(self, text):
         """
@@ -482,9 +2160,11 @@ class MalteseFilter(TextProcessor):
         Returns:
             bool: True if text should be kept (potentially Maltese), False if confidently English
             tuple: (language, probability) if debug is enabled, None otherwise
+                   (the probability is None for texts decided by classify_orthography)
         """
-        if not text:
-            return True, None
+        decision = self._decide_early(text)
+        if decision:
+            return decision
             
         lang, prob = self.identifier.classify(text)
         lang_info = (lang, prob)
@@ -492,13 +2172,35 @@ class MalteseFilter(TextProcessor):
         
         return not is_english, lang_info
 
+    def is_maltese_batch(self, texts):
+        """
+        Check many texts at once, with the same results as is_maltese.
+
+        Args:
+            texts: List of strings to analyze
+
+        Returns:
+            List of (bool, tuple) results as returned by is_maltese, in the order of the texts
+        """
+        results = [self._decide_early(text) for text in texts]
+        lang_infos = iter(self.identifier.classify_batch([text for text, result in zip(texts, results) if not result]))
+
+        for i, result in enumerate(results):
+            if not result:
+                lang, prob = lang_info = next(lang_infos)
+                is_english = (lang == 'en' and prob > self.threshold)
+                results[i] = (not is_english, lang_info)
+        return results
+
+    def process_directory(self):
+        super().process_directory()
+        print("Texts decided by each stage: " + ", ".join(f"{stage} {count}" for stage, count in self.stage_counts.items()))
+
     def process(self, data):
         filtered_posts = []
         
-        for post in data:
-            content = post.get('content', '')
-            is_maltese, lang_info = self.is_maltese(content)
-            
+        results = self.is_maltese_batch([post.get('content', '') for post in data])
+        for post, (is_maltese, lang_info) in zip(data, results):
             if is_maltese:
                 if self.debug:
                     post['lang_info'] = lang_info
@@ -510,9 +2212,125 @@ class TextCleaner(TextProcessor):
     """
     Preprocessor that cleans and normalizes text content in posts.
     """
+
+    # Character mappings, applied in a single str.translate pass:
+    # - Square brackets are replaced with round brackets (square brackets are reserved for placeholders)
+    # - Curly quotes are replaced with straight quotes
+    # - Punctuation emojis are replaced with their text equivalent (required for sentence splitting in later steps)
+    CHARACTERS = str.maketrans({
+        "[": "(", "]": ")",
+        "’": "'", "‘": "'", "“": '"', "”": '"',
+        "❓": "?", "❔": "?", "❗": "!", "❕": "!"
+    })
+    CHARACTERS_REGEX = re.compile("[" + re.escape("".join(chr(code) for code in CHARACTERS)) + "]")
+
+    # Punctuation emojis spanning two characters (emoji + variation selector)
+    PUNCTUATION_EMOJIS = {"⁉️": "!?", "‼️": "!!"}
+    PUNCTUATION_EMOJI_REGEX = re.compile("|".join(PUNCTUATION_EMOJIS))
+
+    NEWLINE_REGEX = re.compile(r'\s*\\n\s*')
+    PUNCTUATION_RUN_REGEX = re.compile(r'\.{2,}|[!?]{2,}')
+    PUNCTUATION_SPACING_REGEX = re.compile(r'(?<!\d)([.!?,])(?=[^\s])')
+    PARENTHESIS_REGEX = re.compile(r'\.\s+\)')
+
+    # Whitespace before trailing punctuation, or any other whitespace that isn't a single space
+    WHITESPACE_REGEX = re.compile(r'(\s+(?=[.!?,](?:\s|$)))|\s{2,}|[^\S ]')
+
+    # URLs and emails are replaced with a single character each while the rest of the text is cleaned
+    # (characters from the Supplementary Private Use Area, which no cleaning step matches)
+    MARK_BASE = 0x100000
+
     def __init__(self, input_dir, output_dir=None):
         super().__init__(input_dir, output_dir)
 
+    @staticmethod
+    def _normalize_punctuation_run(match):
+        run = match.group()
+        if run[0] == '.':
+            return '...' # ANY sequence of 2+ dots are converted to 3 dots
+        if '!' in run and '?' in run:
+            return '!?' # Replaces 2+ !? and question marks with !?
+        return run[:2] # Replaces 2+ exclamation or question marks with 2 marks
+
+    @staticmethod
+    def _normalize_whitespace(match):
+        return '' if match.group(1) else ' '
+
+    def _find_protected(self, text):
+        """
+        Find the URLs and emails in a text, which are left unchanged by cleaning.
+        This avoids full stops (.) in URLs and emails to be mistaken for sentence boundaries.
+
+        Args:
+            text: Input text string
+
+        Returns:
+            Lists of URL and email spans
+        """
+        urls = [match.span() for match in TextAnonymizer.URL_REGEX.finditer(text)] if 'http' in text else []
+        emails = [match.span() for match in TextAnonymizer.EMAIL_REGEX.finditer(text)] if '@' in text else []
+        return urls, emails
+
+    @staticmethod
+    def _find_all(text, string):
+        """Start positions of the non-overlapping occurrences of a string, as replaced by str.replace."""
+        positions = []
+        position = text.find(string)
+        while position != -1:
+            positions.append(position)
+            position = text.find(string, position + len(string))
+        return positions
+
+    def _protect(self, text, urls, emails):
+        """
+        Replace URLs and emails with mark characters, to be restored after cleaning.
+
+        Every occurrence of each distinct URL or email is replaced by its own mark, one after the other (URLs first).
+        This is done by cutting out their spans in a single pass, unless some occurrence isn't one of the spans
+        (e.g. when one URL contains another), in which case they are replaced with str.replace one by one instead.
+
+        Args:
+            text: Input text string
+            urls: Spans of the URLs in the text
+            emails: Spans of the emails in the text
+
+        Returns:
+            Text with marks (and square brackets replaced), and the str.translate table restoring the marks
+        """
+        text = text.replace("[", "(").replace("]", ")")
+
+        found = list(dict.fromkeys(text[start:end] for start, end in urls + emails))
+        marks = {string: chr(self.MARK_BASE + i) for i, string in enumerate(found)}
+        restore = {ord(mark): string for string, mark in marks.items()}
+
+        # Emails overlapping a URL are no longer in the text once URLs are replaced
+        spans = list(urls)
+        i = 0
+        for start, end in emails:
+            while i < len(urls) and urls[i][1] <= start:
+                i += 1
+            if i == len(urls) or urls[i][0] >= end:
+                spans.append((start, end))
+        spans.sort()
+
+        starts = {}
+        for start, end in spans:
+            starts.setdefault(text[start:end], []).append(start)
+
+        if len(spans) < len(urls) + len(emails) or any(self._find_all(text, string) != starts[string] for string in found):
+            for string, mark in marks.items():
+                text = text.replace(string, mark)
+            return text, restore
+
+        pieces = []
+        last_end = 0
+        for start, end in spans:
+            pieces.append(text[last_end:start])
+            pieces.append(marks[text[start:end]])
+            last_end = end
+        pieces.append(text[last_end:])
+        return ''.join(pieces), restore
+
     def clean_text(self, text):
         """
         Clean and normalize a single text string.
@@ -526,68 +2344,41 @@ class TextCleaner(TextProcessor):
 
         if not isinstance(text, str) or not text:
             return text
-        
-        # Replace square brackets with round brackets (square brackets are reserved for placeholders)
-        text = text.replace("[", "(")
-        text = text.replace("]", ")")
-
-        # Catch URLs and Emails and replace them with a placeholder (to be restored after cleaning)
-        # This avoids full stops (.) in URLs and emails to be mistaken for sentence boundaries
-        urls = re.findall(TextAnonymizer.PATTERNS['[URL]'], text) # Catch URLs
-        emails = re.findall(TextAnonymizer.PATTERNS['[EMAIL]'], text) # Catch emails
-
-        # Replace URLs with placeholders
-        for i, url in enumerate(urls):
-            text = text.replace(url, f'[URL_CLEANING_PLACEHOLDER_{i}]')
-
-        # Replace emails with placeholders
-        for i, email in enumerate(emails):
-            text = text.replace(email, f'[EMAIL_CLEANING_PLACEHOLDER_{i}]')
-
-        # Replace curly quotes with straight quotes
-        text = text.replace("’", "'")
-        text = text.replace("‘", "'")
-
-        text = text.replace("“", '"')
-        text = text.replace("”", '"')
-
-        # Replace punctuation emojis with their text equivalent (required for sentence splitting in later steps)
-        text = text.replace("⁉️", "!?")
-        text = text.replace("‼️", "!!")
-        text = text.replace("❓", "?")
-        text = text.replace("❔", "?")
-        text = text.replace("❗", "!")
-        text = text.replace("❕", "!")
+
+        # Square brackets are replaced with round brackets before URLs and emails are found in the original
+        # order of steps, but both kinds of brackets are URL characters and neither are email characters,
+        # so the same URLs and emails are found before replacing them
+        urls, emails = self._find_protected(text)
+        restore = None
+        if urls or emails:
+            text, restore = self._protect(text, urls, emails)
+
+        if self.CHARACTERS_REGEX.search(text):
+            text = text.translate(self.CHARACTERS)
+
+        if '\ufe0f' in text: # Variation selector of the punctuation emojis
+            text = self.PUNCTUATION_EMOJI_REGEX.sub(lambda match: self.PUNCTUATION_EMOJIS[match.group()], text)
 
         # Handle newlines first
-        text = re.sub(r'\s*\\n\s*', ' ', text)
-        
-        text = re.sub(r'\.{2,}', '...', text)  # ANY sequence of 2+ dots are converted to 3 dots
-        
+        if '\\n' in text:
+            text = self.NEWLINE_REGEX.sub(' ', text)
+
         # Normalize multiple punctuation marks to maximum of 2 consecutive marks
-        text = re.sub(r'!{2,}', '!!', text)     # Replaces 2+ exclamation marks with 2 exclamation marks
-        text = re.sub(r'\?{2,}', '??', text)    # Replaces 2+ question marks with 2 question marks
-        text = re.sub(r'(?:(?=[!?]*\?[!?]*!|(?=[!?]*![!?]*\?))[!?]+)', '!?', text) # Replaces 2+ !? and question marks with !?
+        text = self.PUNCTUATION_RUN_REGEX.sub(self._normalize_punctuation_run, text)
 
         # Fix spacing after punctuation (excluding numbers)
-        text = re.sub(r'(?<!\d)([.!?,])(?=[^\s])', r'\1 ', text)
-        
-        # Fix specific case of wrapped text with trailing punctuation
-        text = re.sub(r'\s+([.!?,])(?=\s|$)', r'\1', text)
+        text = self.PUNCTUATION_SPACING_REGEX.sub(r'\1 ', text)
 
-        # Remove space between full stops and closing paranthesis
-        text = re.sub(r'\.\s+\)', '.)', text)
+        # Fix specific case of wrapped text with trailing punctuation, and clean up any multiple spaces
+        text = self.WHITESPACE_REGEX.sub(self._normalize_whitespace, text)
 
-        # Clean up any multiple spaces  
-        text = re.sub(r'\s+', ' ', text)
-        
-        # Restore URLs
-        for i, url in enumerate(urls):
-            text = text.replace(f'[URL_CLEANING_PLACEHOLDER_{i}]', url)
+        # Remove space between full stops and closing paranthesis
+        if ')' in text:
+            text = self.PARENTHESIS_REGEX.sub('.)', text)
 
-        # Restore emails
-        for i, email in enumerate(emails):
-            text = text.replace(f'[EMAIL_CLEANING_PLACEHOLDER_{i}]', email)
+        # Restore URLs and emails
+        if restore:
+            text = text.translate(restore)
 
         return text.strip()
     
@@ -610,6 +2401,172 @@ class TextCleaner(TextProcessor):
                 
         return processed_data
 
+# Span of an identifier found by TextAnonymizer (e.g. Entity('URL', 5, 23))
+Entity = namedtuple('Entity', ['type', 'start', 'end'])
+
+class NameMatcher:
+    """
+    Case-insensitive whole-word matcher for a list of names, giving the same matches as the regex
+    (?i)\\b(?:name1|name2|...)\\b with longer names tried first.
+
+    A match can only start and end at a word boundary, so it always covers whole runs of word or non-word
+    characters. Texts are split into such runs, and each run that starts a name is extended by the
+    following runs and looked up in a set of names. Matching is linear in the length of the text and
+    independent of the number of names (multi-word names such as 'De Battista' take one lookup per run).
+    """
+
+    RUN_REGEX = re.compile(r'\w+|\W+')
+
+    # Characters matched case-insensitively by the regex engine, but not lowercased to the same character by str.lower()
+    CASE_FOLDING = str.maketrans({'İ': 'i', 'ı': 'i', 'ſ': 's'})
+
+    def __init__(self, names):
+        self.names = set()
+        self.max_runs = {} # First run of the names -> largest number of runs in a name starting with it
+
+        for name in names:
+            name = self.fold(name)
+            runs = self.RUN_REGEX.findall(name)
+            if runs:
+                self.names.add(name)
+                self.max_runs[runs[0]] = max(self.max_runs.get(runs[0], 0), len(runs))
+
+        # The equivalent regex pattern (names should be given longest first)
+        self.pattern = r'(?i)\b(?:' + '|'.join(re.escape(name) for name in names) + r')\b'
+
+    @classmethod
+    def from_state(cls, state):
+        """Recreate a NameMatcher from its attributes (as saved in a prebuilt file)."""
+        matcher = cls.__new__(cls)
+        matcher.__dict__.update(state)
+        return matcher
+
+    @classmethod
+    def fold(cls, text):
+        """Lowercase a text for matching (each character is replaced by exactly one character)."""
+        return text.translate(cls.CASE_FOLDING).lower()
+
+    def finditer(self, text):
+        """
+        Find the names in a text.
+
+        Args:
+            text: Input text string
+
+        Yields:
+            (start, end) span of each name, from left to right
+        """
+        runs = self.RUN_REGEX.findall(self.fold(text))
+        if not runs:
+            return
+
+        # Runs alternate between word and non-word characters, and the ends of the text are only
+        # word boundaries next to a word run
+        first_is_word = runs[0][0].isalnum() or runs[0][0] == '_' # Same characters as \w
+        last = len(runs) - 1
+
+        i = 0
+        position = 0
+        while i <= last:
+            run = runs[i]
+            max_runs = self.max_runs.get(run)
+            if max_runs and (i > 0 or first_is_word):
+                # Try the longest candidate first
+                for j in range(min(i + max_runs - 1, last), i - 1, -1):
+                    if j == last and ((last % 2 == 0) != first_is_word):
+                        continue
+                    candidate = ''.join(runs[i:j + 1])
+                    if candidate in self.names:
+                        end = position + len(candidate)
+                        yield position, end
+                        position = end
+                        i = j + 1
+                        break
+                else:
+                    position += len(run)
+                    i += 1
+            else:
+                position += len(run)
+                i += 1
+
+# Directory containing names.txt and surnames.txt
+DEFAULT_NAMES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'names')
+
+# Names and surnames in the list that caused false positives when filtering
+NAME_BLACKLIST = [
+    'vera', 'mara', 'beda', 'tan', 'dawn', 'fortunata', 'all', 'tipo', 'white', 'gili', 'shana', 'quick', 'bin', 'ili', 'kind', 'venera', 'madonna', 'mia', 'best', 'king', 'kind', 'din', 'gili'
+]
+
+# Prebuilt NameMatchers, saved in the names directory the first time they are built
+NAME_MATCHERS_FILENAME = 'name_matchers.pickle'
+
+# Changed whenever NameMatcher or the filtering of the name files changes, so that older prebuilt files are rebuilt
+NAME_MATCHERS_VERSION = 2
+
+def read_name_file(path):
+    """
+    Read a name file, removing duplicates, blacklisted names and names of 2 characters or fewer.
+
+    Returns:
+        List of names, longest first (e.g. 'Maria-Theresa' before 'Maria')
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        names = {line.strip() for line in f if line.strip()}
+
+    names = [name for name in names if name.lower() not in NAME_BLACKLIST and len(name) > 2]
+    names.sort(key=lambda name: (-len(name), name))
+    return names
+
+def build_name_matchers(names_dir):
+    """
+    Build the NameMatchers for the names and surnames in a directory.
+
+    Returns:
+        dict: Placeholder ('[NAME]' or '[SURNAME]') -> NameMatcher, empty if the name files cannot be loaded
+    """
+    try:
+        names = read_name_file(os.path.join(names_dir, 'names.txt'))
+        surnames = read_name_file(os.path.join(names_dir, 'surnames.txt'))
+    except Exception as e:
+        print(f"Error loading name files: {e}")
+        return {}
+
+    if not (names and surnames):
+        return {}
+    return OrderedDict([('[NAME]', NameMatcher(names)), ('[SURNAME]', NameMatcher(surnames))])
+
+def name_files_digest(names_dir):
+    """Hash of the name files (and filtering settings) that the name matchers are built from."""
+    digest = hashlib.sha256(f"{NAME_MATCHERS_VERSION} {sorted(NAME_BLACKLIST)}".encode('utf-8'))
+    for filename in ('names.txt', 'surnames.txt'):
+        with open(os.path.join(names_dir, filename), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+@lru_cache(maxsize=None)
+def _load_name_matchers(names_dir):
+    try:
+        digest = name_files_digest(names_dir)
+    except OSError as e:
+        print(f"Error loading name files: {e}")
+        return {}
+
+    path = os.path.join(names_dir, NAME_MATCHERS_FILENAME)
+    states = load_prebuilt(path, digest, lambda: {placeholder: vars(matcher) for placeholder, matcher in build_name_matchers(names_dir).items()})
+    return OrderedDict((placeholder, NameMatcher.from_state(state)) for placeholder, state in states.items())
+
+def load_name_matchers(names_dir=DEFAULT_NAMES_DIR):
+    """
+    Load the NameMatchers for a names directory, sharing one set per directory within the process.
+
+    The matchers are loaded from the prebuilt file in the directory (name_matchers.pickle) if it was built
+    from the same name files, and otherwise built and saved there for later processes.
+
+    Returns:
+        dict: Placeholder ('[NAME]' or '[SURNAME]') -> NameMatcher, empty if the name files cannot be loaded
+    """
+    return _load_name_matchers(os.path.abspath(names_dir))
+
 class TextAnonymizer(TextProcessor):
     """
     Preprocessor that anonymizes text by replacing identifiers with placeholders.
@@ -623,50 +2580,121 @@ class TextAnonymizer(TextProcessor):
             ('[PHONE]', r'\+?\d{1,3}[-.\s]?\(?\d{2,4}\)?[-.\s]?\d{2,4}[-.\s]?\d{2,4}'),
             ('[USER]', r'@\w+')])
 
-    def __init__(self, input_dir, output_dir=None, names_dir='./classes/names/'):
-        super().__init__(input_dir, output_dir)
+    # Compiled URL and email patterns (also used by TextCleaner to leave URLs and emails unchanged)
+    URL_REGEX = re.compile(PATTERNS['[URL]'])
+    EMAIL_REGEX = re.compile(PATTERNS['[EMAIL]'])
 
-        # Names and surnames in the list that caused false positives when filtering
-        NAME_BLACKLIST = [
-            'vera', 'mara', 'beda', 'tan', 'dawn', 'fortunata', 'all', 'tipo', 'white', 'gili', 'shana', 'quick', 'bin', 'ili', 'kind', 'venera', 'madonna', 'mia', 'best', 'king', 'kind', 'din', 'gili'
-        ]
+    # Substrings that a text must contain for a pattern to match
+    REQUIRED_SUBSTRINGS = {'[URL]': 'http', '[EMAIL]': '@', '[USER]': '@'}
 
-        # Load names and surnames
-        try:
-            if names_dir.endswith('/'):
-                names_dir = names_dir.rstrip('/')
+    # Stands in for the identifiers already found while looking for the next pattern. Like a placeholder,
+    # it is not a word character, whitespace or part of any pattern.
+    MASK = '\x00'
 
-            with open(f'{names_dir}/names.txt', 'r', encoding='utf-8') as f:
-                names = [line.strip() for line in f if line.strip()]
-            
-            with open(f'{names_dir}/surnames.txt', 'r', encoding='utf-8') as f:
-                surnames = [line.strip() for line in f if line.strip()]
+    def __init__(self, input_dir, output_dir=None, names_dir=DEFAULT_NAMES_DIR):
+        super().__init__(input_dir, output_dir)
+        self.names_dir = names_dir
+        self._use_name_matchers()
+
+    def _use_name_matchers(self):
+        # Names are matched with NameMatchers shared by all anonymizers rather than the (much slower)
+        # patterns, with the same result
+        self.name_matchers = load_name_matchers(self.names_dir)
+        for placeholder, matcher in self.name_matchers.items():
+            # Ordered to prevent partial replacements
+            self.PATTERNS[placeholder] = matcher.pattern
+
+    # The name matchers are shared within the process, so only the names directory is kept
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('name_matchers', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # Anonymizers unpickled from older models have no names_dir attribute (and keep using the patterns)
+        if 'names_dir' in state:
+            # The model may have been saved on another machine or run from another directory
+            if not os.path.isdir(self.names_dir):
+                self.names_dir = DEFAULT_NAMES_DIR
+            self._use_name_matchers()
+
+    def find_entities(self, text):
+        """
+        Find the identifiers in a text, with the same precedence as replacing each pattern in turn.
 
-            # Remove duplicates
-            names = list(set(names))
-            surnames = list(set(surnames))
+        Each pattern is matched against the text with the identifiers found by the previous patterns masked
+        out, so that it finds exactly what it would find after their replacement (placeholders never match a
+        later pattern). Patterns that need a substring the text doesn't contain (e.g. '@' for emails) are skipped.
 
-            # Filter out unwanted names
-            names = [name for name in names if name.lower() not in NAME_BLACKLIST]
-            surnames = [surname for surname in surnames if surname.lower() not in NAME_BLACKLIST]
+        Args:
+            text: Input text string
 
-            # Keep only names longer than 2 characters
-            names = [name for name in names if len(name) > 2]
-            surnames = [surname for surname in surnames if len(surname) > 2]
+        Returns:
+            List of Entity(type, start, end) spans in the text (e.g. Entity('URL', 5, 23)), sorted by start
+        """
+        # Anonymizers unpickled from older models have no name_matchers attribute
+        name_matchers = getattr(self, 'name_matchers', {})
+
+        entities = []
+        masked = text
+        for placeholder, pattern in self.PATTERNS.items():
+            required = self.REQUIRED_SUBSTRINGS.get(placeholder)
+            if required and required not in text:
+                continue
+
+            if placeholder in name_matchers:
+                spans = list(name_matchers[placeholder].finditer(masked))
+            else:
+                spans = [match.span() for match in re.finditer(pattern, masked)]
+            if not spans:
+                continue
+
+            entity_type = placeholder[1:-1]
+            entities.extend(Entity(entity_type, start, end) for start, end in spans)
+
+            # Mask the identifiers found, keeping the offsets unchanged
+            pieces = []
+            last_end = 0
+            for start, end in spans:
+                pieces.append(masked[last_end:start])
+                pieces.append(self.MASK * (end - start))
+                last_end = end
+            pieces.append(masked[last_end:])
+            masked = ''.join(pieces)
+
+        entities.sort(key=lambda entity: entity.start)
+        return entities
+
+    def anonymize_with_spans(self, text):
+        """
+        Anonymize a single text string, also returning where the placeholders are.
 
-        except Exception as e:
-            print(f"Error loading name files: {e}")
-            names = []
-            surnames = []
-        
-        # Create name patterns
-        if names and surnames:
-            name_pattern = r'(?i)\b(?:' + '|'.join(re.escape(name) for name in names) + r')\b'
-            surname_pattern = r'(?i)\b(?:' + '|'.join(re.escape(surname) for surname in surnames) + r')\b'
+        Args:
+            text: Input text string
 
-            # Ordered to prevent partial replacements
-            self.PATTERNS['[NAME]'] = name_pattern
-            self.PATTERNS['[SURNAME]'] = surname_pattern
+        Returns:
+            Anonymized text string, and list of Entity(type, start, end) spans of its placeholders
+        """
+        if not isinstance(text, str) or not text:
+            return text, []
+
+        pieces = []
+        placeholders = []
+        position = 0
+        last_end = 0
+        for entity_type, start, end in self.find_entities(text):
+            piece = text[last_end:start]
+            placeholder = f"[{entity_type}]"
+            pieces.append(piece)
+            pieces.append(placeholder)
+            position += len(piece)
+            placeholders.append(Entity(entity_type, position, position + len(placeholder)))
+            position += len(placeholder)
+            last_end = end
+        pieces.append(text[last_end:])
+
+        return ''.join(pieces), placeholders
 
     def anonymize_text(self, text):
         """
@@ -678,13 +2706,7 @@ class TextAnonymizer(TextProcessor):
         Returns:
             Cleaned text string
         """
-        if not isinstance(text, str) or not text:
-            return text
-        
-        for replacement, pattern in self.PATTERNS.items():
-            text = re.sub(pattern, replacement, text)
-        
-        return text
+        return self.anonymize_with_spans(text)[0]
     
     def process(self, data):
         """
@@ -0,0 +1,348 @@
+"""
+Benchmarks the cleaning pipeline stages on the scraped data, and checks that their output still matches
+the data saved by the pipeline (e.g. TextCleaner on data/01_raw must give exactly data/02_cleaned, and
+SentenceSplitter on data/03_anonymized must give exactly data/04_sentences).
+
+The reduced language identifier used by MalteseFilter is also compared with the full langid model it
+was reduced from, which must classify every sentence the same way.
+
+Stage files are also written and read back as JSON arrays and as JSON Lines, which must give the same
+posts, to compare the time and peak memory of the two formats.
+
+The whole pipeline is run from data/01_raw both as separate directory passes and as a single Pipeline
+pass, which must save the same final dataset (and the same stage files, when they are checkpointed).
+The report of the Pipeline pass shows the time each stage takes.
+With --workers, the processors and the pipeline are also run in that many worker processes, which must
+save exactly the same files as a single process.
+
+Incremental runs of the pipeline (after adding or changing raw files) must save the same final dataset
+as a full run.
+
+Name anonymization is checked against the name regexes in TextAnonymizer.PATTERNS instead, since the
+saved data was anonymized with regexes that tried names in an arbitrary order (so that e.g.
+'Zammit Field' could become '[SURNAME] [SURNAME]' rather than '[SURNAME]'). Running the regexes over
+the corpus takes a while.
+
+Usage:
+    python benchmark.py
+    python benchmark.py --repeat 10
+    python benchmark.py --stages cleaning sentences
+    python benchmark.py --stages parallel --workers 4
+"""
+import argparse
+import filecmp
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import tracemalloc
+from functools import partial
+
+from classes.cleaning import TextCleaner, TextAnonymizer, SentenceSplitter, MalteseFilter, JsonCombiner, Pipeline, read_stage_file, write_stage_file, MANIFEST_FILENAME, format_run_report
+from langid.langid import LanguageIdentifier, model
+from config import DATA_DIRECTORIES as DIRS
+from config import MALTESE_PRE_CLASSIFY
+
+
+def load_stage(directory):
+    """Load every JSON (or JSON Lines) file of a stage directory, keyed by filename."""
+    data = {}
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith(('.json', '.jsonl')):
+            data[filename] = list(read_stage_file(os.path.join(directory, filename)))
+    return data
+
+def check_stage(processor, input_data, expected_data):
+    """
+    Process every file of a stage and compare the result with the saved output.
+
+    Returns:
+        List of (filename, index of the first differing post) for the files that differ
+    """
+    mismatches = []
+    for filename, data in input_data.items():
+        processed = processor.process(data)
+        expected = expected_data.get(filename, [])
+        if processed != expected:
+            index = next((i for i, (a, b) in enumerate(zip(processed, expected)) if a != b), min(len(processed), len(expected)))
+            mismatches.append((filename, index))
+    return mismatches
+
+def time_function(function, texts, repeat):
+    """Returns the best time (in seconds) out of `repeat` runs of `function` over all texts."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in texts:
+            function(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def report(name, texts, seconds):
+    size = sum(len(text.encode('utf-8')) for text in texts) / 1e6
+    print(f"{name}: {len(texts)} posts ({size:.2f} MB) in {seconds * 1000:.1f} ms"
+          f" - {len(texts) / seconds:,.0f} posts/s, {size / seconds:.2f} MB/s")
+
+def benchmark_cleaning(repeat):
+    raw = load_stage(DIRS["raw"])
+    cleaner = TextCleaner(DIRS["raw"], DIRS["cleaned"])
+
+    mismatches = check_stage(cleaner, raw, load_stage(DIRS["cleaned"]))
+    for filename, index in mismatches:
+        print(f"TextCleaner output differs from 02_cleaned/{filename} at post {index}")
+
+    texts = [post['content'] for data in raw.values() for post in data if post.get('content')]
+    report("TextCleaner.clean_text", texts, time_function(cleaner.clean_text, texts, repeat))
+    return not mismatches
+
+def anonymize_with_regexes(anonymizer, text):
+    """TextAnonymizer.anonymize_text using the regexes of every pattern, including the names."""
+    for replacement, pattern in anonymizer.PATTERNS.items():
+        text = re.sub(pattern, replacement, text)
+    return text
+
+def benchmark_anonymization(repeat):
+    anonymizer = TextAnonymizer(DIRS["cleaned"], DIRS["anonymized"])
+    texts = [post['content'] for data in load_stage(DIRS["cleaned"]).values() for post in data if post.get('content')]
+
+    start = time.perf_counter()
+    expected = [anonymize_with_regexes(anonymizer, text) for text in texts]
+    report("TextAnonymizer with name regexes", texts, time.perf_counter() - start)
+
+    mismatches = [i for i, text in enumerate(texts) if anonymizer.anonymize_text(text) != expected[i]]
+    for i in mismatches:
+        print(f"TextAnonymizer output differs from the name regexes for post {i}")
+
+    report("TextAnonymizer.anonymize_text", texts, time_function(anonymizer.anonymize_text, texts, repeat))
+    return not mismatches
+
+def benchmark_sentences(repeat, largest=3):
+    splitter = SentenceSplitter(DIRS["anonymized"], DIRS["sentences"])
+    anonymized = load_stage(DIRS["anonymized"])
+
+    mismatches = check_stage(splitter, anonymized, load_stage(DIRS["sentences"]))
+    for filename, index in mismatches:
+        print(f"SentenceSplitter output differs from 04_sentences/{filename} at sentence {index}")
+
+    texts = [post['content'] for data in anonymized.values() for post in data if post.get('content')]
+    report("SentenceSplitter.split_sentences", texts, time_function(splitter.split_sentences, texts, repeat))
+
+    # The largest raw files have the longest posts
+    filenames = sorted(os.listdir(DIRS["raw"]), key=lambda filename: os.path.getsize(os.path.join(DIRS["raw"], filename)), reverse=True)
+    raw = load_stage(DIRS["raw"])
+    for filename in filenames[:largest]:
+        texts = [post['content'] for post in raw.get(filename, []) if post.get('content')]
+        report(f"SentenceSplitter.split_sentences on 01_raw/{filename}", texts, time_function(splitter.split_sentences, texts, repeat))
+    return not mismatches
+
+def benchmark_language(repeat):
+    start = time.perf_counter()
+    language_filter = MalteseFilter(DIRS["sentences"], DIRS["maltese"])
+    print(f"MalteseFilter loaded in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    start = time.perf_counter()
+    identifier = LanguageIdentifier.from_modelstring(model, norm_probs=True)
+    identifier.set_languages(['en', 'mt'])
+    print(f"langid model loaded in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    sentences = load_stage(DIRS["sentences"])
+    mismatches = check_stage(language_filter, sentences, load_stage(DIRS["maltese"]))
+    for filename, index in mismatches:
+        print(f"MalteseFilter output differs from 05_maltese/{filename} at sentence {index}")
+
+    texts = [post['content'] for data in sentences.values() for post in data if post.get('content')]
+    for text in texts:
+        lang, prob = identifier.classify(text)
+        if language_filter.is_maltese(text)[0] == (lang == 'en' and prob > language_filter.threshold):
+            mismatches.append(text)
+            print(f"MalteseFilter classifies {text!r} differently from langid")
+
+    report("langid LanguageIdentifier.classify", texts, time_function(identifier.classify, texts, repeat))
+    if language_filter.is_maltese_batch(texts) != [language_filter.is_maltese(text) for text in texts]:
+        mismatches.append(None)
+        print("MalteseFilter.is_maltese_batch results differ from is_maltese")
+
+    report("MalteseFilter.is_maltese", texts, time_function(language_filter.is_maltese, texts, repeat))
+    report("MalteseFilter.is_maltese_batch", texts, time_function(language_filter.is_maltese_batch, [texts], repeat))
+
+    # The orthographic pre-classifier decides some texts differently from langid (on purpose), so it is
+    # only compared with it
+    pre_classifier = MalteseFilter(DIRS["sentences"], DIRS["maltese"], pre_classify=True)
+    changed = sum(1 for (kept, _), (pre_kept, _) in zip(language_filter.is_maltese_batch(texts), pre_classifier.is_maltese_batch(texts)) if kept != pre_kept)
+    counts = ", ".join(f"{stage} {count}" for stage, count in pre_classifier.stage_counts.items())
+    print(f"With the orthographic pre-classifier: {counts} ({changed} decisions differ from langid)")
+    report("MalteseFilter.is_maltese_batch with the pre-classifier", texts, time_function(pre_classifier.is_maltese_batch, [texts], repeat))
+    return not mismatches
+
+def measure(function, repeat):
+    """Returns the best time (in seconds) out of `repeat` runs of `function`, and its peak memory use (in bytes)."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+def benchmark_files(repeat):
+    mismatches = []
+    with tempfile.TemporaryDirectory() as directory:
+        for stage in ("raw", "sentences"):
+            for filename, data in load_stage(DIRS[stage]).items():
+                name = os.path.splitext(filename)[0]
+                for extension in ('.json', '.jsonl'):
+                    path = os.path.join(directory, name + extension)
+                    write_stage_file(path, data)
+                    if list(read_stage_file(path)) != data:
+                        mismatches.append((filename, extension))
+                        print(f"{stage}/{filename} differs after being saved as {extension}")
+
+                # A stage reads every post of a file and writes it back out, as TextProcessor._process_file does
+                json_path = os.path.join(directory, name + '.json')
+                jsonl_path = os.path.join(directory, name + '.jsonl')
+                json_seconds, json_peak = measure(lambda: write_stage_file(json_path + '.out', read_stage_file(json_path)), repeat)
+                jsonl_seconds, jsonl_peak = measure(lambda: write_stage_file(jsonl_path + '.out', read_stage_file(jsonl_path)), repeat)
+                print(f"{stage}/{name}: {len(data)} posts, JSON {json_seconds * 1000:.1f} ms ({json_peak / 1024:.0f} KiB peak), "
+                      f"JSON Lines {jsonl_seconds * 1000:.1f} ms ({jsonl_peak / 1024:.0f} KiB peak), "
+                      f"{os.path.getsize(json_path) / 1024:.0f} KiB vs {os.path.getsize(jsonl_path) / 1024:.0f} KiB")
+    return not mismatches
+
+def create_stages(directory, raw_dir=DIRS["raw"]):
+    """Processors for each stage of the pipeline (set up as in main.py), saving to subdirectories of directory, and the combiner."""
+    directories = [raw_dir] + [os.path.join(directory, stage) for stage in ("cleaned", "anonymized", "sentences", "maltese", "final")]
+    processors = [processor_class(input_dir, output_dir) for processor_class, input_dir, output_dir
+                  in zip([TextCleaner, TextAnonymizer, SentenceSplitter, partial(MalteseFilter, pre_classify=MALTESE_PRE_CLASSIFY)], directories, directories[1:])]
+    return processors, JsonCombiner(directories[-2], directories[-1])
+
+def same_files(directory, other_directory):
+    """Whether two directories contain the same files with the same contents (apart from their manifests)."""
+    filenames = sorted(filename for filename in os.listdir(directory) if filename != MANIFEST_FILENAME)
+    return filenames == sorted(filename for filename in os.listdir(other_directory) if filename != MANIFEST_FILENAME) and \
+        all(filecmp.cmp(os.path.join(directory, filename), os.path.join(other_directory, filename), shallow=False) for filename in filenames)
+
+def benchmark_pipeline(repeat):
+    # Each run processes the whole corpus, so every variant is only timed once
+    mismatches = []
+    with tempfile.TemporaryDirectory() as directory:
+        separate_dir, fused_dir, checkpoint_dir = (os.path.join(directory, name) for name in ("separate", "fused", "checkpoints"))
+
+        processors, combiner = create_stages(separate_dir)
+        start = time.perf_counter()
+        for processor in processors:
+            processor.process_directory()
+        combiner.process_directory()
+        print(f"Separate directory passes: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+        processors, combiner = create_stages(fused_dir)
+        pipeline = Pipeline(processors, combiner)
+        start = time.perf_counter()
+        pipeline.run()
+        print(f"Pipeline: {(time.perf_counter() - start) * 1000:.1f} ms")
+        print(format_run_report(pipeline.report()))
+        if not same_files(os.path.join(fused_dir, "final"), os.path.join(separate_dir, "final")):
+            mismatches.append("final")
+
+        processors, combiner = create_stages(checkpoint_dir)
+        start = time.perf_counter()
+        Pipeline(processors, combiner, checkpoints=processors).run()
+        print(f"Pipeline saving every stage: {(time.perf_counter() - start) * 1000:.1f} ms")
+        for stage in sorted(os.listdir(separate_dir)):
+            if not same_files(os.path.join(checkpoint_dir, stage), os.path.join(separate_dir, stage)):
+                mismatches.append(stage)
+
+    for stage in mismatches:
+        print(f"Pipeline output differs from the separate passes in {stage}/")
+    return not mismatches
+
+def benchmark_parallel(repeat, workers):
+    # Each run processes the whole corpus, so every variant is only timed once
+    mismatches = []
+    with tempfile.TemporaryDirectory() as directory:
+        single_dir, parallel_dir = os.path.join(directory, "single"), os.path.join(directory, "parallel")
+        timings = {}
+        for output_dir, run_workers in ((single_dir, 1), (parallel_dir, workers)):
+            processors, combiner = create_stages(output_dir)
+            for processor in processors:
+                start = time.perf_counter()
+                processor.process_directory(workers=run_workers)
+                timings[f"{processor.__class__.__name__}.process_directory", run_workers] = time.perf_counter() - start
+
+            processors, combiner = create_stages(os.path.join(output_dir, "pipeline"))
+            start = time.perf_counter()
+            Pipeline(processors, combiner, checkpoints=processors).run(workers=run_workers)
+            timings["Pipeline.run", run_workers] = time.perf_counter() - start
+
+        for name in dict.fromkeys(name for name, _ in timings):
+            print(f"{name}: {timings[name, 1] * 1000:.1f} ms in 1 process, {timings[name, workers] * 1000:.1f} ms in {workers}")
+
+        stages = [stage for stage in sorted(os.listdir(single_dir)) if stage != "pipeline"]
+        stages += [os.path.join("pipeline", stage) for stage in sorted(os.listdir(os.path.join(single_dir, "pipeline")))]
+        for stage in stages:
+            if not same_files(os.path.join(parallel_dir, stage), os.path.join(single_dir, stage)):
+                mismatches.append(stage)
+
+    for stage in mismatches:
+        print(f"Output of {workers} worker processes differs from a single process in {stage}/")
+    return not mismatches
+
+def benchmark_incremental(repeat):
+    # Each run processes the whole corpus (or the part of it that changed), so every run is only timed once
+    mismatches = []
+    with tempfile.TemporaryDirectory() as directory:
+        raw_dir, incremental_dir = os.path.join(directory, "raw"), os.path.join(directory, "incremental")
+        filenames = sorted(filename for filename in os.listdir(DIRS["raw"]) if filename.endswith(('.json', '.jsonl')))
+        os.makedirs(raw_dir)
+        for filename in filenames[1:-1]:
+            shutil.copy(os.path.join(DIRS["raw"], filename), raw_dir)
+
+        # The groups before and after all the others are added in turn, and the last stage is checkpointed
+        changes = [("Full run", None), ("Unchanged", None), (f"Adding {filenames[-1]}", filenames[-1]), (f"Adding {filenames[0]}", filenames[0])]
+        for run, (name, filename) in enumerate(changes):
+            if filename:
+                shutil.copy(os.path.join(DIRS["raw"], filename), raw_dir)
+
+            processors, combiner = create_stages(incremental_dir, raw_dir)
+            start = time.perf_counter()
+            Pipeline(processors, combiner, checkpoints=processors[-1:]).run()
+            print(f"{name}: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+            processors, combiner = create_stages(os.path.join(directory, f"full{run}"), raw_dir)
+            Pipeline(processors, combiner).run()
+            if not same_files(os.path.join(incremental_dir, "final"), os.path.join(directory, f"full{run}", "final")):
+                mismatches.append(name)
+
+    for name in mismatches:
+        print(f"Incremental run differs from a full run ({name})")
+    return not mismatches
+
+STAGES = {
+    'cleaning': benchmark_cleaning,
+    'anonymization': benchmark_anonymization,
+    'sentences': benchmark_sentences,
+    'language': benchmark_language,
+    'files': benchmark_files,
+    'pipeline': benchmark_pipeline,
+    'parallel': benchmark_parallel,
+    'incremental': benchmark_incremental,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the cleaning pipeline stages and check their output against the saved data.")
+    parser.add_argument('--repeat', type=int, default=5, help="Number of timed runs (the best one is reported)")
+    parser.add_argument('--stages', nargs='*', choices=list(STAGES), default=list(STAGES), help="Stages to benchmark")
+    parser.add_argument('--workers', type=int, default=max(2, os.cpu_count() or 1), help="Number of worker processes for the parallel stage")
+    args = parser.parse_args()
+
+    stages = dict(STAGES, parallel=partial(benchmark_parallel, workers=args.workers))
+    results = [stages[stage](args.repeat) for stage in args.stages]
+    if not all(results):
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -7,15 +7,483 @@ from pathlib import Path
 import json
 import os
 import re
-from collections import OrderedDict
+from collections import Counter, OrderedDict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import chain, groupby, islice
+from operator import itemgetter
+import numpy as np
+import hashlib
+import pickle
+import math
+from array import array
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+try:
+    import resource  # Not available on Windows
+except ImportError:
+    resource = None
+
+# File extension of each stage file format: JSON arrays (as saved by the scrapers) and JSON Lines (one
+# post per line, which can be read and written one post at a time)
+STAGE_FORMATS = {'json': '.json', 'jsonl': '.jsonl'}
+
+# Number of posts read or written at once, which are decoded or encoded in a single call (one call per
+# post spends most of its time setting up the decoder or encoder)
+STAGE_FILE_CHUNK_SIZE = 256
+
+def stage_file_format(path):
+    """Return the format of a stage file from its extension ('json' or 'jsonl'), or None if it isn't one."""
+    for stage_format, extension in STAGE_FORMATS.items():
+        if path.endswith(extension):
+            return stage_format
+    return None
+
+def stage_file_path(path, stage_format):
+    """Return the path of a stage file with its extension changed to that of stage_format."""
+    return os.path.splitext(path)[0] + STAGE_FORMATS[stage_format]
+
+def read_stage_file(path):
+    """
+    Read the posts of a stage file.
+
+    JSON Lines files are read a chunk of posts at a time, so only a few posts are held in memory at once.
+    JSON array files have to be loaded whole.
+
+    Args:
+        path: Path of a .json or .jsonl file
+
+    Yields:
+        Post dictionaries
+    """
+    with open(path, 'r', encoding='utf-8') as file:
+        if stage_file_format(path) != 'jsonl':
+            yield from json.load(file)
+            return
+
+        while True:
+            lines = list(islice(file, STAGE_FILE_CHUNK_SIZE))
+            if not lines:
+                break
+
+            # Each line holds a single JSON value, so a chunk of lines is decoded as one JSON array
+            lines = [line for line in lines if not line.isspace()]
+            if lines:
+                yield from json.loads('[' + ','.join(lines) + ']')
+
+class StageFileWriter:
+    """
+    Writes posts to a stage file as they are produced, in the format given by its extension.
+
+    JSON array files are written exactly as json.dump(..., ensure_ascii=False, indent=4) wrote them.
+    The posts are written to a temporary file, which only replaces the stage file when the writer is
+    closed (and is deleted if no posts were written, leaving any existing stage file as it was, or if
+    the writer is used as a context manager and an exception is raised).
+    """
+    def __init__(self, path):
+        self.path = path
+        self.count = 0  # Number of posts written
+        self.encoded = 0  # Number of posts encoded into the file so far
+
+        self.json_lines = stage_file_format(path) == 'jsonl'
+        self.encoder = json.JSONEncoder(ensure_ascii=False, indent=None if self.json_lines else 4)
+        self.chunk = []
+
+        self.temporary_path = f"{path}.{os.getpid()}.tmp"
+        self.file = open(self.temporary_path, 'w', encoding='utf-8')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def write(self, record):
+        """Write a post (posts are encoded STAGE_FILE_CHUNK_SIZE at a time)."""
+        self.chunk.append(record)
+        self.count += 1
+        if len(self.chunk) >= STAGE_FILE_CHUNK_SIZE:
+            self._write_chunk()
+
+    def _write_chunk(self):
+        if self.json_lines:
+            self.file.write(''.join(self.encoder.encode(record) + '\n' for record in self.chunk))
+        else:
+            # The chunk is encoded as an array, whose items are indented as they are in the whole array,
+            # and written without its brackets
+            self.file.write(',\n' if self.encoded else '[\n')
+            self.file.write(self.encoder.encode(self.chunk)[2:-2])
+        self.encoded += len(self.chunk)
+        self.chunk = []
+
+    def close(self):
+        """
+        Finish the stage file, replacing any existing one.
+
+        Returns:
+            Number of posts written
+        """
+        try:
+            if self.chunk:
+                self._write_chunk()
+            if not self.json_lines:
+                self.file.write('\n]' if self.count else '[]')
+            self.file.close()
+        except BaseException:
+            self.discard()
+            raise
+
+        if self.count:
+            os.replace(self.temporary_path, self.path)
+        else:
+            os.remove(self.temporary_path)
+        return self.count
+
+    def discard(self):
+        """Stop writing, leaving any existing stage file as it was."""
+        self.file.close()
+        os.remove(self.temporary_path)
+
+def write_stage_file(path, records):
+    """
+    Write posts to a stage file (see StageFileWriter).
+
+    Args:
+        path: Path of a .json or .jsonl file
+        records: Iterable of post dictionaries
+
+    Returns:
+        Number of posts written
+    """
+    with StageFileWriter(path) as writer:
+        for record in records:
+            writer.write(record)
+    return writer.count
+
+def convert_stage_directory(input_dir, output_format, output_dir=None):
+    """
+    Convert the stage files of a directory to another format (e.g. legacy JSON arrays to JSON Lines, or back).
+
+    Args:
+        input_dir: Directory of .json and/or .jsonl files
+        output_format: 'json' or 'jsonl'
+        output_dir: Directory to save the converted files to (by default input_dir, in which case the
+            original files are replaced by the converted ones)
+    """
+    output_dir = output_dir or input_dir
+    os.makedirs(output_dir, exist_ok=True)
+
+    for filename in sorted(os.listdir(input_dir)):
+        if stage_file_format(filename) in (None, output_format):
+            continue
+
+        file_path = os.path.join(input_dir, filename)
+        output_path = stage_file_path(os.path.join(output_dir, filename), output_format)
+        count = write_stage_file(output_path, read_stage_file(file_path))
+        if output_dir == input_dir and count:
+            os.remove(file_path)
+        print(f"Converted {file_path} to {output_path} ({count} posts)")
+
+# Name of the file in each stage directory recording how its files were produced (see StageManifest)
+MANIFEST_FILENAME = '.manifest'
+
+@lru_cache(maxsize=None)
+def code_digest():
+    """Hash of the source of this module, recorded in the stage manifests so that changing the code reprocesses every file."""
+    with open(__file__, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+def file_digest(path):
+    """Hash of the contents of a file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class StageManifest:
+    """
+    Record of how each file of a stage directory was produced, saved as MANIFEST_FILENAME in the directory.
+
+    Each file's entry holds the hash of the input file it was produced from, the configuration of the
+    processors that produced it (see TextProcessor.configuration), the hash of the code, and the number
+    of posts saved. A file whose entry still matches doesn't have to be produced again.
+    """
+    VERSION = 1
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, MANIFEST_FILENAME)
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                manifest = json.load(file)
+        except (OSError, ValueError):
+            manifest = {}
+        self.files = manifest.get('files', {}) if manifest.get('version') == self.VERSION else {}
+
+    @staticmethod
+    def entry(input_digest, configuration):
+        """Entry for a file produced from an input file with the given hash by processors with the given configuration."""
+        # Round trip through JSON, so that it compares equal to the entry once saved (e.g. tuples become lists)
+        return json.loads(json.dumps({'input': input_digest, 'configuration': configuration, 'code': code_digest()}))
+
+    def get(self, output_path):
+        """Return the recorded entry of a file (None if there isn't one)."""
+        return self.files.get(os.path.basename(output_path))
+
+    def is_current(self, output_path, entry):
+        """Whether a file was produced as entry describes (and still exists, unless it was left empty)."""
+        recorded = self.get(output_path)
+        if recorded is None or any(recorded.get(key) != value for key, value in entry.items()):
+            return False
+        return recorded.get('posts') == 0 or os.path.exists(output_path)
+
+    def record(self, output_path, entry, posts):
+        """Record the entry of a file with the number of posts saved to it, and save the manifest."""
+        self.files[os.path.basename(output_path)] = dict(entry, posts=posts)
+
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        temporary_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temporary_path, 'w', encoding='utf-8') as file:
+            json.dump({'version': self.VERSION, 'files': self.files}, file, ensure_ascii=False, indent=4)
+        os.replace(temporary_path, self.path)
+
+class StageStats:
+    """
+    Measurements of a stage of the cleaning pipeline (a TextProcessor or a JsonCombiner) over a run.
+
+    Times only include the time spent in the stage itself, and not in the stages before it (which produce
+    the posts it reads) or after it, so the stages of a Pipeline, which run interleaved, are measured
+    separately. Stages run in worker processes are measured there, and their measurements summed.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.records_in = 0
+        self.records_out = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        # Peak memory allocated while the stage was running, if tracemalloc is tracing
+        self.peak_memory = None
+        # Time spent on each input post (a batched stage spends most of a batch's time on its last post)
+        self.latencies = array('d')
+
+    def measure(self, records, process):
+        """
+        Run a stage over posts, measuring it.
+
+        Args:
+            records: Iterable of input posts
+            process: Function returning an iterator over the output posts for an iterable of input posts
+                (e.g. a processor's stream_process)
+
+        Yields:
+            The output posts
+        """
+        clock, cpu_clock = time.perf_counter, time.process_time
+        tracing = tracemalloc.is_tracing()
+        wall_start = cpu_start = 0.0
+        record_time = 0.0
+        received = 0
+
+        # The stage is paused while the posts it reads are produced, and while the posts it outputs are used
+        def resume():
+            nonlocal wall_start, cpu_start
+            if tracing:
+                tracemalloc.reset_peak()
+            wall_start, cpu_start = clock(), cpu_clock()
+
+        def pause():
+            nonlocal record_time
+            elapsed = clock() - wall_start
+            self.wall_time += elapsed
+            self.cpu_time += cpu_clock() - cpu_start
+            record_time += elapsed
+            if tracing:
+                self.peak_memory = max(self.peak_memory or 0, tracemalloc.get_traced_memory()[1])
+
+        def inputs():
+            nonlocal record_time, received
+            iterator = iter(records)
+            while True:
+                pause()
+                try:
+                    record = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    resume()
+
+                # The time since the previous post was read is spent on it (and the time before the first
+                # post was read on the first one)
+                if received:
+                    self.latencies.append(record_time)
+                    record_time = 0.0
+                received += 1
+                self.records_in += 1
+                yield record
+
+        resume()
+        outputs = process(inputs())
+        while True:
+            try:
+                record = next(outputs)
+            except StopIteration:
+                break
+            finally:
+                pause()
+            self.records_out += 1
+            yield record
+            resume()
+
+        if received:
+            self.latencies.append(record_time)
+
+    def merge(self, other):
+        """Add the measurements of the same stage in another process."""
+        self.wall_time += other.wall_time
+        self.cpu_time += other.cpu_time
+        self.records_in += other.records_in
+        self.records_out += other.records_out
+        self.bytes_read += other.bytes_read
+        self.bytes_written += other.bytes_written
+        if other.peak_memory is not None:
+            self.peak_memory = max(self.peak_memory or 0, other.peak_memory)
+        self.latencies.extend(other.latencies)
+
+    def to_dict(self):
+        """Return the measurements as a JSON-serializable dictionary (times in seconds, sizes in bytes)."""
+        latencies = np.frombuffer(self.latencies, dtype=np.float64) if self.latencies else np.zeros(1)
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+        return {
+            'stage': self.name,
+            'wall_time': self.wall_time,
+            'cpu_time': self.cpu_time,
+            'records_in': self.records_in,
+            'records_out': self.records_out,
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'peak_memory': self.peak_memory,
+            'latency': {'mean': float(latencies.mean()), 'p50': float(p50), 'p90': float(p90), 'p99': float(p99), 'max': float(latencies.max())},
+        }
+
+def max_rss(who='self'):
+    """Peak resident memory (in bytes) of this process ('self') or of its finished worker processes ('children'), or None on Windows."""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == 'self' else resource.RUSAGE_CHILDREN)
+    # Reported in bytes on macOS, and in kilobytes elsewhere
+    return usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+
+def save_run_report(report, directory):
+    """
+    Save a run report (see Pipeline.report) as run_<start time>.json in directory, so that the reports of
+    successive runs can be compared.
+
+    Returns:
+        Path of the saved report
+    """
+    os.makedirs(directory, exist_ok=True)
+    timestamp = report['started'].replace(':', '').replace('-', '').split('.')[0]
+    path = os.path.join(directory, f"run_{timestamp}.json")
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, 'w', encoding='utf-8') as file:
+        json.dump(report, file, ensure_ascii=False, indent=4)
+    os.replace(temporary_path, path)
+    return path
+
+def format_run_report(report):
+    """Format the stages of a run report as a table (one line per stage, with a header)."""
+    lines = [f"{'Stage':<18}{'Wall (s)':>10}{'CPU (s)':>10}{'In':>9}{'Out':>9}{'Read (MB)':>11}{'Written (MB)':>14}{'p50 (ms)':>10}{'p99 (ms)':>10}"]
+    for stage in report['stages']:
+        lines.append(f"{stage['stage']:<18}{stage['wall_time']:>10.3f}{stage['cpu_time']:>10.3f}{stage['records_in']:>9}{stage['records_out']:>9}"
+                     f"{stage['bytes_read'] / 1e6:>11.2f}{stage['bytes_written'] / 1e6:>14.2f}"
+                     f"{stage['latency']['p50'] * 1000:>10.3f}{stage['latency']['p99'] * 1000:>10.3f}")
+    lines.append(f"Total: {report['wall_time']:.3f} s wall, {report['cpu_time']:.3f} s CPU")
+    return '\n'.join(lines)
+
+# Object processing the chunks of posts given to the current worker process (see map_file_chunks)
+_worker_target = None
+
+def _init_worker(target, trace_memory=False):
+    global _worker_target
+    _worker_target = target
+    # Trace the worker's memory too if the main process does (it isn't inherited by spawned processes)
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+def _process_worker_chunk(chunk, arguments):
+    return _worker_target.process_chunk(chunk, *arguments)
+
+def iter_file_chunks(file_path, size):
+    """Yield the posts of a stage file in lists of up to size posts (a single empty list if it has none)."""
+    records = read_stage_file(file_path)
+    chunk = list(islice(records, size))
+    while True:
+        yield chunk
+        chunk = list(islice(records, size))
+        if not chunk:
+            break
+
+def map_file_chunks(target, file_paths, workers, chunk_size, arguments=None):
+    """
+    Process the posts of several stage files in chunks, in a pool of worker processes.
+
+    Each worker process receives its own copy of target once, when it starts (so any state it builds, such
+    as the anonymizer's name matchers or the language identifier, is built once per worker), and calls
+    target.process_chunk(posts) on the chunks it is given. The chunks of every file are queued one after
+    the other, so small files are spread across the workers as well as the chunks of large files, but only
+    a couple of chunks per worker are held in memory at once.
+
+    Args:
+        target: Object with a process_chunk method (e.g. a TextProcessor or a Pipeline)
+        file_paths: Paths of the stage files to process
+        workers: Number of worker processes
+        chunk_size: Maximum number of posts per chunk
+        arguments: Extra arguments to pass to process_chunk with the chunks of each file (a tuple per file)
+
+    Yields:
+        (file_path, results) pairs in the order of file_paths, where results iterates over the results of
+        process_chunk for each chunk of the file in order (and has to be consumed before the next pair)
+    """
+    arguments = arguments or [()] * len(file_paths)
+    chunks = ((index, chunk) for index, file_path in enumerate(file_paths) for chunk in iter_file_chunks(file_path, chunk_size))
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(target, tracemalloc.is_tracing())) as executor:
+        def results():
+            pending = deque()
+            for index, chunk in chunks:
+                pending.append((index, executor.submit(_process_worker_chunk, chunk, arguments[index])))
+                if len(pending) > 2 * workers:
+                    index, future = pending.popleft()
+                    yield index, future.result()
+            for index, future in pending:
+                yield index, future.result()
+
+        for index, group in groupby(results(), key=itemgetter(0)):
+            yield file_paths[index], (result for _, result in group)
 
 class TextProcessor(ABC):
     """
     Abstract base class for processing JSON files containing posts.
     """
-    def __init__(self, input_dir, output_dir=None):
+
+    # Maximum number of posts sent to a worker process at once when processing in parallel
+    CHUNK_SIZE = 1024
+
+    def __init__(self, input_dir, output_dir=None, output_format=None):
         self.input_dir = input_dir
         self.output_dir = output_dir or input_dir
+        # Format of the files saved by process_directory ('json' or 'jsonl', see STAGE_FORMATS), by
+        # default the format of each input file
+        self.output_format = output_format
+        # Measurements of the posts processed by process_directory or a Pipeline
+        self.stats = StageStats(type(self).__name__)
 
     @abstractmethod
     def process(self, data):
@@ -30,40 +498,382 @@ class TextProcessor(ABC):
         """
         pass
 
-    def process_directory(self):
-        """Process all JSON files in the input directory."""
+    def stream_process(self, records):
+        """
+        Process posts one at a time, as they are read from a stage file.
+
+        By default the posts are collected into a list and processed with process; processors which can
+        handle one post at a time override this, so a stage never holds more than a post in memory.
+
+        Args:
+            records: Iterable of post dictionaries
+
+        Returns:
+            Iterator over the processed post dictionaries
+        """
+        return iter(self.process(list(records)))
+
+    def configuration(self):
+        """
+        Settings that affect the processed posts, recorded in the stage manifests (see StageManifest), so
+        that files are processed again when they change.
+
+        Returns:
+            JSON-serializable dictionary
+        """
+        return {'processor': type(self).__name__}
+
+    def process_chunk(self, records):
+        """
+        Process a chunk of posts in a worker process (see map_file_chunks).
+
+        Returns:
+            (processed posts, counts, stats), where counts are the processor's stage_counts for the chunk
+            if it keeps any (e.g. MalteseFilter) and stats are its StageStats for the chunk, to be added to
+            those of the main process by merge_chunk
+        """
+        counts = getattr(self, 'stage_counts', None)
+        if counts is not None:
+            counts.clear()
+        stats = StageStats(self.stats.name)
+        return list(stats.measure(records, self.stream_process)), counts, stats
+
+    def merge_chunk(self, counts, stats):
+        """Add the counts and measurements returned by process_chunk in a worker process."""
+        if counts:
+            self.stage_counts.update(counts)
+        self.stats.merge(stats)
+
+    def _merge_chunks(self, results):
+        for records, counts, stats in results:
+            self.merge_chunk(counts, stats)
+            yield from records
+
+    def process_directory(self, workers=1, incremental=True):
+        """
+        Process all JSON (.json) and JSON Lines (.jsonl) files in the input directory.
+
+        Args:
+            workers: Number of worker processes to process the files with (split into chunks of
+                CHUNK_SIZE posts, and saved in the same order as by a single process)
+            incremental: Skip the files whose output was saved from the same input, with the same
+                configuration and code (as recorded in the output directory's StageManifest)
+        """
         if not os.path.exists(self.output_dir):
             os.makedirs(self.output_dir)
         
+        manifest = StageManifest(self.output_dir)
+        entries = {}
         for filename in os.listdir(self.input_dir):
-            if filename.endswith('.json'):
+            if stage_file_format(filename):
                 file_path = os.path.join(self.input_dir, filename)
-                self._process_file(file_path)
+                entry = StageManifest.entry(file_digest(file_path), self.configuration())
+                if incremental and manifest.is_current(self._output_path(file_path), entry):
+                    print(f"Skipped {file_path} (unchanged)")
+                else:
+                    entries[file_path] = entry
+
+        file_paths = list(entries)
+        if workers > 1:
+            for file_path, results in map_file_chunks(self, file_paths, workers, self.CHUNK_SIZE):
+                self.stats.bytes_read += os.path.getsize(file_path)
+                manifest.record(self._output_path(file_path), entries[file_path], self._save_file(file_path, self._merge_chunks(results)))
+        else:
+            for file_path in file_paths:
+                manifest.record(self._output_path(file_path), entries[file_path], self._process_file(file_path))
 
     def _process_file(self, file_path):
-        """Load JSON, process it, and save the result."""
-        with open(file_path, 'r', encoding='utf-8') as file:
-            data = json.load(file)
-
-        processed_data = self.process(data)
-
-        if processed_data:
-            output_path = os.path.join(self.output_dir, os.path.basename(file_path))
-            with open(output_path, 'w', encoding='utf-8') as file:
-                json.dump(processed_data, file, ensure_ascii=False, indent=4)
+        """Stream the posts of a stage file through stream_process, and save the result."""
+        self.stats.bytes_read += os.path.getsize(file_path)
+        return self._save_file(file_path, self.stats.measure(read_stage_file(file_path), self.stream_process))
+
+    def _output_path(self, file_path):
+        output_path = os.path.join(self.output_dir, os.path.basename(file_path))
+        if self.output_format:
+            output_path = stage_file_path(output_path, self.output_format)
+        return output_path
+
+    def _save_file(self, file_path, records):
+        """Save the processed posts of a stage file, returning the number of posts saved."""
+        output_path = self._output_path(file_path)
+        count = write_stage_file(output_path, records)
+        if count:
+            self.stats.bytes_written += os.path.getsize(output_path)
             print(f"Processed {file_path} and saved to {output_path}")
         else:
             print(f"No valid data in {file_path}")
+        return count
+
+def load_prebuilt(path, digest, build):
+    """
+    Load an object saved by an earlier process, or build it and save it for later processes.
+
+    Objects are saved as plain data (e.g. a dict of attributes rather than an instance), since pickled
+    instances can only be loaded when this module is imported under the same name.
+
+    Args:
+        path: Path of the prebuilt file
+        digest: Hash of everything the object is built from (the file is rebuilt if it doesn't match)
+        build: Function returning the object (a false value is returned as is, and not saved)
+
+    Returns:
+        The prebuilt or newly built object
+    """
+    try:
+        with open(path, 'rb') as f:
+            prebuilt = pickle.load(f)
+        if prebuilt['digest'] == digest:
+            return prebuilt['object']
+    except Exception:
+        pass # Not built yet, or built from something else
+
+    built = build()
+    if built:
+        try:
+            temporary_path = f"{path}.{os.getpid()}.tmp"
+            with open(temporary_path, 'wb') as f:
+                pickle.dump({'digest': digest, 'object': built}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary_path, path)
+        except OSError:
+            pass # e.g. a read-only directory, in which case each process builds its own
+    return built
+
+class TwoLanguageIdentifier:
+    """
+    The langid language identifier reduced to two languages, giving the same results as a
+    LanguageIdentifier (with norm_probs=True) restricted to them with set_languages.
+
+    With two languages, the normalized probabilities only depend on the difference between their
+    log-probabilities, so only the difference between the weights of each feature is kept. langid counts
+    the features of a text by walking a DFA over its bytes, where each state adds a fixed set of features,
+    so the differences are also summed per state. Scoring a text is then a single walk over its bytes,
+    without a feature vector.
+    """
+
+    # Changed whenever the reduction changes, so that older prebuilt files are rebuilt
+    VERSION = 1
+
+    # classify_batch walks the texts one at a time once fewer than this many are left
+    MIN_BATCH = 16
+
+    def __init__(self, languages, nextmove, state_weights, bias):
+        self.languages = languages # In langid's order (e.g. ['en', 'mt'])
+        self.nextmove = nextmove # DFA transitions, (state << 8) + byte -> next state
+        self.state_weights = state_weights # State -> log-probability of the second language minus the first
+        self.bias = bias # Difference between the log prior probabilities
+
+        # The same tables as NumPy arrays (sharing the memory of nextmove), for classify_batch
+        self._nextmove_array = np.frombuffer(nextmove, dtype=np.uint16 if nextmove.typecode == 'H' else np.uint32)
+        self._state_weights_array = np.array(state_weights, dtype=np.float64)
+
+    # Only the tables are kept (the arrays are recreated from them)
+    def __getstate__(self):
+        return {'languages': self.languages, 'nextmove': self.nextmove, 'state_weights': self.state_weights, 'bias': self.bias}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    @classmethod
+    def from_langid(cls, languages):
+        """Reduce langid's model (which takes a few seconds to decode) to two languages."""
+        identifier = LanguageIdentifier.from_modelstring(model, norm_probs=True)
+        identifier.set_languages(languages)
+        first, second = identifier.nb_ptc.astype('float64').T
+        feature_weights = (second - first).tolist()
+
+        state_weights = [0.0] * (len(identifier.tk_nextmove) >> 8)
+        for state, features in identifier.tk_output.items():
+            state_weights[state] = sum(feature_weights[feature] for feature in features)
+
+        typecode = 'H' if len(state_weights) <= 1 << 16 else 'I'
+        bias = float(identifier.nb_pc[1]) - float(identifier.nb_pc[0])
+        return cls(list(identifier.nb_classes), array(typecode, identifier.tk_nextmove), state_weights, bias)
+
+    def classify(self, text):
+        """
+        Classify a text.
+
+        Returns:
+            tuple: (language, probability)
+        """
+        nextmove = self.nextmove
+        state_weights = self.state_weights
+        state = 0
+        score = self.bias
+        for byte in text.encode('utf-8'):
+            state = nextmove[(state << 8) + byte]
+            score += state_weights[state]
+        return self._classify_score(score)
+
+    def classify_batch(self, texts):
+        """
+        Classify many texts at once, with the same results as classify.
+
+        The texts are walked together, one byte position at a time, with each step a few NumPy operations
+        over all the texts that are long enough. Each score is still added up in the same order as in
+        classify, so the results are identical.
+
+        Args:
+            texts: List of texts
+
+        Returns:
+            List of (language, probability) tuples, in the order of the texts
+        """
+        encoded = [text.encode('utf-8') for text in texts]
+        lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+        order = np.argsort(-lengths, kind='stable').tolist()
+        lengths = lengths[order]
+        data = np.frombuffer(b''.join([encoded[i] for i in order]), dtype=np.uint8)
+
+        negative_lengths = -lengths # Increasing, for searchsorted
+        positions = np.cumsum(lengths) - lengths # Offset of the next byte of each text in data
+        states = np.zeros(len(order), dtype=np.int64)
+        scores = np.full(len(order), self.bias, dtype=np.float64)
+
+        # The texts are sorted longest first, so those that are still being walked always come first
+        step = 0
+        active = len(order)
+        while True:
+            active = int(np.searchsorted(negative_lengths[:active], -step)) # Texts longer than step bytes
+            if active < self.MIN_BATCH:
+                break
+            states[:active] = self._nextmove_array[(states[:active] << 8) + data[positions[:active]]]
+            scores[:active] += self._state_weights_array[states[:active]]
+            positions[:active] += 1
+            step += 1
+
+        # Finish the few longest texts one at a time
+        nextmove = self.nextmove
+        state_weights = self.state_weights
+        for row in range(active):
+            state = int(states[row])
+            score = float(scores[row])
+            for byte in encoded[order[row]][step:]:
+                state = nextmove[(state << 8) + byte]
+                score += state_weights[state]
+            scores[row] = score
+
+        results = [None] * len(order)
+        for i, score in zip(order, scores.tolist()):
+            results[i] = self._classify_score(score)
+        return results
+
+    def _classify_score(self, score):
+        # Normalized as in langid, where overflowing exponentials give a probability of 0
+        first = 1 / (1 + (math.exp(score) if score < 709 else math.inf))
+        second = 1 / ((math.exp(-score) if score > -709 else math.inf) + 1)
+        if first >= second:
+            return self.languages[0], first
+        return self.languages[1], second
+
+@lru_cache(maxsize=None)
+def load_language_identifier(languages=('en', 'mt')):
+    """
+    Load the TwoLanguageIdentifier for a pair of languages, sharing one per pair within the process.
+
+    The identifier is saved next to this file the first time it is built (e.g. langid_en_mt.pickle), and
+    loaded from there by later processes as long as the langid model is unchanged.
+    """
+    digest = hashlib.sha256(f"{TwoLanguageIdentifier.VERSION} {sorted(languages)}".encode('utf-8'))
+    digest.update(model.encode('ascii') if isinstance(model, str) else model)
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), f"langid_{'_'.join(sorted(languages))}.pickle")
+    state = load_prebuilt(path, digest.hexdigest(), lambda: TwoLanguageIdentifier.from_langid(languages).__getstate__())
+    return TwoLanguageIdentifier(**state)
+
+# Sentence of a post, as yielded by SentenceSplitter.iter_sentences (e.g. Sentence(0, 1, 0, 12, 'Bonġu lkoll.'))
+Sentence = namedtuple('Sentence', ['post_id', 'number', 'start', 'end', 'text'])
 
 class MalteseFilter(TextProcessor):
-    def __init__(self, input_dir, output_dir=None, threshold=0.94, debug=False):
-        super().__init__(input_dir, output_dir)
+    # Number of texts classified together by iter_process
+    BATCH_SIZE = 4096
+
+    # Stages that can decide whether a text is kept, in the order they are tried (counted in stage_counts)
+    STAGES = ('empty', 'orthography', 'langid')
+
+    # Orthographic pre-classifier (see classify_orthography)
+    MALTESE_LETTERS = set('ċġħżĊĠĦŻ')
+    MALTESE_WORDS = {
+        # Function words, with their common spellings without Maltese letters
+        'li', "ta'", 'ma', 'mhux', 'biex', 'huwa', 'hija', 'huma', 'kien', 'kienet', 'jien', 'jiena', 'aħna', 'ahna',
+        'dan', 'din', 'dawn', 'ukoll', 'wkoll', 'imma', 'jekk', 'meta', 'fejn', 'għax', 'ghax', 'kif', 'minn', 'fuq',
+        'lil', 'ħafna', 'hafna', 'sew', 'tajjeb', 'grazzi', 'iva', 'xi', 'kollha', 'kollox', 'kollu', 'issa', 'qed',
+        'qiegħed', 'għandi', 'ghandi', 'għandu', 'ghandu', 'għandek', 'ghandek', 'nista', 'tista', 'jista', 'għaliex',
+        'anke', 'lanqas', 'mela', 'allura', 'bħal', 'bhal', 'bla', 'sabiex', 'hemm', 'hawn', 'hekk', 'jew', 'kont',
+        'qisu', "x'",
+        # Articles, on their own or joined to a preposition (e.g. 'il-' in 'il-kelb', 'tal-' in 'tal-Maltin')
+        'il-', 'l-', 'iċ-', 'in-', 'ir-', 'is-', 'it-', 'ix-', 'iż-', 'id-', 'tal-', 'taċ-', 'tad-', 'tan-', 'tar-',
+        'tas-', 'tat-', 'tax-', 'taż-', 'fil-', 'fiċ-', 'fid-', 'fin-', 'fir-', 'fis-', 'fit-', 'fix-', 'fiż-', 'bil-',
+        'mal-', 'sal-', 'mill-', 'għall-', 'ghall-', 'lill-', 'dal-', 'dil-', 'kull-'
+    }
+    ENGLISH_WORDS = {
+        'the', 'and', 'is', 'you', 'to', 'of', 'for', 'in', 'this', 'that', 'with', 'have', 'are', 'be', 'it', 'on',
+        'was', 'my', 'we', 'they', 'your', 'i', 'am', 'not', 'but', 'what', 'so', 'do', 'just', 'from', 'at', 'if',
+        'can', 'will', 'all', 'about', 'would', 'there', 'their', 'an', 'has', 'had', 'been', 'were', 'he', 'she',
+        'his', 'her', 'them', 'which', 'when', 'who', 'how', 'our', 'me', 'more', 'very', 'one', 'out', 'up', 'no',
+        'some', 'any', 'know', 'like'
+    }
+    # Words are split at punctuation, symbols and emojis, except for apostrophes and hyphens, which are kept
+    # at the end of the word before them (e.g. "x'" in "x'inhu", 'il-' in 'il-kelb')
+    WORD_REGEX = re.compile(r"[^\W_]+['-]?")
+    # A text is Maltese if it has at least this much Maltese evidence (Maltese words and words with
+    # Maltese letters, a single one of which is nearly decisive), and more of it than English words (so
+    # that Maltese with a few English words mixed in is still decided)...
+    MIN_MALTESE_EVIDENCE = 1
+    # ...and English if it has at least this many (distinct) English words, making up at least half of its
+    # words, and no Maltese evidence
+    MIN_ENGLISH_WORDS = 5
+
+    def __init__(self, input_dir, output_dir=None, threshold=0.94, debug=False, pre_classify=False, output_format=None):
+        super().__init__(input_dir, output_dir, output_format)
 
         self.threshold = threshold
         self.debug = debug
+        # Decide the clear cases from their spelling and words before using langid (see classify_orthography)
+        self.pre_classify = pre_classify
+
+        # Gives the same results as langid's LanguageIdentifier restricted to English and Maltese
+        self.identifier = load_language_identifier(('en', 'mt'))
+
+        # Number of texts decided by each stage
+        self.stage_counts = Counter({stage: 0 for stage in self.STAGES})
+
+    def classify_orthography(self, text):
+        """
+        Classify a text from its letters and words alone, if it is a clear case.
 
-        self.identifier = LanguageIdentifier.from_modelstring(model, norm_probs=True)
-        self.identifier.set_languages(['en', 'mt'])
+        Args:
+            text: String to analyze
+
+        Returns:
+            'mt' or 'en', or None if the text is left for langid
+        """
+        words = self.WORD_REGEX.findall(text.lower().replace('’', "'"))
+
+        maltese_evidence = len(self.MALTESE_WORDS.intersection(words))
+        if not self.MALTESE_LETTERS.isdisjoint(text):
+            maltese_evidence += sum(1 for word in words if not self.MALTESE_LETTERS.isdisjoint(word))
+        english_words = len(self.ENGLISH_WORDS.intersection(words))
+
+        if maltese_evidence >= self.MIN_MALTESE_EVIDENCE and maltese_evidence > english_words:
+            return 'mt'
+        if english_words >= self.MIN_ENGLISH_WORDS and english_words * 2 >= len(words) and not maltese_evidence:
+            return 'en'
+        return None
+
+    def _decide_early(self, text):
+        """Decide a text without langid if possible, returning (bool, tuple) as is_maltese, or None."""
+        if not text:
+            self.stage_counts['empty'] += 1
+            return True, None
+
+        if self.pre_classify:
+            lang = self.classify_orthography(text)
+            if lang:
+                self.stage_counts['orthography'] += 1
+                return lang == 'mt', (lang, None)
+
+        self.stage_counts['langid'] += 1
+        return None
 
     def is_maltese(self, text):
         """
@@ -75,9 +885,11 @@ class MalteseFilter(TextProcessor):
         Returns:
             bool: True if text should be kept (potentially Maltese), False if confidently English
             tuple: (language, probability) if debug is enabled, None otherwise
+                   (the probability is None for texts decided by classify_orthography)
         """
-        if not text:
-            return True, None
+        decision = self._decide_early(text)
+        if decision:
+            return decision
             
         lang, prob = self.identifier.classify(text)
         lang_info = (lang, prob)
@@ -85,91 +897,171 @@ class MalteseFilter(TextProcessor):
         
         return not is_english, lang_info
 
+    def is_maltese_batch(self, texts):
+        """
+        Check many texts at once, with the same results as is_maltese.
+
+        Args:
+            texts: List of strings to analyze
+
+        Returns:
+            List of (bool, tuple) results as returned by is_maltese, in the order of the texts
+        """
+        results = [self._decide_early(text) for text in texts]
+        lang_infos = iter(self.identifier.classify_batch([text for text, result in zip(texts, results) if not result]))
+
+        for i, result in enumerate(results):
+            if not result:
+                lang, prob = lang_info = next(lang_infos)
+                is_english = (lang == 'en' and prob > self.threshold)
+                results[i] = (not is_english, lang_info)
+        return results
+
+    def configuration(self):
+        return dict(super().configuration(), threshold=self.threshold, debug=self.debug, pre_classify=self.pre_classify,
+                    languages=list(self.identifier.languages))
+
+    def process_directory(self, workers=1, incremental=True):
+        super().process_directory(workers, incremental)
+        print("Texts decided by each stage: " + ", ".join(f"{stage} {count}" for stage, count in self.stage_counts.items()))
+
+    def iter_process(self, records):
+        """
+        Filter posts or sentences lazily, classifying BATCH_SIZE of them at a time.
+
+        Args:
+            records: Iterable of post dictionaries, or of Sentence records (e.g. from SentenceSplitter.iter_process)
+
+        Yields:
+            The records that are potentially Maltese
+        """
+        records = iter(records)
+        while True:
+            batch = list(islice(records, self.BATCH_SIZE))
+            if not batch:
+                break
+
+            texts = [record.text if isinstance(record, Sentence) else record.get('content', '') for record in batch]
+            for record, (is_maltese, lang_info) in zip(batch, self.is_maltese_batch(texts)):
+                if is_maltese:
+                    if self.debug and not isinstance(record, Sentence):
+                        record = dict(record, lang_info=lang_info)
+                    yield record
+
+    def stream_process(self, records):
+        return self.iter_process(records)
+
     def process(self, data):
-        filtered_posts = []
-        
-        for post in data:
-            content = post.get('content', '')
-            is_maltese, lang_info = self.is_maltese(content)
-            
-            if is_maltese:
-                if self.debug:
-                    post['lang_info'] = lang_info
-                filtered_posts.append(post)
-                
-        return filtered_posts
+        return list(self.iter_process(data))
 
 
 class SentenceSplitter(TextProcessor):
-    def __init__(self, input_dir, output_dir=None):
-        super().__init__(input_dir, output_dir)
+    """
+    Preprocessor that splits posts into sentences (one output post per sentence).
+    """
 
-        # Create regex pattern which matches any placeholder from TextAnonymizer
-        placeholder_types = '|'.join(key[1:-1] for key in TextAnonymizer.PATTERNS.keys())
+    # Common Maltese abbreviations and titles
+    ABBREVIATIONS = {
+        'Dr', 'Mr', 'Mrs', 'Ms', 'Prof', 'Profs', 'Dott', 'Onor', 'Kan',
+        'S.L', 'Kap', 'Art', 'Fr', 'Sra', 'Sur', 'Sinjura', 'Sinj',
+        'et al', 'eċċ', 'ecc', 'e.g', 'i.e', 'vs', 'St', 'P.S'
+    }
+
+    # The patterns start with a lookahead on their first characters, which lets the regex engine skip
+    # ahead to the positions where they can match (rather than trying every alternative at every position)
+    ABBREVIATION_REGEX = re.compile(
+        '(?=[' + ''.join(sorted({abbr[0] for abbr in ABBREVIATIONS})) + r'])\b(?:'
+        + '|'.join(re.escape(abbr) for abbr in sorted(ABBREVIATIONS)) + r')\.'
+    )
+
+    # Numbers with punctuation (e.g. '€2.50' or '1,000-2,000') and ellipses are never split on
+    NUMBER_REGEX = re.compile(r'(?=[€$\d])[€$]?\d+(?:[.,]\d+)?(?:-[€$]?\d+(?:[.,]\d+)?)?')
+    ELLIPSIS_REGEX = re.compile(r'\.\.\.+')
+
+    # Sentence endings or newlines, which end a sentence (and are kept at its end)
+    DELIMITER_REGEX = re.compile(r'(?=[.!?\n])(?:[.!?]+|\n+)')
+
+    # Protected characters are replaced with BLANK in a copy of the text before it is split. It is a word
+    # character, as were the placeholders that protected characters used to be replaced with, so the
+    # word boundaries around them (which the abbreviations depend on) are unchanged.
+    BLANK = '_'
+
+    def __init__(self, input_dir, output_dir=None, output_format=None):
+        super().__init__(input_dir, output_dir, output_format)
+
+        # Create regex pattern which matches any placeholder from TextAnonymizer (the name placeholders
+        # are only added to TextAnonymizer.PATTERNS once the names are loaded)
+        placeholders = dict.fromkeys([*TextAnonymizer.PATTERNS, '[NAME]', '[SURNAME]'])
+        placeholder_types = '|'.join(key[1:-1] for key in placeholders)
         self.placeholder_regex = re.compile(f"\\[({placeholder_types})\\]")
 
-    def split_sentences(self, text):
-        # Common Maltese abbreviations and titles 
-        abbreviations = {
-            'Dr', 'Mr', 'Mrs', 'Ms', 'Prof', 'Profs', 'Dott', 'Onor', 'Kan',
-            'S.L', 'Kap', 'Art', 'Fr', 'Sra', 'Sur', 'Sinjura', 'Sinj', 
-            'et al', 'eċċ', 'ecc', 'e.g', 'i.e', 'vs', 'St', 'P.S'
-        }
+    def _blank(self, text, spans):
+        """Replace the characters in the given (start, end) spans with BLANK, keeping the offsets unchanged."""
+        pieces = []
+        last_end = 0
+        for start, end in spans:
+            pieces.append(text[last_end:start])
+            pieces.append(self.BLANK * (end - start))
+            last_end = end
+        pieces.append(text[last_end:])
+        return ''.join(pieces)
+
+    def iter_spans(self, text):
+        """
+        Find the sentences of a text lazily, ending each one at a sentence ending or newline.
+
+        Numbers, ellipses and abbreviations (e.g. 'Dr.') are protected by blanking them out in a copy of
+        the text, so that their punctuation is not taken for a sentence ending. The copy is then split in a
+        single scan, and the sentences are taken from the original text at the same offsets.
 
-        # Create pattern for abbreviations to protect them
-        abbrev_pattern = '|'.join(r'\b' + re.escape(abbr) + r'\.' for abbr in abbreviations)
+        Args:
+            text: Input text string
 
+        Yields:
+            (start, end) offsets of each sentence in the text, without leading or trailing whitespace
+        """
         protected_text = text
+        if '.' in text:
+            # Protect numbers with punctuation and ellipses
+            spans = [match.span() for match in self.NUMBER_REGEX.finditer(text) if '.' in match.group()]
+            if '...' in text:
+                spans.extend(match.span() for match in self.ELLIPSIS_REGEX.finditer(text))
+                spans.sort()
+            protected_text = self._blank(text, spans)
+
+            # Protect abbreviations, including any other occurrence of the same text (e.g. 'Dr.' in 'MDr.')
+            for abbreviation in dict.fromkeys(match.group() for match in self.ABBREVIATION_REGEX.finditer(protected_text)):
+                protected_text = protected_text.replace(abbreviation, self.BLANK * len(abbreviation))
 
-        # Protect numbers with punctuation
-        protected_text = re.sub(r'([€$]?\d+(?:[.,]\d+)?(?:-[€$]?\d+(?:[.,]\d+)?)?)', 
-                            lambda m: f"NUM_{m.group(1).replace('.','DOT').replace(',','COMMA')}_MARK", 
-                            protected_text)
+        # Split on sentence endings or newlines, keeping the delimiters
+        start = 0
+        ends = (match.end() for match in self.DELIMITER_REGEX.finditer(protected_text))
+        for end in chain(ends, [len(text)]):
+            # Remove leading or trailing whitespace
+            sentence = text[start:end]
+            stripped = sentence.lstrip()
+            if stripped:
+                sentence_start = start + len(sentence) - len(stripped)
+                yield sentence_start, sentence_start + len(stripped.rstrip())
+            start = end
+
+    def _format_sentence(self, sentence):
+        """Shorten the ellipses in a sentence to '...' and capitalize its first letter."""
+        if '....' in sentence:
+            sentence = self.ELLIPSIS_REGEX.sub('...', sentence)
+        return sentence[0].upper() + sentence[1:]
 
-        # Protect ellipses
-        protected_text = re.sub(r'\.{3,}', 'ELLIPSIS_MARK', protected_text)
+    def split_sentences(self, text):
+        """
+        Split a text into sentences (see iter_spans).
 
-        # Protect abbreviations
-        abbrev_matches = list(re.finditer(abbrev_pattern, protected_text))
-        for i, match in enumerate(abbrev_matches):
-            protected_text = protected_text.replace(match.group(), f"ABBREV_{i}_MARK")
+        Args:
+            text: Input text string
 
-        # Split on sentence endings or newlines, keeping the delimiters
-        pattern = r'([.!?]+|\n+)'
-        splits = re.split(pattern, protected_text)
-
-        # Reconstruct sentences with their endings
-        sentences = []
-        for i in range(0, len(splits)-1, 2):
-            if splits[i] or splits[i+1]:  # If either part is non-empty
-                sentence = (splits[i] + splits[i+1]).strip()
-                if sentence:
-                    sentences.append(sentence)
-
-        # Add the last part if it exists and wasn't followed by a delimiter
-        if len(splits) % 2 == 1 and splits[-1].strip():
-            sentences.append(splits[-1].strip())
-
-        for i, sentence in enumerate(sentences):
-            # Keep replacing until no more matches are found
-            while 'NUM_' in sentences[i]:
-                sentences[i] = re.sub(r'NUM_([^_]+)_MARK', 
-                                    lambda m: m.group(1).replace('DOT', '.').replace('COMMA', ','), 
-                                    sentences[i])
-
-        # Restore ellipses
-        for i, sentence in enumerate(sentences):
-            sentences[i] = sentence.replace('ELLIPSIS_MARK', '...')
-
-        # Restore abbreviations
-        for i, match in enumerate(abbrev_matches):
-            for j, sentence in enumerate(sentences):
-                sentences[j] = sentence.replace(f"ABBREV_{i}_MARK", match.group())
-
-        sentences = [sentence.strip() for sentence in sentences] # Remove leading or trailing whitespace
-        sentences = [sentence[0].upper() + sentence[1:] for sentence in sentences] # Capitalize first letter of sentence
-
-        return sentences
+        Returns:
+            List of sentences, with ellipses shortened to '...' and their first letter capitalized
+        """
+        return [self._format_sentence(text[start:end]) for start, end in self.iter_spans(text)]
 
     def is_invalid_sentence(self, sentence):
         # If the sentence is empty or just whitespace
@@ -186,28 +1078,171 @@ class SentenceSplitter(TextProcessor):
 
         return False
 
+    def iter_sentences(self, post, post_id=None):
+        """
+        Split a post into sentences lazily, skipping invalid sentences.
 
-    def process(self, data):
-        processed_data = []
-        for post in data:
-            sentences = self.split_sentences(post['content'])
-            for i, sentence in enumerate(sentences):
-                # Skip invalid sentences
-                if self.is_invalid_sentence(sentence):
-                    continue
+        Args:
+            post: Post dictionary
+            post_id: Identifier of the post, copied to its sentences
+
+        Yields:
+            Sentence(post_id, number, start, end, text) records, where number counts every sentence of the
+            post from 1 (including the skipped ones) and start/end are the offsets of the sentence in the
+            post's content
+        """
+        content = post['content']
+        for number, (start, end) in enumerate(self.iter_spans(content), start=1):
+            sentence = self._format_sentence(content[start:end])
+            if not self.is_invalid_sentence(sentence):
+                yield Sentence(post_id, number, start, end, sentence)
+
+    def iter_process(self, records):
+        """
+        Split posts into sentences lazily, one post at a time.
 
+        Args:
+            records: Iterable of post dictionaries
+
+        Yields:
+            Sentence records (see iter_sentences), whose post_id is the index of their post in records
+        """
+        for post_id, post in enumerate(records):
+            yield from self.iter_sentences(post, post_id)
+
+    def stream_process(self, records):
+        for post in records:
+            for sentence in self.iter_sentences(post):
                 new_post = post.copy()
-                new_post['sentence_number'] = i + 1
-                new_post['content'] = sentence
-                processed_data.append(new_post)
-        return processed_data
+                new_post['sentence_number'] = sentence.number
+                new_post['content'] = sentence.text
+                yield new_post
+
+    def process(self, data):
+        return list(self.stream_process(data))
 
 class TextCleaner(TextProcessor):
     """
     Preprocessor that cleans and normalizes text content in posts.
     """
-    def __init__(self, input_dir, output_dir=None):
-        super().__init__(input_dir, output_dir)
+
+    # Character mappings, applied in a single str.translate pass:
+    # - Square brackets are replaced with round brackets (square brackets are reserved for placeholders)
+    # - Curly quotes are replaced with straight quotes
+    # - Punctuation emojis are replaced with their text equivalent (required for sentence splitting in later steps)
+    CHARACTERS = str.maketrans({
+        "[": "(", "]": ")",
+        "’": "'", "‘": "'", "“": '"', "”": '"',
+        "❓": "?", "❔": "?", "❗": "!", "❕": "!"
+    })
+    CHARACTERS_REGEX = re.compile("[" + re.escape("".join(chr(code) for code in CHARACTERS)) + "]")
+
+    # Punctuation emojis spanning two characters (emoji + variation selector)
+    PUNCTUATION_EMOJIS = {"⁉️": "!?", "‼️": "!!"}
+    PUNCTUATION_EMOJI_REGEX = re.compile("|".join(PUNCTUATION_EMOJIS))
+
+    NEWLINE_REGEX = re.compile(r'\s*\\n\s*')
+    PUNCTUATION_RUN_REGEX = re.compile(r'\.{2,}|[!?]{2,}')
+    PUNCTUATION_SPACING_REGEX = re.compile(r'(?<!\d)([.!?,])(?=[^\s])')
+    PARENTHESIS_REGEX = re.compile(r'\.\s+\)')
+
+    # Whitespace before trailing punctuation, or any other whitespace that isn't a single space
+    WHITESPACE_REGEX = re.compile(r'(\s+(?=[.!?,](?:\s|$)))|\s{2,}|[^\S ]')
+
+    # URLs and emails are replaced with a single character each while the rest of the text is cleaned
+    # (characters from the Supplementary Private Use Area, which no cleaning step matches)
+    MARK_BASE = 0x100000
+
+    def __init__(self, input_dir, output_dir=None, output_format=None):
+        super().__init__(input_dir, output_dir, output_format)
+
+    @staticmethod
+    def _normalize_punctuation_run(match):
+        run = match.group()
+        if run[0] == '.':
+            return '...' # ANY sequence of 2+ dots are converted to 3 dots
+        if '!' in run and '?' in run:
+            return '!?' # Replaces 2+ !? and question marks with !?
+        return run[:2] # Replaces 2+ exclamation or question marks with 2 marks
+
+    @staticmethod
+    def _normalize_whitespace(match):
+        return '' if match.group(1) else ' '
+
+    def _find_protected(self, text):
+        """
+        Find the URLs and emails in a text, which are left unchanged by cleaning.
+        This avoids full stops (.) in URLs and emails to be mistaken for sentence boundaries.
+
+        Args:
+            text: Input text string
+
+        Returns:
+            Lists of URL and email spans
+        """
+        urls = [match.span() for match in TextAnonymizer.URL_REGEX.finditer(text)] if 'http' in text else []
+        emails = [match.span() for match in TextAnonymizer.EMAIL_REGEX.finditer(text)] if '@' in text else []
+        return urls, emails
+
+    @staticmethod
+    def _find_all(text, string):
+        """Start positions of the non-overlapping occurrences of a string, as replaced by str.replace."""
+        positions = []
+        position = text.find(string)
+        while position != -1:
+            positions.append(position)
+            position = text.find(string, position + len(string))
+        return positions
+
+    def _protect(self, text, urls, emails):
+        """
+        Replace URLs and emails with mark characters, to be restored after cleaning.
+
+        Every occurrence of each distinct URL or email is replaced by its own mark, one after the other (URLs first).
+        This is done by cutting out their spans in a single pass, unless some occurrence isn't one of the spans
+        (e.g. when one URL contains another), in which case they are replaced with str.replace one by one instead.
+
+        Args:
+            text: Input text string
+            urls: Spans of the URLs in the text
+            emails: Spans of the emails in the text
+
+        Returns:
+            Text with marks (and square brackets replaced), and the str.translate table restoring the marks
+        """
+        text = text.replace("[", "(").replace("]", ")")
+
+        found = list(dict.fromkeys(text[start:end] for start, end in urls + emails))
+        marks = {string: chr(self.MARK_BASE + i) for i, string in enumerate(found)}
+        restore = {ord(mark): string for string, mark in marks.items()}
+
+        # Emails overlapping a URL are no longer in the text once URLs are replaced
+        spans = list(urls)
+        i = 0
+        for start, end in emails:
+            while i < len(urls) and urls[i][1] <= start:
+                i += 1
+            if i == len(urls) or urls[i][0] >= end:
+                spans.append((start, end))
+        spans.sort()
+
+        starts = {}
+        for start, end in spans:
+            starts.setdefault(text[start:end], []).append(start)
+
+        if len(spans) < len(urls) + len(emails) or any(self._find_all(text, string) != starts[string] for string in found):
+            for string, mark in marks.items():
+                text = text.replace(string, mark)
+            return text, restore
+
+        pieces = []
+        last_end = 0
+        for start, end in spans:
+            pieces.append(text[last_end:start])
+            pieces.append(marks[text[start:end]])
+            last_end = end
+        pieces.append(text[last_end:])
+        return ''.join(pieces), restore
 
     def clean_text(self, text):
         """
@@ -222,71 +1257,51 @@ class TextCleaner(TextProcessor):
 
         if not isinstance(text, str) or not text:
             return text
-        
-        # Replace square brackets with round brackets (square brackets are reserved for placeholders)
-        text = text.replace("[", "(")
-        text = text.replace("]", ")")
-
-        # Catch URLs and Emails and replace them with a placeholder (to be restored after cleaning)
-        # This avoids full stops (.) in URLs and emails to be mistaken for sentence boundaries
-        urls = re.findall(TextAnonymizer.PATTERNS['[URL]'], text) # Catch URLs
-        emails = re.findall(TextAnonymizer.PATTERNS['[EMAIL]'], text) # Catch emails
-
-        # Replace URLs with placeholders
-        for i, url in enumerate(urls):
-            text = text.replace(url, f'[URL_CLEANING_PLACEHOLDER_{i}]')
-
-        # Replace emails with placeholders
-        for i, email in enumerate(emails):
-            text = text.replace(email, f'[EMAIL_CLEANING_PLACEHOLDER_{i}]')
-
-        # Replace curly quotes with straight quotes
-        text = text.replace("’", "'")
-        text = text.replace("‘", "'")
-
-        text = text.replace("“", '"')
-        text = text.replace("”", '"')
-
-        # Replace punctuation emojis with their text equivalent (required for sentence splitting in later steps)
-        text = text.replace("⁉️", "!?")
-        text = text.replace("‼️", "!!")
-        text = text.replace("❓", "?")
-        text = text.replace("❔", "?")
-        text = text.replace("❗", "!")
-        text = text.replace("❕", "!")
+
+        # Square brackets are replaced with round brackets before URLs and emails are found in the original
+        # order of steps, but both kinds of brackets are URL characters and neither are email characters,
+        # so the same URLs and emails are found before replacing them
+        urls, emails = self._find_protected(text)
+        restore = None
+        if urls or emails:
+            text, restore = self._protect(text, urls, emails)
+
+        if self.CHARACTERS_REGEX.search(text):
+            text = text.translate(self.CHARACTERS)
+
+        if '\ufe0f' in text: # Variation selector of the punctuation emojis
+            text = self.PUNCTUATION_EMOJI_REGEX.sub(lambda match: self.PUNCTUATION_EMOJIS[match.group()], text)
 
         # Handle newlines first
-        text = re.sub(r'\s*\\n\s*', ' ', text)
-        
-        text = re.sub(r'\.{2,}', '...', text)  # ANY sequence of 2+ dots are converted to 3 dots
-        
+        if '\\n' in text:
+            text = self.NEWLINE_REGEX.sub(' ', text)
+
         # Normalize multiple punctuation marks to maximum of 2 consecutive marks
-        text = re.sub(r'!{2,}', '!!', text)     # Replaces 2+ exclamation marks with 2 exclamation marks
-        text = re.sub(r'\?{2,}', '??', text)    # Replaces 2+ question marks with 2 question marks
-        text = re.sub(r'(?:(?=[!?]*\?[!?]*!|(?=[!?]*![!?]*\?))[!?]+)', '!?', text) # Replaces 2+ !? and question marks with !?
+        text = self.PUNCTUATION_RUN_REGEX.sub(self._normalize_punctuation_run, text)
 
         # Fix spacing after punctuation (excluding numbers)
-        text = re.sub(r'(?<!\d)([.!?,])(?=[^\s])', r'\1 ', text)
-        
-        # Fix specific case of wrapped text with trailing punctuation
-        text = re.sub(r'\s+([.!?,])(?=\s|$)', r'\1', text)
+        text = self.PUNCTUATION_SPACING_REGEX.sub(r'\1 ', text)
 
-        # Remove space between full stops and closing paranthesis
-        text = re.sub(r'\.\s+\)', '.)', text)
+        # Fix specific case of wrapped text with trailing punctuation, and clean up any multiple spaces
+        text = self.WHITESPACE_REGEX.sub(self._normalize_whitespace, text)
 
-        # Clean up any multiple spaces  
-        text = re.sub(r'\s+', ' ', text)
-        
-        # Restore URLs
-        for i, url in enumerate(urls):
-            text = text.replace(f'[URL_CLEANING_PLACEHOLDER_{i}]', url)
+        # Remove space between full stops and closing paranthesis
+        if ')' in text:
+            text = self.PARENTHESIS_REGEX.sub('.)', text)
 
-        # Restore emails
-        for i, email in enumerate(emails):
-            text = text.replace(f'[EMAIL_CLEANING_PLACEHOLDER_{i}]', email)
+        # Restore URLs and emails
+        if restore:
+            text = text.translate(restore)
 
         return text.strip()
     
+    def stream_process(self, records):
+        for post in records:
+            if 'content' in post and post['content']:
+                cleaned_post = post.copy()
+                cleaned_post['content'] = self.clean_text(post['content'])
+                yield cleaned_post
+
     def process(self, data):
         """
         Process list of posts by cleaning their content.
@@ -297,14 +1312,173 @@ class TextCleaner(TextProcessor):
         Returns:
             List of posts with cleaned content
         """
-        processed_data = []
-        for post in data:
-            if 'content' in post and post['content']:
-                cleaned_post = post.copy()
-                cleaned_post['content'] = self.clean_text(post['content'])
-                processed_data.append(cleaned_post)
-                
-        return processed_data
+        return list(self.stream_process(data))
+
+# Span of an identifier found by TextAnonymizer (e.g. Entity('URL', 5, 23))
+Entity = namedtuple('Entity', ['type', 'start', 'end'])
+
+class NameMatcher:
+    """
+    Case-insensitive whole-word matcher for a list of names, giving the same matches as the regex
+    (?i)\\b(?:name1|name2|...)\\b with longer names tried first.
+
+    A match can only start and end at a word boundary, so it always covers whole runs of word or non-word
+    characters. Texts are split into such runs, and each run that starts a name is extended by the
+    following runs and looked up in a set of names. Matching is linear in the length of the text and
+    independent of the number of names (multi-word names such as 'De Battista' take one lookup per run).
+    """
+
+    RUN_REGEX = re.compile(r'\w+|\W+')
+
+    # Characters matched case-insensitively by the regex engine, but not lowercased to the same character by str.lower()
+    CASE_FOLDING = str.maketrans({'İ': 'i', 'ı': 'i', 'ſ': 's'})
+
+    def __init__(self, names):
+        self.names = set()
+        self.max_runs = {} # First run of the names -> largest number of runs in a name starting with it
+
+        for name in names:
+            name = self.fold(name)
+            runs = self.RUN_REGEX.findall(name)
+            if runs:
+                self.names.add(name)
+                self.max_runs[runs[0]] = max(self.max_runs.get(runs[0], 0), len(runs))
+
+        # The equivalent regex pattern (names should be given longest first)
+        self.pattern = r'(?i)\b(?:' + '|'.join(re.escape(name) for name in names) + r')\b'
+
+    @classmethod
+    def from_state(cls, state):
+        """Recreate a NameMatcher from its attributes (as saved in a prebuilt file)."""
+        matcher = cls.__new__(cls)
+        matcher.__dict__.update(state)
+        return matcher
+
+    @classmethod
+    def fold(cls, text):
+        """Lowercase a text for matching (each character is replaced by exactly one character)."""
+        return text.translate(cls.CASE_FOLDING).lower()
+
+    def finditer(self, text):
+        """
+        Find the names in a text.
+
+        Args:
+            text: Input text string
+
+        Yields:
+            (start, end) span of each name, from left to right
+        """
+        runs = self.RUN_REGEX.findall(self.fold(text))
+        if not runs:
+            return
+
+        # Runs alternate between word and non-word characters, and the ends of the text are only
+        # word boundaries next to a word run
+        first_is_word = runs[0][0].isalnum() or runs[0][0] == '_' # Same characters as \w
+        last = len(runs) - 1
+
+        i = 0
+        position = 0
+        while i <= last:
+            run = runs[i]
+            max_runs = self.max_runs.get(run)
+            if max_runs and (i > 0 or first_is_word):
+                # Try the longest candidate first
+                for j in range(min(i + max_runs - 1, last), i - 1, -1):
+                    if j == last and ((last % 2 == 0) != first_is_word):
+                        continue
+                    candidate = ''.join(runs[i:j + 1])
+                    if candidate in self.names:
+                        end = position + len(candidate)
+                        yield position, end
+                        position = end
+                        i = j + 1
+                        break
+                else:
+                    position += len(run)
+                    i += 1
+            else:
+                position += len(run)
+                i += 1
+
+# Directory containing names.txt and surnames.txt
+DEFAULT_NAMES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'names')
+
+# Names and surnames in the list that caused false positives when filtering
+NAME_BLACKLIST = [
+    'vera', 'mara', 'beda', 'tan', 'dawn', 'fortunata', 'all', 'tipo', 'white', 'gili', 'shana', 'quick', 'bin', 'ili', 'kind', 'venera', 'madonna', 'mia', 'best', 'king', 'kind', 'din', 'gili'
+]
+
+# Prebuilt NameMatchers, saved in the names directory the first time they are built
+NAME_MATCHERS_FILENAME = 'name_matchers.pickle'
+
+# Changed whenever NameMatcher or the filtering of the name files changes, so that older prebuilt files are rebuilt
+NAME_MATCHERS_VERSION = 2
+
+def read_name_file(path):
+    """
+    Read a name file, removing duplicates, blacklisted names and names of 2 characters or fewer.
+
+    Returns:
+        List of names, longest first (e.g. 'Maria-Theresa' before 'Maria')
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        names = {line.strip() for line in f if line.strip()}
+
+    names = [name for name in names if name.lower() not in NAME_BLACKLIST and len(name) > 2]
+    names.sort(key=lambda name: (-len(name), name))
+    return names
+
+def build_name_matchers(names_dir):
+    """
+    Build the NameMatchers for the names and surnames in a directory.
+
+    Returns:
+        dict: Placeholder ('[NAME]' or '[SURNAME]') -> NameMatcher, empty if the name files cannot be loaded
+    """
+    try:
+        names = read_name_file(os.path.join(names_dir, 'names.txt'))
+        surnames = read_name_file(os.path.join(names_dir, 'surnames.txt'))
+    except Exception as e:
+        print(f"Error loading name files: {e}")
+        return {}
+
+    if not (names and surnames):
+        return {}
+    return OrderedDict([('[NAME]', NameMatcher(names)), ('[SURNAME]', NameMatcher(surnames))])
+
+def name_files_digest(names_dir):
+    """Hash of the name files (and filtering settings) that the name matchers are built from."""
+    digest = hashlib.sha256(f"{NAME_MATCHERS_VERSION} {sorted(NAME_BLACKLIST)}".encode('utf-8'))
+    for filename in ('names.txt', 'surnames.txt'):
+        with open(os.path.join(names_dir, filename), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+@lru_cache(maxsize=None)
+def _load_name_matchers(names_dir):
+    try:
+        digest = name_files_digest(names_dir)
+    except OSError as e:
+        print(f"Error loading name files: {e}")
+        return {}
+
+    path = os.path.join(names_dir, NAME_MATCHERS_FILENAME)
+    states = load_prebuilt(path, digest, lambda: {placeholder: vars(matcher) for placeholder, matcher in build_name_matchers(names_dir).items()})
+    return OrderedDict((placeholder, NameMatcher.from_state(state)) for placeholder, state in states.items())
+
+def load_name_matchers(names_dir=DEFAULT_NAMES_DIR):
+    """
+    Load the NameMatchers for a names directory, sharing one set per directory within the process.
+
+    The matchers are loaded from the prebuilt file in the directory (name_matchers.pickle) if it was built
+    from the same name files, and otherwise built and saved there for later processes.
+
+    Returns:
+        dict: Placeholder ('[NAME]' or '[SURNAME]') -> NameMatcher, empty if the name files cannot be loaded
+    """
+    return _load_name_matchers(os.path.abspath(names_dir))
 
 class TextAnonymizer(TextProcessor):
     """
@@ -319,50 +1493,124 @@ class TextAnonymizer(TextProcessor):
             ('[PHONE]', r'\+?\d{1,3}[-.\s]?\(?\d{2,4}\)?[-.\s]?\d{2,4}[-.\s]?\d{2,4}'),
             ('[USER]', r'@\w+')])
 
-    def __init__(self, input_dir, output_dir=None, names_dir='./classes/names/'):
-        super().__init__(input_dir, output_dir)
+    # Compiled URL and email patterns (also used by TextCleaner to leave URLs and emails unchanged)
+    URL_REGEX = re.compile(PATTERNS['[URL]'])
+    EMAIL_REGEX = re.compile(PATTERNS['[EMAIL]'])
 
-        # Names and surnames in the list that caused false positives when filtering
-        NAME_BLACKLIST = [
-            'vera', 'mara', 'beda', 'tan', 'dawn', 'fortunata', 'all', 'tipo', 'white', 'gili', 'shana', 'quick', 'bin', 'ili', 'kind', 'venera', 'madonna', 'mia', 'best', 'king', 'kind', 'din', 'gili'
-        ]
+    # Substrings that a text must contain for a pattern to match
+    REQUIRED_SUBSTRINGS = {'[URL]': 'http', '[EMAIL]': '@', '[USER]': '@'}
 
-        # Load names and surnames
-        try:
-            if names_dir.endswith('/'):
-                names_dir = names_dir.rstrip('/')
+    # Stands in for the identifiers already found while looking for the next pattern. Like a placeholder,
+    # it is not a word character, whitespace or part of any pattern.
+    MASK = '\x00'
 
-            with open(f'{names_dir}/names.txt', 'r', encoding='utf-8') as f:
-                names = [line.strip() for line in f if line.strip()]
-            
-            with open(f'{names_dir}/surnames.txt', 'r', encoding='utf-8') as f:
-                surnames = [line.strip() for line in f if line.strip()]
+    def __init__(self, input_dir, output_dir=None, names_dir=DEFAULT_NAMES_DIR, output_format=None):
+        super().__init__(input_dir, output_dir, output_format)
+        self.names_dir = names_dir
+        self._use_name_matchers()
 
-            # Remove duplicates
-            names = list(set(names))
-            surnames = list(set(surnames))
+    def _use_name_matchers(self):
+        # Names are matched with NameMatchers shared by all anonymizers rather than the (much slower)
+        # patterns, with the same result
+        self.name_matchers = load_name_matchers(self.names_dir)
+        for placeholder, matcher in self.name_matchers.items():
+            # Ordered to prevent partial replacements
+            self.PATTERNS[placeholder] = matcher.pattern
+
+    def configuration(self):
+        return dict(super().configuration(), names=name_files_digest(self.names_dir))
+
+    # The name matchers are shared within the process, so only the names directory is kept
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('name_matchers', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # Anonymizers unpickled from older models have no names_dir attribute (and keep using the patterns)
+        if 'names_dir' in state:
+            # The model may have been saved on another machine or run from another directory
+            if not os.path.isdir(self.names_dir):
+                self.names_dir = DEFAULT_NAMES_DIR
+            self._use_name_matchers()
+
+    def find_entities(self, text):
+        """
+        Find the identifiers in a text, with the same precedence as replacing each pattern in turn.
 
-            # Filter out unwanted names
-            names = [name for name in names if name.lower() not in NAME_BLACKLIST]
-            surnames = [surname for surname in surnames if surname.lower() not in NAME_BLACKLIST]
+        Each pattern is matched against the text with the identifiers found by the previous patterns masked
+        out, so that it finds exactly what it would find after their replacement (placeholders never match a
+        later pattern). Patterns that need a substring the text doesn't contain (e.g. '@' for emails) are skipped.
 
-            # Keep only names longer than 2 characters
-            names = [name for name in names if len(name) > 2]
-            surnames = [surname for surname in surnames if len(surname) > 2]
+        Args:
+            text: Input text string
 
-        except Exception as e:
-            print(f"Error loading name files: {e}")
-            names = []
-            surnames = []
-        
-        # Create name patterns
-        if names and surnames:
-            name_pattern = r'(?i)\b(?:' + '|'.join(re.escape(name) for name in names) + r')\b'
-            surname_pattern = r'(?i)\b(?:' + '|'.join(re.escape(surname) for surname in surnames) + r')\b'
+        Returns:
+            List of Entity(type, start, end) spans in the text (e.g. Entity('URL', 5, 23)), sorted by start
+        """
+        # Anonymizers unpickled from older models have no name_matchers attribute
+        name_matchers = getattr(self, 'name_matchers', {})
+
+        entities = []
+        masked = text
+        for placeholder, pattern in self.PATTERNS.items():
+            required = self.REQUIRED_SUBSTRINGS.get(placeholder)
+            if required and required not in text:
+                continue
+
+            if placeholder in name_matchers:
+                spans = list(name_matchers[placeholder].finditer(masked))
+            else:
+                spans = [match.span() for match in re.finditer(pattern, masked)]
+            if not spans:
+                continue
+
+            entity_type = placeholder[1:-1]
+            entities.extend(Entity(entity_type, start, end) for start, end in spans)
+
+            # Mask the identifiers found, keeping the offsets unchanged
+            pieces = []
+            last_end = 0
+            for start, end in spans:
+                pieces.append(masked[last_end:start])
+                pieces.append(self.MASK * (end - start))
+                last_end = end
+            pieces.append(masked[last_end:])
+            masked = ''.join(pieces)
+
+        entities.sort(key=lambda entity: entity.start)
+        return entities
+
+    def anonymize_with_spans(self, text):
+        """
+        Anonymize a single text string, also returning where the placeholders are.
 
-            # Ordered to prevent partial replacements
-            self.PATTERNS['[NAME]'] = name_pattern
-            self.PATTERNS['[SURNAME]'] = surname_pattern
+        Args:
+            text: Input text string
+
+        Returns:
+            Anonymized text string, and list of Entity(type, start, end) spans of its placeholders
+        """
+        if not isinstance(text, str) or not text:
+            return text, []
+
+        pieces = []
+        placeholders = []
+        position = 0
+        last_end = 0
+        for entity_type, start, end in self.find_entities(text):
+            piece = text[last_end:start]
+            placeholder = f"[{entity_type}]"
+            pieces.append(piece)
+            pieces.append(placeholder)
+            position += len(piece)
+            placeholders.append(Entity(entity_type, position, position + len(placeholder)))
+            position += len(placeholder)
+            last_end = end
+        pieces.append(text[last_end:])
+
+        return ''.join(pieces), placeholders
 
     def anonymize_text(self, text):
         """
@@ -374,14 +1622,15 @@ class TextAnonymizer(TextProcessor):
         Returns:
             Cleaned text string
         """
-        if not isinstance(text, str) or not text:
-            return text
-        
-        for replacement, pattern in self.PATTERNS.items():
-            text = re.sub(pattern, replacement, text)
-        
-        return text
+        return self.anonymize_with_spans(text)[0]
     
+    def stream_process(self, records):
+        for post in records:
+            if 'content' in post and post['content']:
+                anonymized_post = post.copy()
+                anonymized_post['content'] = self.anonymize_text(post['content'])
+                yield anonymized_post
+
     def process(self, data):
         """
         Process list of posts by anonymizing their content.
@@ -392,14 +1641,7 @@ class TextAnonymizer(TextProcessor):
         Returns:
             List of posts with anonymized content
         """
-        processed_data = []
-        for post in data:
-            if 'content' in post and post['content']:
-                anonymized_post = post.copy()
-                anonymized_post['content'] = self.anonymize_text(post['content'])
-                processed_data.append(anonymized_post)
-                
-        return processed_data
+        return list(self.stream_process(data))
 
 class JsonCombiner:
     def __init__(self, input_dir, output_dir=None, output_file="combined_data.json"):
@@ -407,6 +1649,7 @@ class JsonCombiner:
         self.output_dir = output_dir or input_dir
         self.output_file = output_file
         self.content_hash_set = set()  # Track unique content hashes
+        self.stats = StageStats(type(self).__name__)
 
     def _normalize_content(self, content):
         """Normalize content for comparison by removing extra whitespace and converting to lowercase"""
@@ -417,44 +1660,379 @@ class JsonCombiner:
         normalized = self._normalize_content(content)
         return hash(normalized)
 
-    def process_directory(self):
+    def _stage_files(self):
+        """List the json and jsonl files in the input directory (sorted, so entries are numbered in the same order on every run)."""
+        return sorted(chain(Path(self.input_dir).glob("*.json"), Path(self.input_dir).glob("*.jsonl")))
+
+    def combine(self, groups, start_id=0):
+        """
+        Combine the posts of several groups, skipping posts whose content has already been seen.
+
+        Args:
+            groups: Iterable of (group_name, posts) pairs
+            start_id: Number of the first entry
+
+        Yields:
+            {'id', 'source', 'content'} entries, numbered from start_id
+        """
+        sentence_id = start_id
+        for group_name, data in groups:
+            for item in data:
+                content = item['content']
+                content_hash = self._hash_content(content)
+                
+                # Only add if content is unique
+                if content_hash not in self.content_hash_set:
+                    yield {
+                        'id': sentence_id,
+                        'source': group_name,
+                        'content': content
+                    }
+                    self.content_hash_set.add(content_hash)
+                    sentence_id += 1
+
+    def _keep(self, items):
+        """Pass on the entries kept from the combined file, marking their contents as seen."""
+        for item in items:
+            self.content_hash_set.add(self._hash_content(item['content']))
+            yield item
+
+    def _recorded_shards(self, output_path):
+        """Shards recorded in the manifest when the combined file was saved (none if it no longer exists)."""
+        recorded = StageManifest(self.output_dir).get(output_path)
+        if recorded is None or recorded.get('code') != code_digest() or not os.path.exists(output_path):
+            return []
+        return recorded['shards']
+
+    def reusable_shards(self, shards):
+        """
+        Count the leading shards whose entries in the combined file can be kept as they are: those which
+        are unchanged, and only come after unchanged shards (whose entries determine which of their posts
+        are duplicates, and how their entries are numbered).
+
+        Args:
+            shards: (group_name, entry) pairs for each group to combine, in order, where entry describes
+                how its posts were produced (see StageManifest.entry)
+
+        Returns:
+            Number of shards that don't have to be merged again
+        """
+        recorded = self._recorded_shards(str(Path(self.output_dir) / self.output_file))
+        count = 0
+        for (group_name, entry), recorded_shard in zip(shards, recorded):
+            if recorded_shard['group'] != group_name or any(recorded_shard.get(key) != value for key, value in entry.items()):
+                break
+            count += 1
+        return count
+
+    def is_up_to_date(self, shards):
+        """Whether the combined file was saved from exactly these shards (see reusable_shards)."""
+        recorded = self._recorded_shards(str(Path(self.output_dir) / self.output_file))
+        return len(recorded) == len(shards) and self.reusable_shards(shards) == len(shards)
+
+    def save(self, groups, shards=None, reuse=0):
+        """
+        Combine the posts of several groups (see combine) and save them to output_file.
+
+        Args:
+            groups: Iterable of (group_name, posts) pairs for the groups after the first reuse shards
+            shards: (group_name, entry) pairs for every group (see reusable_shards), recorded in the
+                manifest (None records nothing)
+            reuse: Number of leading shards whose entries are copied from the existing combined file
+                rather than merged again (see reusable_shards)
+        """
         # Create output directory if it doesn't exist
         Path(self.output_dir).mkdir(parents=True, exist_ok=True)
-        
-        combined_data = []
-        sentence_id = 0
-        
-        # Process all json files
-        for file_path in Path(self.input_dir).glob("*.json"):
-            group_name = file_path.stem  # Get filename without extension
-            
-            # Read and process file
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                for item in data:
-                    content = item['content']
-                    content_hash = self._hash_content(content)
-                    
-                    # Only add if content is unique
-                    if content_hash not in self.content_hash_set:
-                        combined_data.append({
-                            'id': sentence_id,
-                            'source': group_name,
-                            'content': content
-                        })
-                        self.content_hash_set.add(content_hash)
-                        sentence_id += 1
+
+        # Save combined data (as JSON Lines if output_file ends with .jsonl)
+        output_path = str(Path(self.output_dir) / self.output_file)
+        counts = [shard['posts'] for shard in self._recorded_shards(output_path)[:reuse]]
+        with StageFileWriter(output_path) as writer:
+            if counts:
+                self.stats.bytes_read += os.path.getsize(output_path)
+                kept = read_stage_file(output_path)
+                try:
+                    combined = self.stats.measure(islice(kept, sum(counts)), self._keep)
+                    for item in combined:
+                        writer.write(item)
+                finally:
+                    kept.close()
+
+            for group_name, data in groups:
+                start_id = writer.count
+                combined = self.stats.measure(data, lambda posts: self.combine([(group_name, posts)], start_id))
+                for item in combined:
+                    writer.write(item)
+                counts.append(writer.count - start_id)
+        if writer.count:
+            self.stats.bytes_written += os.path.getsize(output_path)
+
+        if shards is not None:
+            entry = {'shards': [dict(entry, group=group_name, posts=count) for (group_name, entry), count in zip(shards, counts)], 'code': code_digest()}
+            StageManifest(self.output_dir).record(output_path, entry, writer.count)
         
         # Log duplicate stats
-        print(f"Saved {len(combined_data)} unique entries.")
-        
-        # Save combined data
-        output_path = Path(self.output_dir) / self.output_file
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(combined_data, f, indent=4, ensure_ascii=False)
+        if reuse:
+            print(f"Saved {writer.count} unique entries ({sum(counts[:reuse])} kept from {reuse} unchanged groups).")
+        else:
+            print(f"Saved {writer.count} unique entries.")
+
+    def process_directory(self, incremental=True):
+        """
+        Combine all json and jsonl files (named after their group).
+
+        Args:
+            incremental: Only merge the files that are new or changed since the combined file was saved
+                (and those after them, see reusable_shards)
+        """
+        file_paths = self._stage_files()
+        shards = [(file_path.stem, StageManifest.entry(file_digest(file_path), {})) for file_path in file_paths]
+        if incremental and self.is_up_to_date(shards):
+            print(f"Skipped {self.output_file} (unchanged)")
+        else:
+            reuse = self.reusable_shards(shards) if incremental else 0
+            self.stats.bytes_read += sum(os.path.getsize(file_path) for file_path in file_paths[reuse:])
+            self.save(((file_path.stem, read_stage_file(str(file_path))) for file_path in file_paths[reuse:]), shards, reuse)
         
         # Clean up original files if output is same as input 
         if self.output_dir == self.input_dir:
-            for file_path in Path(self.input_dir).glob("*.json"):
+            for file_path in self._stage_files():
                 if file_path.name != self.output_file:
                     file_path.unlink()
+
+class Pipeline:
+    """
+    Runs several processors over each input file in a single pass, passing the posts from one processor
+    to the next in memory instead of saving and reloading every stage.
+
+    e.g. Pipeline([cleaner, anonymizer, sentence_splitter, language_filter], combiner).run() reads each raw
+    file once and saves only the combined data.
+    """
+    def __init__(self, processors, combiner=None, input_dir=None, output_dir=None, output_format=None, checkpoints=()):
+        """
+        Args:
+            processors: TextProcessors to run, in order
+            combiner: JsonCombiner to combine the output of every file with (None saves a file per input file)
+            input_dir: Directory of the files to process (by default that of the first processor)
+            output_dir: Directory to save a file per input file to when there is no combiner (by default
+                that of the last processor)
+            output_format: Format of the files saved per input file (by default that of the last processor)
+            checkpoints: Processors whose output is also saved to their own output directory (e.g. for
+                debugging), as process_directory would save it
+        """
+        self.processors = list(processors)
+        self.combiner = combiner
+        self.input_dir = input_dir or self.processors[0].input_dir
+        self.output_dir = output_dir or self.processors[-1].output_dir
+        self.output_format = output_format or self.processors[-1].output_format
+        self.checkpoints = list(checkpoints)
+        # Measurements of the last run (see report)
+        self.run_info = {}
+
+    def __getstate__(self):
+        # Worker processes only run the processors (see process_chunk)
+        return dict(vars(self), combiner=None)
+
+    def _output_path(self, output_dir, output_format, file_path):
+        output_path = os.path.join(output_dir, os.path.basename(file_path))
+        return stage_file_path(output_path, output_format) if output_format else output_path
+
+    def _is_checkpoint(self, processor):
+        return any(processor is checkpoint for checkpoint in self.checkpoints)
+
+    def _checkpoint_path(self, processor, file_path):
+        os.makedirs(processor.output_dir, exist_ok=True)
+        return self._output_path(processor.output_dir, processor.output_format, file_path)
+
+    def configuration(self, count=None):
+        """Configurations of the first count processors (all of them by default), see TextProcessor.configuration."""
+        return [processor.configuration() for processor in self.processors[:count]]
+
+    def _checkpoint(self, records, processor, output_path, manifest, entry):
+        """Pass posts through, saving them to output_path once all of them have passed."""
+        with StageFileWriter(output_path) as writer:
+            for record in records:
+                writer.write(record)
+                yield record
+        manifest.record(output_path, entry, writer.count)
+        self._saved_checkpoint(processor, writer)
+
+    def _saved_checkpoint(self, processor, writer):
+        if writer.count:
+            processor.stats.bytes_written += os.path.getsize(writer.path)
+        print(f"Saved {writer.count} posts to {writer.path}")
+
+    def _start(self, file_path, input_digest, manifests):
+        """
+        Find the last checkpoint whose output was saved from the same input file, with the same
+        configuration and code, which processing can start from.
+
+        Returns:
+            (path of the file to read the posts from, index of the first processor to run)
+        """
+        for index in sorted(manifests, reverse=True):
+            output_path = self._checkpoint_path(self.processors[index], file_path)
+            entry = StageManifest.entry(input_digest, self.configuration(index + 1))
+            if manifests[index].is_current(output_path, entry) and os.path.exists(output_path):
+                return output_path, index + 1
+        return file_path, 0
+
+    def stream_file(self, file_path):
+        """
+        Run every processor over the posts of a stage file.
+
+        Yields:
+            The posts output by the last processor
+        """
+        return self._stream_file(file_path, file_digest(file_path), file_path, 0, self._manifests())
+
+    def _manifests(self):
+        """Manifests of the checkpoint processors' output directories, keyed by the index of the processor."""
+        return {index: StageManifest(processor.output_dir) for index, processor in enumerate(self.processors) if self._is_checkpoint(processor)}
+
+    def _stream_file(self, file_path, input_digest, source_path, start, manifests):
+        records = read_stage_file(source_path)
+        for index in range(start, len(self.processors)):
+            processor = self.processors[index]
+            records = processor.stats.measure(records, processor.stream_process)
+            if index in manifests:
+                entry = StageManifest.entry(input_digest, self.configuration(index + 1))
+                records = self._checkpoint(records, processor, self._checkpoint_path(processor, file_path), manifests[index], entry)
+        return records
+
+    def process_chunk(self, records, start=0):
+        """
+        Run the processors from the start-th one over a chunk of posts in a worker process (see map_file_chunks).
+
+        Returns:
+            (posts output by the last processor, posts output by each checkpoint processor that was run,
+            (counts, stats) of each processor that was run (see TextProcessor.process_chunk))
+        """
+        checkpoint_records = []
+        measurements = []
+        for processor in self.processors[start:]:
+            records, counts, stats = processor.process_chunk(records)
+            measurements.append((counts, stats))
+            if self._is_checkpoint(processor):
+                checkpoint_records.append(records)
+        return records, checkpoint_records, measurements
+
+    def _merge_chunks(self, file_path, input_digest, start, results, manifests):
+        """Pass on the posts processed by the worker processes, saving the output of the checkpoint processors."""
+        indices = [index for index in sorted(manifests) if index >= start]
+        writers = [StageFileWriter(self._checkpoint_path(self.processors[index], file_path)) for index in indices]
+        try:
+            for records, checkpoint_records, measurements in results:
+                for processor, (counts, stats) in zip(self.processors[start:], measurements):
+                    processor.merge_chunk(counts, stats)
+                for writer, chunk in zip(writers, checkpoint_records):
+                    for record in chunk:
+                        writer.write(record)
+                yield from records
+        except BaseException:
+            for writer in writers:
+                writer.discard()
+            raise
+
+        for index, writer in zip(indices, writers):
+            manifests[index].record(writer.path, StageManifest.entry(input_digest, self.configuration(index + 1)), writer.close())
+            self._saved_checkpoint(self.processors[index], writer)
+
+    def input_files(self):
+        """List the paths of the files to process, in order."""
+        return [os.path.join(self.input_dir, filename) for filename in sorted(os.listdir(self.input_dir)) if stage_file_format(filename)]
+
+    def run(self, workers=1, incremental=True):
+        """
+        Process every input file, saving the combined data or a file per input file, and measure the run
+        (see report).
+
+        Args:
+            workers: Number of worker processes to run the processors in (each file is split into chunks
+                of TextProcessor.CHUNK_SIZE posts, and the output is saved in the same order as by a single
+                process)
+            incremental: Skip the work whose result was already saved from the same input files, with the
+                same configuration and code: files are processed from the output of their last up to date
+                checkpoint, and the combiner only merges new or changed files (see
+                JsonCombiner.reusable_shards). Without a combiner, files whose output is up to date are skipped.
+        """
+        stages = self.processors + ([self.combiner] if self.combiner else [])
+        for stage in stages:
+            stage.stats = StageStats(stage.stats.name)
+
+        started = datetime.now(timezone.utc)
+        start, cpu_start, children_start = time.perf_counter(), time.process_time(), os.times()
+        self._run(workers, incremental)
+        children_end = os.times()
+        self.run_info = {
+            'started': started.isoformat(),
+            'workers': workers,
+            'incremental': incremental,
+            # Whether the stages' peak memory was measured (see StageStats)
+            'trace_memory': tracemalloc.is_tracing(),
+            'wall_time': time.perf_counter() - start,
+            # Including the worker processes
+            'cpu_time': time.process_time() - cpu_start + (children_end.children_user - children_start.children_user)
+                        + (children_end.children_system - children_start.children_system),
+            'max_rss': max_rss(),
+            'max_rss_workers': max_rss('children') if workers > 1 else None,
+        }
+
+    def report(self):
+        """
+        Report of the last run: its time, CPU time (including the worker processes) and peak memory, and the
+        measurements of each stage (see StageStats), as a JSON-serializable dictionary.
+        """
+        stages = self.processors + ([self.combiner] if self.combiner else [])
+        return dict(self.run_info, stages=[stage.stats.to_dict() for stage in stages])
+
+    def _run(self, workers, incremental):
+        manifests = self._manifests()
+        file_paths = self.input_files()
+        digests = [file_digest(file_path) for file_path in file_paths]
+        entries = [StageManifest.entry(digest, self.configuration()) for digest in digests]
+
+        # Files to process, from the first one that isn't up to date
+        if self.combiner:
+            shards = [(Path(file_path).stem, entry) for file_path, entry in zip(file_paths, entries)]
+            if incremental and self.combiner.is_up_to_date(shards):
+                print(f"Skipped {self.combiner.output_file} (unchanged)")
+                return
+            reuse = self.combiner.reusable_shards(shards) if incremental else 0
+            selected = list(range(reuse, len(file_paths)))
+        else:
+            os.makedirs(self.output_dir, exist_ok=True)
+            output_manifest = StageManifest(self.output_dir)
+            selected = []
+            for index, file_path in enumerate(file_paths):
+                if incremental and output_manifest.is_current(self._output_path(self.output_dir, self.output_format, file_path), entries[index]):
+                    print(f"Skipped {file_path} (unchanged)")
+                else:
+                    selected.append(index)
+
+        starts = [self._start(file_paths[index], digests[index], manifests) if incremental else (file_paths[index], 0) for index in selected]
+        for source_path, start in starts:
+            if start < len(self.processors):
+                self.processors[start].stats.bytes_read += os.path.getsize(source_path)
+        if workers > 1:
+            results = map_file_chunks(self, [source_path for source_path, _ in starts], workers, TextProcessor.CHUNK_SIZE, [(start,) for _, start in starts])
+            files = ((index, self._merge_chunks(file_paths[index], digests[index], start, file_results, manifests))
+                     for index, (_, start), (_, file_results) in zip(selected, starts, results))
+        else:
+            files = ((index, self._stream_file(file_paths[index], digests[index], source_path, start, manifests))
+                     for index, (source_path, start) in zip(selected, starts))
+
+        if self.combiner:
+            self.combiner.save(((Path(file_paths[index]).stem, records) for index, records in files), shards, reuse)
+            return
+
+        for index, records in files:
+            file_path = file_paths[index]
+            output_path = self._output_path(self.output_dir, self.output_format, file_path)
+            count = write_stage_file(output_path, records)
+            output_manifest.record(output_path, entries[index], count)
+            if count:
+                self.processors[-1].stats.bytes_written += os.path.getsize(output_path)
+                print(f"Processed {file_path} and saved to {output_path}")
+            else:
+                print(f"No valid data in {file_path}")
@@ -17,6 +17,35 @@ DATA_DIRECTORIES = {
     "final": os.path.join(DATA_DIR, "06_final"), # Final dataset ready for use
 }
 
+# Format of the files saved by the preprocessing stages: "json" (JSON arrays) or "jsonl" (JSON Lines, one
+# post per line, which are read and written a few posts at a time). Existing stage files can be converted
+# from one to the other with convert_stages.py.
+STAGE_FORMAT = "json"
+
+# Stages whose output is also saved to their data directory (e.g. ["sentences", "maltese"], for debugging
+# or as checkpoints). The pipeline otherwise passes the posts from one stage to the next in memory, and
+# only saves the final dataset. Later runs only process the raw files that are new or changed since their
+# checkpoints were saved (and read the others from their last checkpoint), so saving the last stage lets
+# a run after scraping a new group only process that group.
+CHECKPOINT_STAGES = ["maltese"]
+
+# Number of worker processes the preprocessing stages run in (1 runs them in the main process)
+PIPELINE_WORKERS = os.cpu_count() or 1
+
+# Directory the report of each pipeline run (time, memory and posts of each stage) is saved to, as
+# run_<start time>.json
+RUN_REPORT_DIR = os.path.join(BASE_DIR, "run_reports")
+
+# Whether to trace memory allocations during the run, so that the report includes the peak memory of each
+# stage (otherwise only the peak memory of the whole process is reported). Tracing makes the pipeline
+# about 4 times slower, so it is off by default.
+TRACE_MEMORY = False
+
+# Whether MalteseFilter decides the clear cases (e.g. text with ċ, ġ, ħ or ż, or Maltese function words)
+# from their spelling and words before using langid, which drops a lot of Maltese written without Maltese
+# letters as confident English
+MALTESE_PRE_CLASSIFY = True
+
 # Ensure directories exist
 for directory in DATA_DIRECTORIES.values():
     os.makedirs(directory, exist_ok=True)
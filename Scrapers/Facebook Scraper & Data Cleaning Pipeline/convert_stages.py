@@ -0,0 +1,29 @@
+"""
+Converts the stage files in data/ between JSON arrays (.json) and JSON Lines (.jsonl), replacing the
+original files.
+
+Usage:
+    python convert_stages.py jsonl
+    python convert_stages.py json --stages cleaned anonymized
+"""
+import argparse
+
+from classes.cleaning import STAGE_FORMATS, convert_stage_directory
+from config import DATA_DIRECTORIES as DIRS
+
+
+# Stages whose files are converted (the raw files are kept as the scrapers saved them, and the final
+# combined file is named by JsonCombiner)
+STAGES = ["cleaned", "anonymized", "sentences", "maltese"]
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert the pipeline's stage files between JSON arrays and JSON Lines.")
+    parser.add_argument('format', choices=list(STAGE_FORMATS), help="Format to convert the stage files to")
+    parser.add_argument('--stages', nargs='*', choices=[stage for stage in DIRS if stage != "root"], default=STAGES, help="Stages to convert")
+    args = parser.parse_args()
+
+    for stage in args.stages:
+        convert_stage_directory(DIRS[stage], args.format)
+
+if __name__ == '__main__':
+    main()
@@ -1,23 +1,39 @@
+import tracemalloc
+
 from classes.scraper import FacebookScraper
-from classes.cleaning import TextCleaner, TextAnonymizer, MalteseFilter, SentenceSplitter, JsonCombiner
+from classes.cleaning import TextCleaner, TextAnonymizer, MalteseFilter, SentenceSplitter, JsonCombiner, Pipeline
+from classes.cleaning import save_run_report, format_run_report
 from config import DATA_DIRECTORIES as DIRS
-from config import FACEBOOK_GROUPS, POST_LIMIT_PER_GROUP
+from config import FACEBOOK_GROUPS, POST_LIMIT_PER_GROUP, STAGE_FORMAT, CHECKPOINT_STAGES, PIPELINE_WORKERS, RUN_REPORT_DIR, TRACE_MEMORY
+from config import MALTESE_PRE_CLASSIFY
 
-for group in FACEBOOK_GROUPS:
-    scraper = FacebookScraper(group_url=group, num_posts=POST_LIMIT_PER_GROUP, debug=True, output_dir=DIRS["raw"])
-    scraper.scrape()
 
-cleaner = TextCleaner(DIRS["raw"], DIRS["cleaned"])
-cleaner.process_directory()
+def main():
+    for group in FACEBOOK_GROUPS:
+        scraper = FacebookScraper(group_url=group, num_posts=POST_LIMIT_PER_GROUP, debug=True, output_dir=DIRS["raw"])
+        scraper.scrape()
 
-anonymizer = TextAnonymizer(DIRS["cleaned"], DIRS["anonymized"])
-anonymizer.process_directory()
+    # Processors for each stage, keyed by the data directory they save to
+    stages = {
+        "cleaned": TextCleaner(DIRS["raw"], DIRS["cleaned"], output_format=STAGE_FORMAT),
+        "anonymized": TextAnonymizer(DIRS["cleaned"], DIRS["anonymized"], output_format=STAGE_FORMAT),
+        "sentences": SentenceSplitter(DIRS["anonymized"], DIRS["sentences"], output_format=STAGE_FORMAT),
+        "maltese": MalteseFilter(DIRS["sentences"], DIRS["maltese"], pre_classify=MALTESE_PRE_CLASSIFY, output_format=STAGE_FORMAT),
+    }
+    combiner = JsonCombiner(DIRS["maltese"], DIRS["final"], output_file="combined_data.json")
 
-sentence_splitter = SentenceSplitter(DIRS["anonymized"], DIRS["sentences"])
-sentence_splitter.process_directory()
+    # Run every stage over each raw file in a single pass, saving only the checkpoint stages and the final
+    # dataset (and skipping the files that haven't changed since the last run)
+    pipeline = Pipeline(stages.values(), combiner, checkpoints=[stages[stage] for stage in CHECKPOINT_STAGES])
+    if TRACE_MEMORY:
+        tracemalloc.start()
+    pipeline.run(workers=PIPELINE_WORKERS)
+    tracemalloc.stop()
 
-language_filter = MalteseFilter(DIRS["sentences"], DIRS["maltese"])
-language_filter.process_directory()
+    report = pipeline.report()
+    print(format_run_report(report))
+    print(f"Saved run report to {save_run_report(report, RUN_REPORT_DIR)}")
 
-combiner = JsonCombiner(DIRS["maltese"], DIRS["final"], output_file="combined_data.json")
-combiner.process_directory()
\ No newline at end of file
+# The worker processes import this module, so the pipeline must only run when it is executed directly
+if __name__ == '__main__':
+    main()
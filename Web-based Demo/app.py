@@ -49,7 +49,8 @@ def analyze():
                 tokens = preprocessor.tokenise(sentence)
                 tokens = preprocessor.clean_tokens(tokens)
                 tokens = preprocessor.selective_lowercase(tokens)
-                tokens = [preprocessor.get_lemma(token) for token in tokens]
+                lemmas = preprocessor.resolve_tokens(tokens, normalize=False)
+                tokens = [lemmas[token] for token in tokens]
                 processed_text = " ".join(tokens)
 
                 X_input = random_forest_vectorizer.transform([processed_text])